@@ -5,4 +5,7 @@ from django.apps import AppConfig
 
 class BomConfig(AppConfig):
     name = 'bom'
-    mouser_api_key = None
\ No newline at end of file
+    mouser_api_key = None
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,187 @@
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from functools import lru_cache
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q, Value
+from django.db.models.functions import Coalesce, Concat
+
+from .constants import AUTOCOMPLETE_KINDS, AUTOCOMPLETE_MANUFACTURERS, AUTOCOMPLETE_OPTIONS_PART_CLASSES, NUMBER_SCHEME_SEMI_INTELLIGENT
+from .models import Manufacturer, ManufacturerPart, Part, PartClass, PartRevision
+
+
+# How long a replaced index stays in the cache, for the processes still looking up the version before
+AUTOCOMPLETE_REPLACED_TIMEOUT = 60
+
+
+class PrefixIndex:
+    """
+    Autocomplete suggestions sorted by their lower cased text, so that the ones starting with a prefix are next to each
+    other: a lookup is a bisect to the first of them and a slice of at most limit suggestions. The suggestions of each
+    source, a part or a manufacturer, are kept with a count of the sources of each suggestion, so that a changed
+    source is updated in place.
+    """
+    __slots__ = ('entries', 'counts', 'sources')
+
+    def __init__(self, sources):
+        self.sources = {key: suggestions for key, suggestions in sources.items() if suggestions}
+        self.counts = Counter(suggestion for suggestions in self.sources.values() for suggestion in suggestions)
+        self.entries = sorted((suggestion.lower(), suggestion) for suggestion in self.counts)
+
+    def update(self, sources):
+        # sources are the suggestions of each changed source, none for one that is gone
+        for key, suggestions in sources.items():
+            for suggestion in self.sources.pop(key, []):
+                self.counts[suggestion] -= 1
+                if not self.counts[suggestion]:
+                    del self.counts[suggestion]
+                    del self.entries[bisect_left(self.entries, (suggestion.lower(), suggestion))]
+            for suggestion in suggestions:
+                self.counts[suggestion] += 1
+                if self.counts[suggestion] == 1:
+                    insort(self.entries, (suggestion.lower(), suggestion))
+            if suggestions:
+                self.sources[key] = suggestions
+
+    def lookup(self, prefix, limit):
+        prefix = prefix.lower()
+        start = bisect_left(self.entries, (prefix,))
+        end = start
+        while end < len(self.entries) and end - start < limit and self.entries[end][0].startswith(prefix):
+            end += 1
+        return [suggestion for _, suggestion in self.entries[start:end]]
+
+
+def autocomplete_sources(organization_id, kind, part_ids=None, manufacturer_ids=None):
+    # The text a search of kind can be completed to by source: the name of each manufacturer, and for parts the part
+    # number, the synopsis of the latest part revision and the manufacturer part numbers of each part too. Only the
+    # sources in part_ids and manufacturer_ids are loaded when they are given. Double quotes are taken out, a chosen
+    # suggestion is searched for as a quoted phrase.
+    sources = defaultdict(list)
+    manufacturers = Manufacturer.objects.filter(organization_id=organization_id)
+    if manufacturer_ids is not None:
+        manufacturers = manufacturers.filter(id__in=manufacturer_ids)
+    for manufacturer_id, name in manufacturers.values_list('id', 'name'):
+        sources[('manufacturer', manufacturer_id)].append(name)
+
+    if kind != AUTOCOMPLETE_MANUFACTURERS:
+        parts = Part.objects.filter(organization_id=organization_id)
+        if part_ids is not None:
+            parts = parts.filter(id__in=part_ids)
+        for part in parts.select_related('organization', 'number_class'):
+            sources[('part', part.id)].append(part.full_part_number())
+        latest_synopses = dict(PartRevision.objects.filter(part__in=parts).order_by('id').values_list('part_id', 'searchable_synopsis'))
+        for part_id, synopsis in latest_synopses.items():
+            sources[('part', part_id)].append(synopsis)
+        for part_id, manufacturer_part_number in ManufacturerPart.objects.filter(part__in=parts).values_list('part_id', 'manufacturer_part_number'):
+            sources[('part', part_id)].append(manufacturer_part_number)
+
+    cleaned = {key: [(suggestion or '').replace('"', '').strip() for suggestion in suggestions] for key, suggestions in sources.items()}
+    return {key: [suggestion for suggestion in suggestions if suggestion] for key, suggestions in cleaned.items()}
+
+
+def autocomplete_version_key(organization_id):
+    return f'autocomplete_version_{organization_id}'
+
+
+def autocomplete_index_key(organization_id, kind, version):
+    return f'autocomplete_{kind}_{organization_id}_{version}'
+
+
+def invalidate_autocomplete(organization_ids):
+    # For changes that touch every suggestion, such as a new number scheme, the next lookup builds the index again
+    cache.delete_many([autocomplete_version_key(organization_id) for organization_id in set(organization_ids)])
+
+
+def update_autocomplete(organization_id, part_ids=(), manufacturer_ids=()):
+    # Once the transaction commits, moves the organization's cached indexes to a new version with the suggestions of
+    # part_ids and manufacturer_ids as they are then, rather than have the next lookup build them from every part
+    transaction.on_commit(lambda: update_autocomplete_indexes(organization_id, list(part_ids), list(manufacturer_ids)))
+
+
+def update_autocomplete_indexes(organization_id, part_ids, manufacturer_ids):
+    version_key = autocomplete_version_key(organization_id)
+    version = cache.get(version_key)
+    if version is None:
+        return  # Nothing is cached, the next lookup builds the indexes
+    new_version = uuid4().hex
+    for kind in AUTOCOMPLETE_KINDS:
+        index_key = autocomplete_index_key(organization_id, kind, version)
+        index = cache.get(index_key)
+        if index is None:
+            continue
+        changed = {('part', part_id): [] for part_id in part_ids if kind != AUTOCOMPLETE_MANUFACTURERS}
+        changed.update({('manufacturer', manufacturer_id): [] for manufacturer_id in manufacturer_ids})
+        if changed:
+            changed.update(autocomplete_sources(organization_id, kind, part_ids, manufacturer_ids))
+            index.update(changed)
+        cache.set(autocomplete_index_key(organization_id, kind, new_version), index, timeout=settings.BOM_CONFIG.get('bom_cache_timeout', None))
+        cache.touch(index_key, AUTOCOMPLETE_REPLACED_TIMEOUT)
+    cache.set(version_key, new_version, timeout=None)
+
+
+@lru_cache(maxsize=32)
+def cached_prefix_index(organization_id, kind, version):
+    # Kept in this process for as long as its version is current, and in the cache for the other processes
+    index_key = autocomplete_index_key(organization_id, kind, version)
+    index = cache.get(index_key)
+    if index is None:
+        index = PrefixIndex(autocomplete_sources(organization_id, kind))
+        cache.set(index_key, index, timeout=settings.BOM_CONFIG.get('bom_cache_timeout', None))
+    return index
+
+
+def autocomplete(organization, kind, prefix, limit):
+    """
+    At most limit suggestions of kind for the organization that start with prefix, ignoring case. The index behind
+    them is built once and then kept current: a change to a part, part revision, manufacturer part or manufacturer of
+    the organization updates it in place, a change to the organization or its part classes has it built again.
+    """
+    version_key = autocomplete_version_key(organization.id)
+    version = cache.get(version_key)
+    if version is None:
+        version = uuid4().hex
+        cache.set(version_key, version, timeout=None)
+    return cached_prefix_index(organization.id, kind, version).lookup(prefix, limit)
+
+
+def full_part_number_expression(organization):
+    # Part.full_part_number as a database expression, to filter on
+    if organization.number_scheme != NUMBER_SCHEME_SEMI_INTELLIGENT:
+        return Coalesce('number_item', Value(''))
+    if organization.number_variation_len > 0:
+        return Concat('number_class__code', Value('-'), 'number_item', Value('-'), Coalesce('number_variation', Value('')))
+    return Concat('number_class__code', Value('-'), 'number_item')
+
+
+def part_options(organization, query, exclude_ids, offset, limit):
+    # One page of the parts of the organization whose part number or latest description contains query, labelled
+    # with Part.verbose_str, in part number order
+    parts = Part.objects.filter(organization=organization).exclude(id__in=exclude_ids).annotate(full_number=full_part_number_expression(organization))
+    if query:
+        parts = parts.filter(Q(full_number__icontains=query) | Q(id__in=PartRevision.objects.filter(
+            part__organization=organization, description__icontains=query).values('part_id')))
+    parts = list(parts.select_related('organization', 'number_class').order_by('number_class__code', 'number_item', 'number_variation', 'id')[offset:offset + limit + 1])
+    descriptions = dict(PartRevision.objects.filter(part__in=parts[:limit]).order_by('id').values_list('part_id', 'description'))
+    return [{'label': part.verbose_str(descriptions.get(part.id) or ''), 'value': str(part)} for part in parts[:limit]], len(parts) > limit
+
+
+def part_class_options(organization, query, exclude_ids, offset, limit):
+    part_classes = PartClass.objects.filter(organization=organization).exclude(id__in=exclude_ids)
+    if query:
+        part_classes = part_classes.filter(Q(code__icontains=query) | Q(name__icontains=query))
+    part_classes = list(part_classes.order_by('code', 'id')[offset:offset + limit + 1])
+    return [{'label': str(part_class), 'value': str(part_class)} for part_class in part_classes[:limit]], len(part_classes) > limit
+
+
+def autocomplete_options(organization, source, query, exclude_ids=(), offset=0, limit=10):
+    """
+    The options of an AutocompleteTextInput: a page of at most limit objects of source within the organization that
+    match query, from offset on, each with the label shown in the dropdown and the value it fills in, and whether
+    there are more after them.
+    """
+    options = part_class_options if source == AUTOCOMPLETE_OPTIONS_PART_CLASSES else part_options
+    return options(organization, query, exclude_ids, offset, limit)
@@ -0,0 +1,69 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .explosion import PART_REVISION_RELATED, bom_explosion_backend, bom_tree
+from .models import PartRevision, PartRevisionClosure, SellerPart
+
+
+# Bumped by edits that can show up in any BOM of any organization, such as renaming a seller or manufacturer
+BOM_CACHE_GENERATION_KEY = 'bom_cache_generation'
+
+
+def bom_cache_version_key(part_revision_id):
+    return f'bom_cache_version_{part_revision_id}'
+
+
+def bom_cache_versions(part_revision_id):
+    # Versions are random tokens rather than counters, so a missing or evicted one simply becomes a new version
+    keys = [BOM_CACHE_GENERATION_KEY, bom_cache_version_key(part_revision_id)]
+    versions = cache.get_many(keys)
+    missing = {key: uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def delete_versions(keys):
+    # Right away, for reads later in the same transaction, and again once it is committed: until then other connections
+    # still read the old BOM, and could have cached it under the new version
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def exploded_bom(part_revision):
+    """
+    The lines of bom_tree(part_revision) and the seller parts of every part in them, by part id. Neither depends on
+    the top level quantity, so they are cached together under the current version of the part revision, and a
+    repeat explosion doesn't go to the database at all.
+    """
+    if not settings.BOM_CONFIG.get('bom_cache', False):
+        lines = list(bom_tree(part_revision).lines())
+        return lines, SellerPart.by_part({line.part_revision.part_id for line in lines})
+
+    generation, version = bom_cache_versions(part_revision.id)
+    cache_key = f'bom_cache_{bom_explosion_backend()}_{part_revision.id}_{generation}_{version}'
+    exploded = cache.get(cache_key)
+    if exploded is None:
+        # Cache the part revision with everything a BOM shows about it, so that a hit has no lazy loads left to do
+        part_revision = PartRevision.objects.select_related(*PART_REVISION_RELATED).get(id=part_revision.id)
+        lines = list(bom_tree(part_revision).lines())
+        exploded = lines, SellerPart.by_part({line.part_revision.part_id for line in lines})
+        cache.set(cache_key, exploded, timeout=settings.BOM_CONFIG.get('bom_cache_timeout'))
+    return exploded
+
+
+def invalidate_bom_caches(part_revision_ids):
+    # A change below a part revision changes the BOM of every assembly that uses it
+    part_revision_ids = set(part_revision_ids) - {None}
+    if not part_revision_ids:
+        return
+    ancestor_ids = set(PartRevisionClosure.objects.filter(descendant_id__in=part_revision_ids).values_list('ancestor_id', flat=True))
+    delete_versions([bom_cache_version_key(part_revision_id) for part_revision_id in ancestor_ids | part_revision_ids])
+
+
+def invalidate_all_bom_caches():
+    delete_versions([BOM_CACHE_GENERATION_KEY])
@@ -0,0 +1,130 @@
+from collections import defaultdict
+
+from .bom_cache import exploded_bom
+from .content_hash import EMPTY_ASSEMBLY_HASH
+from .models import Assembly
+
+
+BOM_DIFF_ADDED = 'added'
+BOM_DIFF_REMOVED = 'removed'
+BOM_DIFF_CHANGED = 'changed'
+BOM_DIFF_FIELDS = ('revision', 'quantity', 'references')
+
+
+def bom_diff_lines(part_revision):
+    """
+    The indented BOM of part_revision by path, a path being the (part number, do_not_load) of each line from below
+    the top level down to the line itself. Repeated subparts of one assembly are merged into a single line, and only
+    the first of the repeated subparts' subtrees is kept, the others being copies of it.
+    """
+    lines, _ = exploded_bom(part_revision)
+    part_numbers = {}
+    keys_by_bom_id = {lines[0].bom_id: ()}
+    # Repeated subparts share a bom id, so a line's parent is told apart by the index of the latest line with its id
+    indexes_by_bom_id = {lines[0].bom_id: 0}
+    parent_indexes = {}
+    diff_lines = {}
+    for index, line in enumerate(lines[1:], 1):
+        part_revision = line.part_revision
+        if part_revision.id not in part_numbers:
+            part_numbers[part_revision.id] = part_revision.part.full_part_number()
+        key = keys_by_bom_id[line.parent_id] + ((part_numbers[part_revision.id], line.do_not_load),)
+        parent_index = indexes_by_bom_id[line.parent_id]
+        keys_by_bom_id[line.bom_id] = key
+        indexes_by_bom_id[line.bom_id] = index
+        if key in diff_lines:
+            if parent_indexes[key] == parent_index:
+                diff_lines[key]['quantity'] += line.quantity
+                diff_lines[key]['references'] = ', '.join(filter(None, (diff_lines[key]['references'], line.references)))
+        else:
+            parent_indexes[key] = parent_index
+            diff_lines[key] = {
+                'part_revision': part_revision,
+                'revision': part_revision.revision,
+                'quantity': line.quantity,
+                'references': line.references,
+            }
+    return diff_lines
+
+
+def bom_diff_side(diff_line):
+    if diff_line is None:
+        return None
+    part_revision = diff_line['part_revision']
+    return {
+        'part_id': part_revision.part_id,
+        'part_revision_id': part_revision.id,
+        'revision': diff_line['revision'],
+        'synopsis': part_revision.synopsis(),
+        'quantity': diff_line['quantity'],
+        'references': diff_line['references'],
+    }
+
+
+def bom_diff_entry(status, key, old, new, changes=()):
+    return {
+        'status': status,
+        'level': len(key),
+        'path': [part_number for part_number, _ in key],
+        'part_number': key[-1][0],
+        'do_not_load': key[-1][1],
+        'changes': list(changes),
+        'old': bom_diff_side(old),
+        'new': bom_diff_side(new),
+    }
+
+
+def same_bom(old_part_revision, new_part_revision):
+    # Whether the two revisions have the same BOM by the content hashes of their assemblies, a part revision without
+    # an assembly having an empty one
+    if old_part_revision.assembly_id == new_part_revision.assembly_id:
+        return True
+    content_hashes = dict(Assembly.objects.filter(id__in=[old_part_revision.assembly_id, new_part_revision.assembly_id])
+                          .values_list('id', 'content_hash'))
+    content_hashes[None] = EMPTY_ASSEMBLY_HASH
+    return content_hashes.get(old_part_revision.assembly_id) == content_hashes.get(new_part_revision.assembly_id)
+
+
+def removed_keys_after(old_lines, new_lines):
+    # The keys of the lines that are only in old_lines, by the key of the line that precedes each in old_lines
+    removed_after = defaultdict(list)
+    previous_key = None
+    for key in old_lines:
+        if key not in new_lines:
+            removed_after[previous_key].append(key)
+        previous_key = key
+    return removed_after
+
+
+def bom_diff(old_part_revision, new_part_revision):
+    """
+    The lines added, removed and changed going from the indented BOM of old_part_revision to that of
+    new_part_revision. Lines are matched by their path, in the order of the new BOM with removed lines after the line
+    that preceded them in the old one. Revisions whose assemblies have the same content hash aren't exploded.
+    """
+    if same_bom(old_part_revision, new_part_revision):
+        return []
+
+    old_lines = bom_diff_lines(old_part_revision)
+    new_lines = bom_diff_lines(new_part_revision)
+    removed_after = removed_keys_after(old_lines, new_lines)
+    diff = []
+
+    def append_removed(after_key):
+        stack = list(reversed(removed_after.pop(after_key, [])))
+        while stack:
+            key = stack.pop()
+            diff.append(bom_diff_entry(BOM_DIFF_REMOVED, key, old_lines[key], None))
+            stack.extend(reversed(removed_after.pop(key, [])))
+
+    append_removed(None)
+    for key, new in new_lines.items():
+        old = old_lines.get(key)
+        if old is None:
+            diff.append(bom_diff_entry(BOM_DIFF_ADDED, key, None, new))
+        else:
+            changes = [field for field in BOM_DIFF_FIELDS if old[field] != new[field]]
+            if changes:
+                diff.append(bom_diff_entry(BOM_DIFF_CHANGED, key, old, new, changes))
+        append_removed(key)
+    return diff
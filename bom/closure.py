@@ -0,0 +1,71 @@
+from collections import defaultdict
+
+
+def part_revision_edges(part_revision_model, assembly_subparts_model):
+    # A part revision uses another one once for every subpart in its assembly that points at it. Model classes are
+    # passed in so that migrations can use their historical models.
+    part_revision_ids_by_assembly = defaultdict(list)
+    for part_revision_id, assembly_id in part_revision_model.objects.exclude(assembly=None).values_list('id', 'assembly_id'):
+        part_revision_ids_by_assembly[assembly_id].append(part_revision_id)
+
+    for assembly_id, child_id in assembly_subparts_model.objects.values_list('assembly_id', 'subpart__part_revision_id'):
+        if child_id is None:
+            continue
+        for parent_id in part_revision_ids_by_assembly[assembly_id]:
+            yield parent_id, child_id
+
+
+def closure_rows(part_revision_ids, edges):
+    """
+    Computes the closure of the BOM graph as {(ancestor_id, descendant_id, depth): path_count}, including a depth 0 row
+    for every part revision. An edge that would close a cycle is left out, the BOM explosion reports those. Returns the
+    rows and the left out edges as {(parent_id, child_id): count}.
+    """
+    children = defaultdict(list)
+    for parent_id, child_id in edges:
+        children[parent_id].append(child_id)
+
+    descendants = {}
+    cycle_edges = defaultdict(int)
+    for root_id in part_revision_ids:
+        if root_id in descendants:
+            continue
+        path_ids = {root_id}
+        stack = [(root_id, iter(children[root_id]))]
+        while stack:
+            part_revision_id, child_ids = stack[-1]
+            child_id = next(child_ids, None)
+            if child_id is None:
+                stack.pop()
+                path_ids.remove(part_revision_id)
+                rows = defaultdict(int)
+                rows[(part_revision_id, 0)] = 1
+                for c_id in children[part_revision_id]:
+                    if c_id not in descendants:
+                        cycle_edges[(part_revision_id, c_id)] += 1  # c_id is still on the path, it is a back edge
+                        continue
+                    for (descendant_id, depth), path_count in descendants[c_id].items():
+                        rows[(descendant_id, depth + 1)] += path_count
+                descendants[part_revision_id] = rows
+            elif child_id not in path_ids and child_id not in descendants:
+                path_ids.add(child_id)
+                stack.append((child_id, iter(children[child_id])))
+
+    rows = {(ancestor_id, descendant_id, depth): path_count
+            for ancestor_id, rows in descendants.items() for (descendant_id, depth), path_count in rows.items()}
+    return rows, dict(cycle_edges)
+
+
+def rebuild_closure(part_revision_model, assembly_subparts_model, closure_model, cycle_edge_model=None, batch_size=1000):
+    part_revision_ids = part_revision_model.objects.values_list('id', flat=True)
+    rows, cycle_edges = closure_rows(part_revision_ids, part_revision_edges(part_revision_model, assembly_subparts_model))
+    closure_model.objects.all().delete()
+    closure_model.objects.bulk_create([
+        closure_model(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=depth, path_count=path_count)
+        for (ancestor_id, descendant_id, depth), path_count in rows.items()
+    ], batch_size=batch_size)
+    if cycle_edge_model is not None:
+        cycle_edge_model.objects.all().delete()
+        cycle_edge_model.objects.bulk_create([
+            cycle_edge_model(parent_id=parent_id, child_id=child_id, count=count) for (parent_id, child_id), count in cycle_edges.items()
+        ], batch_size=batch_size)
@@ -26,6 +26,24 @@ NUMBER_VARIATION_LEN_MIN = 0
 NUMBER_VARIATION_LEN_MAX = 16
 NUMBER_VARIATION_LEN_DEFAULT = 2
 
+BOM_EXPLOSION_BACKEND_LEVEL = 'level'
+BOM_EXPLOSION_BACKEND_CTE = 'cte'
+
+BOM_SEARCH_BACKEND_ICONTAINS = 'icontains'
+BOM_SEARCH_BACKEND_FULL_TEXT = 'fulltext'
+
+QUANTITY_SWEEP_DEFAULT = (10, 100, 1000, 5000, 10000)
+QUANTITY_SWEEP_MAX = 20
+
+AUTOCOMPLETE_PARTS = 'parts'
+AUTOCOMPLETE_MANUFACTURERS = 'manufacturers'
+AUTOCOMPLETE_KINDS = (AUTOCOMPLETE_PARTS, AUTOCOMPLETE_MANUFACTURERS)
+AUTOCOMPLETE_LIMIT_DEFAULT = 10
+AUTOCOMPLETE_LIMIT_MAX = 50
+AUTOCOMPLETE_OPTIONS_PARTS = 'parts'
+AUTOCOMPLETE_OPTIONS_PART_CLASSES = 'part-classes'
+AUTOCOMPLETE_OPTIONS_SOURCES = (AUTOCOMPLETE_OPTIONS_PARTS, AUTOCOMPLETE_OPTIONS_PART_CLASSES)
+
 DATA_SOURCE_OCTOPART = 'octopart'
 DATA_SOURCE_MOUSER = 'mouser'
 DATA_SOURCES = (
@@ -0,0 +1,51 @@
+import hashlib
+import json
+from collections import defaultdict
+
+
+def assembly_content_hash(rows):
+    """
+    Hashes the content of an assembly from one (part_revision_id, count, reference, do_not_load, child_content_hash)
+    row per subpart, where child_content_hash is the hash of the subpart's own assembly. Two assemblies hash the same
+    exactly when their whole BOMs are the same, whatever order their subparts were added in.
+    """
+    content = sorted([part_revision_id, float(count), reference or '', bool(do_not_load), child_content_hash or '']
+                     for part_revision_id, count, reference, do_not_load, child_content_hash in rows)
+    return hashlib.sha256(json.dumps(content, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+EMPTY_ASSEMBLY_HASH = assembly_content_hash([])
+
+
+def rebuild_content_hashes(part_revision_model, assembly_subparts_model, assembly_model):
+    # Hashes every assembly, children first. Model classes are passed in so that migrations can use their historical
+    # models. A subpart that closes a cycle is hashed without the content below it.
+    assembly_ids_by_part_revision = dict(part_revision_model.objects.values_list('id', 'assembly_id'))
+    rows_by_assembly = defaultdict(list)
+    for assembly_id, part_revision_id, count, reference, do_not_load in assembly_subparts_model.objects.values_list(
+            'assembly_id', 'subpart__part_revision_id', 'subpart__count', 'subpart__reference', 'subpart__do_not_load'):
+        rows_by_assembly[assembly_id].append((part_revision_id, count, reference, do_not_load))
+
+    def child_assembly_ids(assembly_id):
+        return [assembly_ids_by_part_revision.get(row[0]) for row in rows_by_assembly[assembly_id]]
+
+    hashes = {}
+    for root_id in assembly_model.objects.values_list('id', flat=True):
+        path_ids = {root_id}
+        stack = [(root_id, iter(child_assembly_ids(root_id)))]
+        while stack:
+            assembly_id, children = stack[-1]
+            child_id = next(children, -1)
+            if child_id == -1:
+                stack.pop()
+                path_ids.remove(assembly_id)
+                hashes[assembly_id] = assembly_content_hash(
+                    row + (hashes.get(assembly_ids_by_part_revision.get(row[0])),) for row in rows_by_assembly[assembly_id])
+            elif child_id is not None and child_id not in path_ids and child_id not in hashes:
+                path_ids.add(child_id)
+                stack.append((child_id, iter(child_assembly_ids(child_id))))
+
+    for assembly in assembly_model.objects.all():
+        if assembly.content_hash != hashes[assembly.id]:
+            assembly.content_hash = hashes[assembly.id]
+            assembly.save(update_fields=['content_hash'])
@@ -272,3 +272,15 @@ class BOMFlatCSVHeaders(CSVHeaders):
 
 class BOMIndentedCSVHeaders(BOMFlatCSVHeaders):
     all_headers_defns = [CSVHeader('level')] + BOMFlatCSVHeaders.all_headers_defns
+
+
+class BOMQuantitySweepCSVHeaders(CSVHeaders):
+    all_headers_defns = [
+        CSVHeader('quantity', name_options=['qty', ]),
+        CSVHeader('unit_cost', name_options=[]),
+        CSVHeader('cost', name_options=[]),
+        CSVHeader('out_of_pocket_cost', name_options=[]),
+        CSVHeader('nre_cost', name_options=['nre', ]),
+        CSVHeader('total_out_of_pocket_cost', name_options=[]),
+        CSVHeader('missing_item_costs', name_options=[]),
+    ]
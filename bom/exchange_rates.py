@@ -0,0 +1,35 @@
+from djmoney.contrib.exchange.models import get_rate
+from moneyed import Money
+
+
+class ExchangeRates:
+    """
+    Exchange rates looked up at most once per pair of currencies, for converting many amounts in one request. Each
+    rate comes from djmoney's get_rate, so from its rates cache or the database, and every conversion after the first
+    is a dictionary lookup and a multiplication.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.rates = {}
+
+    def rate(self, source, target):
+        key = (str(source), str(target))
+        if key[0] == key[1]:
+            return 1
+        if key not in self.rates:
+            self.rates[key] = get_rate(key[0], key[1], backend=self.backend)
+        return self.rates[key]
+
+    def convert(self, money, currency):
+        # Like djmoney's convert_money, returning money itself when it is in currency already
+        if money is None or str(money.currency) == str(currency):
+            return money
+        return money.__class__(money.amount * self.rate(money.currency, currency), currency)
+
+    def convert_all(self, moneys, currency):
+        return [self.convert(money, currency) for money in moneys]
+
+    def convert_values(self, values, currency):
+        # values, a dict such as an export row, with any amount of money in it converted to currency
+        return {key: self.convert(value, currency) if isinstance(value, Money) else value for key, value in values.items()}
@@ -0,0 +1,291 @@
+import json
+import zlib
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.db import connection
+
+from .constants import BOM_EXPLOSION_BACKEND_CTE, BOM_EXPLOSION_BACKEND_LEVEL
+from .models import AssemblySubparts, PartRevision, PartRevisionSnapshot, Subpart
+
+
+# One row of an indented BOM, as produced by a depth first walk of the tree below a PartRevision
+BomLine = namedtuple('BomLine', [
+    'level', 'bom_id', 'parent_id', 'part_revision', 'subpart', 'quantity', 'parent_quantity', 'extended_quantity', 'references', 'do_not_load',
+])
+
+PART_REVISION_RELATED = (
+    'part__organization',
+    'part__number_class',
+    'part__primary_manufacturer_part__manufacturer',
+)
+
+
+def bom_line_id(parent_id, part_revision_id, do_not_load):
+    return (parent_id or '') + (str(part_revision_id) + '-dnl' if do_not_load else str(part_revision_id))
+
+
+class BomCycleError(RecursionError):
+    """
+    Raised when a part revision turns up again within its own BOM. Carries the offending path of part revisions, from
+    the exploded part revision down to the repeated one.
+    """
+
+    def __init__(self, part_revisions):
+        self.part_revisions = part_revisions
+        super().__init__('Infinite recursion in part relationship: ' + ' > '.join(str(pr) for pr in part_revisions))
+
+
+def scaled_line(line, bom_id_prefix, level, quantity):
+    return line._replace(level=line.level + level, bom_id=bom_id_prefix + line.bom_id, parent_id=bom_id_prefix + line.parent_id,
+                         parent_quantity=line.parent_quantity * quantity, extended_quantity=line.extended_quantity * quantity)
+
+
+def bom_explosion_backend():
+    backend = settings.BOM_CONFIG.get('bom_explosion_backend', BOM_EXPLOSION_BACKEND_LEVEL)
+    if backend == BOM_EXPLOSION_BACKEND_CTE and BomTreeCteLoader.supported():
+        return BOM_EXPLOSION_BACKEND_CTE
+    return BOM_EXPLOSION_BACKEND_LEVEL
+
+
+def bom_tree(part_revision):
+    # Released revisions are served from the snapshot taken when they were released, if there is one
+    if part_revision.configuration == 'R':
+        data = PartRevisionSnapshot.objects.filter(part_revision=part_revision).values_list('data', flat=True).first()
+        if data is not None:
+            return BomTreeSnapshotLoader(part_revision, data).load()
+    return live_bom_tree(part_revision)
+
+
+def live_bom_tree(part_revision):
+    if bom_explosion_backend() == BOM_EXPLOSION_BACKEND_CTE:
+        return BomTreeCteLoader(part_revision).load()
+    return BomTreeLoader(part_revision).load()
+
+
+def encode_bom_snapshot(lines):
+    # A zlib compressed JSON array with a row per line, in the order of the lines:
+    # [index of the parent line or -1, part revision id, subpart id, quantity, references, do_not_load]
+    # Levels, ids and extended quantities all follow from the parent line, so they aren't stored.
+    rows = []
+    index_by_bom_id = {}
+    for line in lines:
+        parent_index = index_by_bom_id[line.parent_id] if line.parent_id is not None else -1
+        index_by_bom_id[line.bom_id] = len(rows)
+        rows.append([parent_index, line.part_revision.id, line.subpart.id if line.subpart else None, line.quantity, line.references, line.do_not_load])
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode('utf-8'))
+
+
+class BomTreeLoader:
+    """
+    Loads the multi-level structure below a PartRevision one BOM level at a time, so the number of
+    queries depends on the depth of the BOM rather than on its size.
+    """
+
+    def __init__(self, part_revision):
+        self.part_revision = part_revision
+        self.part_revisions = {part_revision.id: part_revision}
+        self.subparts_by_assembly = defaultdict(list)
+        self.subtrees = {}
+
+    def load(self):
+        loaded_assembly_ids = set()
+        assembly_ids = {self.part_revision.assembly_id} - {None}
+        while assembly_ids:
+            loaded_assembly_ids.update(assembly_ids)
+            next_assembly_ids = set()
+            assembly_subparts = AssemblySubparts.objects.filter(assembly_id__in=assembly_ids).order_by('id')\
+                .select_related(*[f'subpart__part_revision__{related}' for related in PART_REVISION_RELATED])
+            for assembly_subpart in assembly_subparts:
+                subpart = assembly_subpart.subpart
+                if subpart.part_revision is None:
+                    continue
+                # Share a single instance per part revision so that repeated parts don't get their own copies
+                subpart.part_revision = self.part_revisions.setdefault(subpart.part_revision_id, subpart.part_revision)
+                self.subparts_by_assembly[assembly_subpart.assembly_id].append(subpart)
+                next_assembly_ids.add(subpart.part_revision.assembly_id)
+            assembly_ids = next_assembly_ids - loaded_assembly_ids - {None}
+        return self
+
+    def subparts(self, part_revision):
+        return self.subparts_by_assembly.get(part_revision.assembly_id, [])
+
+    def postorder(self):
+        # Distinct part revisions below the exploded one, children first. Walked with an explicit stack so deep BOMs
+        # don't depend on the recursion limit, stopping on the first part revision that repeats within a path.
+        order = []
+        done_ids = set()
+        path_ids = {self.part_revision.id}
+        stack = [(self.part_revision, iter(self.subparts(self.part_revision)))]
+        while stack:
+            part_revision, children = stack[-1]
+            sp = next(children, None)
+            if sp is None:
+                stack.pop()
+                path_ids.remove(part_revision.id)
+                done_ids.add(part_revision.id)
+                order.append(part_revision)
+            elif sp.part_revision.id in path_ids:
+                raise BomCycleError([frame[0] for frame in stack] + [sp.part_revision])
+            elif sp.part_revision.id not in done_ids:
+                path_ids.add(sp.part_revision.id)
+                stack.append((sp.part_revision, iter(self.subparts(sp.part_revision))))
+        return order
+
+    def expand(self, part_revision, bom_id='', level=0, quantity=1):
+        # Depth first lines below part_revision. Shared sub-assemblies are replayed from self.subtrees, scaled
+        # by the quantity of their parent, rather than walked again.
+        stack = [(iter(self.subparts(part_revision)), bom_id, level, quantity)]
+        while stack:
+            children, parent_id, parent_level, parent_qty = stack[-1]
+            sp = next(children, None)
+            if sp is None:
+                stack.pop()
+                continue
+            sp_bom_id = bom_line_id(parent_id, sp.part_revision.id, sp.do_not_load)
+            extended_quantity = parent_qty * sp.count
+            yield BomLine(level=parent_level + 1, bom_id=sp_bom_id, parent_id=parent_id, part_revision=sp.part_revision, subpart=sp,
+                          quantity=sp.count, parent_quantity=parent_qty, extended_quantity=extended_quantity, references=sp.reference,
+                          do_not_load=sp.do_not_load)
+            if sp.part_revision.id in self.subtrees:
+                for line in self.subtrees[sp.part_revision.id]:
+                    yield scaled_line(line, sp_bom_id, parent_level + 1, extended_quantity)
+            else:
+                stack.append((iter(self.subparts(sp.part_revision)), sp_bom_id, parent_level + 1, extended_quantity))
+
+    def lines(self):
+        # Expand each part revision used more than once a single time, children first, so that every
+        # sub-assembly it contains is already memoized when it is replayed.
+        occurrences = defaultdict(int)
+        for subparts in self.subparts_by_assembly.values():
+            for sp in subparts:
+                occurrences[sp.part_revision.id] += 1
+        for part_revision in self.postorder():
+            if occurrences[part_revision.id] > 1 and self.subparts(part_revision):
+                self.subtrees[part_revision.id] = list(self.expand(part_revision))
+
+        root_id = bom_line_id(None, self.part_revision.id, False)
+        yield BomLine(level=0, bom_id=root_id, parent_id=None, part_revision=self.part_revision, subpart=None, quantity=1,
+                      parent_quantity=1, extended_quantity=1, references='', do_not_load=False)
+        yield from self.expand(self.part_revision, bom_id=root_id)
+
+
+class BomTreeCteLoader:
+    """
+    Loads the whole multi-level structure below a PartRevision with a single recursive CTE. Levels and
+    extended quantities are computed by the database, the models for each line are then fetched in one query.
+    """
+    vendors = ('postgresql', 'sqlite')
+
+    def __init__(self, part_revision):
+        self.part_revision = part_revision
+        self.rows = []
+
+    @classmethod
+    def supported(cls):
+        return connection.vendor in cls.vendors
+
+    @staticmethod
+    def sql():
+        return f"""
+            WITH RECURSIVE bom_tree(level, path, node_path, parent_node_path, part_revision_id, assembly_id, assembly_subpart_id, subpart_id, count,
+                                    reference, do_not_load, parent_quantity, extended_quantity, is_cycle) AS (
+                SELECT 0, '/' || CAST(pr.id AS TEXT) || '/', CAST('/' AS TEXT), CAST(NULL AS TEXT), pr.id, pr.assembly_id, CAST(NULL AS INTEGER),
+                       CAST(NULL AS INTEGER), CAST(1 AS DOUBLE PRECISION), CAST('' AS TEXT), FALSE, CAST(1 AS DOUBLE PRECISION),
+                       CAST(1 AS DOUBLE PRECISION), FALSE
+                FROM {PartRevision._meta.db_table} pr
+                WHERE pr.id = %s
+                UNION ALL
+                SELECT t.level + 1, t.path || CAST(child.id AS TEXT) || '/', t.node_path || CAST(asp.id AS TEXT) || '/', t.node_path, child.id,
+                       child.assembly_id, asp.id, sp.id, sp.count, sp.reference, sp.do_not_load, t.extended_quantity, t.extended_quantity * sp.count,
+                       t.path LIKE '%%/' || CAST(child.id AS TEXT) || '/%%'
+                FROM bom_tree t
+                JOIN {AssemblySubparts._meta.db_table} asp ON asp.assembly_id = t.assembly_id
+                JOIN {Subpart._meta.db_table} sp ON sp.id = asp.subpart_id
+                JOIN {PartRevision._meta.db_table} child ON child.id = sp.part_revision_id
+                WHERE NOT t.is_cycle
+            )
+            SELECT level, path, node_path, parent_node_path, part_revision_id, assembly_subpart_id, subpart_id, count, reference, do_not_load,
+                   parent_quantity, extended_quantity, is_cycle
+            FROM bom_tree
+        """
+
+    def load(self):
+        with connection.cursor() as cursor:
+            cursor.execute(self.sql(), [self.part_revision.id])
+            columns = [col[0] for col in cursor.description]
+            self.rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        cycles = [row['path'] for row in self.rows if row['is_cycle']]
+        if cycles:
+            part_revision_ids = [int(part_revision_id) for part_revision_id in cycles[0].strip('/').split('/')]
+            part_revisions = PartRevision.objects.filter(id__in=part_revision_ids)\
+                .select_related('part__organization', 'part__number_class').in_bulk()
+            raise BomCycleError([part_revisions[part_revision_id] for part_revision_id in part_revision_ids])
+        return self
+
+    def lines(self):
+        subpart_ids = [row['subpart_id'] for row in self.rows if row['subpart_id'] is not None]
+        subparts = Subpart.objects.filter(id__in=subpart_ids)\
+            .select_related(*[f'part_revision__{related}' for related in PART_REVISION_RELATED]).in_bulk()
+        part_revisions = {self.part_revision.id: self.part_revision}
+        for subpart in subparts.values():
+            subpart.part_revision = part_revisions.setdefault(subpart.part_revision_id, subpart.part_revision)
+
+        rows_by_parent_node_path = defaultdict(list)
+        for row in self.rows:
+            rows_by_parent_node_path[row['parent_node_path']].append(row)
+
+        stack = [(rows_by_parent_node_path[None][0], None)]
+        while stack:
+            row, parent_id = stack.pop()
+            subpart = subparts.get(row['subpart_id'])
+            bom_id = bom_line_id(parent_id, row['part_revision_id'], row['do_not_load'])
+            yield BomLine(level=row['level'], bom_id=bom_id, parent_id=parent_id, part_revision=part_revisions[row['part_revision_id']], subpart=subpart,
+                          quantity=row['count'] if subpart else 1, parent_quantity=row['parent_quantity'] if subpart else 1,
+                          extended_quantity=row['extended_quantity'] if subpart else 1, references=row['reference'],
+                          do_not_load=bool(row['do_not_load']))
+            children = sorted(rows_by_parent_node_path[row['node_path']], key=lambda r: r['assembly_subpart_id'])
+            stack.extend((child, bom_id) for child in reversed(children))
+
+
+class BomTreeSnapshotLoader:
+    """
+    Loads the structure below a released PartRevision from its snapshot, so only the part revisions it refers to are
+    fetched, in one query. Lines below part revisions deleted since the release are left out, subparts deleted since
+    keep their lines but lose their ids.
+    """
+
+    def __init__(self, part_revision, data):
+        self.part_revision = part_revision
+        self.data = data
+        self.rows = []
+
+    def load(self):
+        self.rows = json.loads(zlib.decompress(bytes(self.data)).decode('utf-8'))
+        return self
+
+    def lines(self):
+        part_revisions = PartRevision.objects.filter(id__in={row[1] for row in self.rows})\
+            .select_related(*PART_REVISION_RELATED).in_bulk()
+        part_revisions[self.part_revision.id] = self.part_revision
+        subpart_ids = set(Subpart.objects.filter(id__in={row[2] for row in self.rows if row[2] is not None}).values_list('id', flat=True))
+
+        lines = []
+        for parent_index, part_revision_id, subpart_id, quantity, references, do_not_load in self.rows:
+            if parent_index < 0:
+                line = BomLine(level=0, bom_id=bom_line_id(None, part_revision_id, False), parent_id=None, part_revision=self.part_revision,
+                               subpart=None, quantity=1, parent_quantity=1, extended_quantity=1, references='', do_not_load=False)
+            else:
+                parent = lines[parent_index]
+                part_revision = part_revisions.get(part_revision_id)
+                if parent is None or part_revision is None:
+                    lines.append(None)
+                    continue
+                # The subpart as it was at release, it may have been edited or deleted since
+                subpart = Subpart(id=subpart_id if subpart_id in subpart_ids else None, part_revision=part_revision, count=quantity, reference=references, do_not_load=do_not_load)
+                line = BomLine(level=parent.level + 1, bom_id=bom_line_id(parent.bom_id, part_revision_id, do_not_load), parent_id=parent.bom_id,
+                               part_revision=part_revision, subpart=subpart, quantity=quantity, parent_quantity=parent.extended_quantity,
+                               extended_quantity=parent.extended_quantity * quantity, references=references, do_not_load=do_not_load)
+            lines.append(line)
+            yield line
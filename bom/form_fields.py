@@ -1,21 +1,25 @@
 from django import forms
+from django.urls import reverse
 from django.utils.safestring import mark_safe
 from json import dumps
 
+from .constants import AUTOCOMPLETE_LIMIT_DEFAULT
+
 
 class AutocompleteTextInput(forms.TextInput):
     def __init__(self, *args, **kwargs):
-        self.queryset = kwargs.pop('queryset')
+        # source is one of constants.AUTOCOMPLETE_OPTIONS_SOURCES, options are fetched from json:autocomplete-options
+        # a page at a time as the input is typed in, so rendering doesn't depend on how many objects there are
+        self.source = kwargs.pop('source')
+        self.exclude_ids = kwargs.pop('exclude_ids', [])
         self.autocomplete_limit = kwargs.pop('autocomplete_limit', None)
         self.autocomplete_min_length = kwargs.pop('autocomplete_min_length', 0)
         self.autocomplete_submit = kwargs.pop('autocomplete_submit', False)
         self.form_name = kwargs.pop('form_name', 'form')
-        self.verbose_string_function = kwargs.pop('verbose_string_function', str)
         super().__init__(*args, **kwargs)
 
     def render(self, name, value, attrs=None, renderer=None):
-        # verbose_string_function is used if we want to show verbose strings in the dropdown,
-        # but autocomplete to something simpler
+        # Options show verbose labels in the dropdown, but autocomplete to something simpler
 
         # Disable chrome autocomplete..we dont want double duty here!
         if attrs is not None:
@@ -25,34 +29,49 @@ class AutocompleteTextInput(forms.TextInput):
 
         html = super().render(name, value, attrs)
 
-        autocomplete_dict = {}
-        autocomplete_dict_to_fill = {}
-        for obj in self.queryset:
-            verbose_obj_str = self.verbose_string_function(obj).replace('"', '\\"')
-            autocomplete_dict.update({verbose_obj_str: None})
-            autocomplete_dict_to_fill.update({verbose_obj_str: str(obj)})
-
-        autocomplete_json = dumps(autocomplete_dict).replace("'", "\\'")
-        autocomplete_json_to_fill = dumps(autocomplete_dict_to_fill).replace("'", "\\'")
+        options_url = reverse('json:autocomplete-options', kwargs={'source': self.source})
+        limit = self.autocomplete_limit or AUTOCOMPLETE_LIMIT_DEFAULT
 
         # To escape brackets in a Python 3.6 f-string we use double brackets
         inline_code = mark_safe(
             f"""<script>
-            const {name}_data = JSON.parse('{autocomplete_json}');
-            const {name}_data_to_fill = JSON.parse('{autocomplete_json_to_fill}');
+            const {name}_values = {{}};
             const {name}_input = document.getElementById("id_{name}");
             const {name}_form = {name}_input.form;
+            let {name}_request = null;
             $(document).ready(function () {{
                 $('#id_{name}').autocomplete({{
-                    data: {name}_data,
-                    limit: {self.autocomplete_limit or 'undefined'}, // The max amount of results that can be shown at once. Default: Infinity.
+                    data: {{}},
+                    limit: {limit}, // The max amount of results that can be shown at once. Default: Infinity.
                     minLength: {self.autocomplete_min_length}, // The minimum length of the input for the autocomplete to start. Default: 1.
                     onAutocomplete: function (val) {{
-                        console.log({name}_data_to_fill);
-                        $("#id_{name}").val({name}_data_to_fill[val]);
+                        $("#id_{name}").val({name}_values[val]);
                         {f'{name}_form.submit()' if self.autocomplete_submit else ''}
                     }},
                 }});
+                const {name}_autocomplete = M.Autocomplete.getInstance({name}_input);
+
+                // Options for what has been typed so far, replacing the previous request's if it is still pending
+                $('#id_{name}').on('focus input', function () {{
+                    if ({name}_request !== null) {{
+                        {name}_request.abort();
+                    }}
+                    {name}_request = $.ajax({{
+                        url: "{options_url}",
+                        data: {{q: $(this).val().trim(), limit: {limit}, exclude: {dumps(list(self.exclude_ids))}}},
+                        traditional: true,
+                        success: function (response) {{
+                            {name}_request = null;
+                            const data = {{}};
+                            response['content']['options'].forEach(option => {{
+                                data[option['label']] = null;
+                                {name}_values[option['label']] = option['value'];
+                            }});
+                            {name}_autocomplete.updateData(data);
+                            {name}_autocomplete.open();
+                        }},
+                    }});
+                }});
             }});
             </script>"""
         )
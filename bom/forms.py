@@ -14,6 +14,8 @@ from django.utils.translation import gettext_lazy as _
 from djmoney.money import Money
 
 from .constants import (
+    AUTOCOMPLETE_OPTIONS_PARTS,
+    AUTOCOMPLETE_OPTIONS_PART_CLASSES,
     CONFIGURATION_TYPES,
     CURRENT_UNITS,
     DISTANCE_UNITS,
@@ -59,6 +61,7 @@ from .models import (
     Part,
     PartClass,
     PartRevision,
+    PartRevisionClosure,
     Seller,
     SellerPart,
     Subpart,
@@ -393,7 +396,7 @@ class PartClassSelectionForm(forms.Form):
         self.fields['part_class'] = forms.CharField(required=False,
                                                     widget=AutocompleteTextInput(attrs={'placeholder': 'Select a part class.'},
                                                                                  autocomplete_submit=True,
-                                                                                 queryset=PartClass.objects.filter(organization=self.organization)))
+                                                                                 source=AUTOCOMPLETE_OPTIONS_PART_CLASSES))
 
     def clean_part_class(self):
         part_class = self.cleaned_data['part_class']
@@ -810,7 +813,7 @@ class PartFormSemiIntelligent(forms.ModelForm):
         super(PartFormSemiIntelligent, self).__init__(*args, **kwargs)
         self.fields['number_item'].validators.append(alphanumeric)
         self.fields['number_class'] = forms.CharField(label='Part Number Class*', required=True, help_text='Select a number class.',
-                                                      widget=AutocompleteTextInput(queryset=PartClass.objects.filter(organization=self.organization)))
+                                                      widget=AutocompleteTextInput(source=AUTOCOMPLETE_OPTIONS_PART_CLASSES))
         if kwargs.get('instance', None):  # To check uniqueness
             self.id = kwargs['instance'].id
 
@@ -985,11 +988,6 @@ class SubpartForm(forms.ModelForm):
         if self.ignore_part_revision:
             self.fields.get('part_revision').required = False
 
-        if self.part_id:
-            part = Part.objects.get(id=self.part_id)
-            unusable_part_ids = [p.id for p in part.where_used_full()]
-            unusable_part_ids.append(part.id)
-
     def clean_count(self):
         count = self.cleaned_data['count']
         if not count:
@@ -1005,6 +1003,10 @@ class SubpartForm(forms.ModelForm):
         if self.ignore_part_revision:
             return None
         part_revision = self.cleaned_data['part_revision']
+        if part_revision and self.instance.pk and part_revision.id != self.instance.part_revision_id:
+            parents = PartRevision.objects.filter(assembly__subparts=self.instance)
+            if PartRevisionClosure.would_create_cycle(part_revision, parents):
+                raise forms.ValidationError("Infinite recursion! Can't add a part to its self.", code='invalid')
         return part_revision
 
     def clean(self):
@@ -1030,14 +1032,12 @@ class AddSubpartForm(forms.Form):
         self.organization = kwargs.pop('organization', None)
         self.part_id = kwargs.pop('part_id', None)
         self.part = Part.objects.get(id=self.part_id)
-        self.part_revision = self.part.latest()
-        self.unusable_part_rev_ids = [pr.id for pr in self.part_revision.where_used_full()]
-        self.unusable_part_rev_ids.append(self.part_revision.id)
+        self.part_revision = kwargs.pop('part_revision', None) or self.part.latest()
         super(AddSubpartForm, self).__init__(*args, **kwargs)
         self.fields['subpart_part_number'] = forms.CharField(required=True, label="Subpart part number",
                                                     widget=AutocompleteTextInput(attrs={'placeholder': 'Select a part.'},
-                                                                                 queryset=Part.objects.filter(organization=self.organization).exclude(id=self.part_id),
-                                                                                 verbose_string_function=Part.verbose_str))
+                                                                                 source=AUTOCOMPLETE_OPTIONS_PARTS,
+                                                                                 exclude_ids=[self.part_id]))
 
     def clean_count(self):
         count = self.cleaned_data['count']
@@ -1068,7 +1068,7 @@ class AddSubpartForm(forms.Form):
             if self.subpart_part is None:
                 self.add_error('subpart_part_number', f"No part revision exists for part {part.full_part_number()}. Create a revision before adding to an assembly.")
                 return subpart_part_number
-            if self.subpart_part.id in self.unusable_part_rev_ids:
+            if self.part_revision.would_create_cycle(self.subpart_part):
                 validation_error = forms.ValidationError("Infinite recursion! Can't add a part to its self.", code='invalid')
                 self.add_error('subpart_part_number', validation_error)
         except AttributeError as e:
@@ -1268,12 +1268,7 @@ class BOMCSVForm(forms.Form):
                     existing_part_revision = PartRevision.objects.filter(part=existing_part, revision=part_dict['revision']).first()
 
                 if existing_part_revision and parent_part_revision:  # Check for infinite recursion
-                    contains_parent = False
-                    indented_bom = existing_part_revision.indented()
-                    for _, sp in indented_bom.parts.items():  # Make sure the subpart does not contain the parent - infinite recursion!
-                        if sp.part_revision == parent_part_revision:
-                            contains_parent = True
-                    if contains_parent:
+                    if parent_part_revision.would_create_cycle(existing_part_revision):
                         raise ValidationError(
                             f"Row {row_count} - Uploaded part {part_number} contains parent part in its assembly. Cannot add {part_number} as it would cause infinite recursion. Uploading of this subpart skipped.",
                             code='invalid')
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.16 on 2026-10-17 02:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from bom.closure import rebuild_closure
+
+
+def build_part_revision_closure(apps, schema_editor):
+    PartRevision = apps.get_model('bom', 'PartRevision')
+    AssemblySubparts = apps.get_model('bom', 'AssemblySubparts')
+    PartRevisionClosure = apps.get_model('bom', 'PartRevisionClosure')
+    rebuild_closure(PartRevision, AssemblySubparts, PartRevisionClosure)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bom', '0047_sellerpart_seller_part_number'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartRevisionClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField(default=0)),
+                ('path_count', models.PositiveIntegerField(default=1)),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_closures', to='bom.partrevision')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_closures', to='bom.partrevision')),
+            ],
+            options={
+                'unique_together': {('ancestor', 'descendant', 'depth')},
+                'index_together': {('descendant', 'depth')},
+            },
+        ),
+        migrations.RunPython(build_part_revision_closure, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.16 on 2026-10-17 09:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bom', '0048_partrevisionclosure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartRevisionSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('data', models.BinaryField()),
+                ('part_revision', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='bom_snapshot', to='bom.partrevision')),
+            ],
+        ),
+    ]
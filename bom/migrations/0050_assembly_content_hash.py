@@ -0,0 +1,28 @@
+# Generated by Django 3.2.16 on 2026-10-17 11:05
+
+from django.db import migrations, models
+
+from bom.content_hash import rebuild_content_hashes
+
+
+def build_assembly_content_hashes(apps, schema_editor):
+    PartRevision = apps.get_model('bom', 'PartRevision')
+    AssemblySubparts = apps.get_model('bom', 'AssemblySubparts')
+    Assembly = apps.get_model('bom', 'Assembly')
+    rebuild_content_hashes(PartRevision, AssemblySubparts, Assembly)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bom', '0049_partrevisionsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assembly',
+            name='content_hash',
+            field=models.CharField(db_index=True, default='4f53cda18c2baa0c0354bb5f9a3ecbe5ed12ab4d8e11ba873c2f11161202b945', editable=False, max_length=64),
+        ),
+        migrations.RunPython(build_assembly_content_hashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+from bom.search import search_index
+
+
+def create_search_index(apps, schema_editor):
+    index = search_index(schema_editor.connection.alias)
+    if index is not None:
+        index.create()
+        index.update(apps.get_model('bom', 'PartRevision'))
+
+
+def drop_search_index(apps, schema_editor):
+    index = search_index(schema_editor.connection.alias)
+    if index is not None:
+        index.drop()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bom', '0050_assembly_content_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 3.2.16 on 2026-10-17 13:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from bom.trigrams import rebuild_trigrams
+
+
+PG_TRGM_INDEXES = (
+    ('bom_manufacturer_name_trgm', 'bom_manufacturer', 'name'),
+    ('bom_manufacturerpart_manufacturer_part_number_trgm', 'bom_manufacturerpart', 'manufacturer_part_number'),
+)
+
+
+def build_trigram_indexes(apps, schema_editor):
+    # PostgreSQL indexes the fields with pg_trgm, the same expression as icontains lookups so they can use it, other
+    # databases get the trigram tables filled
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for name, table, column in PG_TRGM_INDEXES:
+            schema_editor.execute(f'CREATE INDEX {name} ON {table} USING GIN (UPPER({column}::text) gin_trgm_ops)')
+        return
+    rebuild_trigrams(apps.get_model('bom', 'Manufacturer'), 'name', apps.get_model('bom', 'ManufacturerTrigram'), 'manufacturer')
+    rebuild_trigrams(apps.get_model('bom', 'ManufacturerPart'), 'manufacturer_part_number', apps.get_model('bom', 'ManufacturerPartTrigram'),
+                     'manufacturer_part')
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for name, _, _ in PG_TRGM_INDEXES:
+            schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bom', '0051_partrevisionsearch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ManufacturerTrigram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('manufacturer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bom.manufacturer')),
+            ],
+            options={
+                'unique_together': {('trigram', 'manufacturer')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ManufacturerPartTrigram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('manufacturer_part', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bom.manufacturerpart')),
+            ],
+            options={
+                'unique_together': {('trigram', 'manufacturer_part')},
+            },
+        ),
+        migrations.RunPython(build_trigram_indexes, drop_trigram_indexes),
+    ]
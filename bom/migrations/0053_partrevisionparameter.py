@@ -0,0 +1,34 @@
+# Generated by Django 3.2.16 on 2026-10-17 15:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from bom.parameters import rebuild_parameters
+
+
+def build_parameters(apps, schema_editor):
+    rebuild_parameters(apps.get_model('bom', 'PartRevision'), apps.get_model('bom', 'PartRevisionParameter'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bom', '0052_manufacturer_trigrams'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartRevisionParameter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32)),
+                ('quantity', models.CharField(max_length=16)),
+                ('value', models.FloatField()),
+                ('part_revision', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parameters', to='bom.partrevision')),
+            ],
+            options={
+                'index_together': {('quantity', 'value')},
+            },
+        ),
+        migrations.RunPython(build_parameters, migrations.RunPython.noop),
+    ]
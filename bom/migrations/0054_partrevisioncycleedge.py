@@ -0,0 +1,38 @@
+# Generated by Django 3.2.16 on 2026-10-17 04:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from bom.closure import rebuild_closure
+
+
+def build_part_revision_cycle_edges(apps, schema_editor):
+    # The closure is rebuilt with the edges it leaves out, so that the two agree
+    PartRevision = apps.get_model('bom', 'PartRevision')
+    AssemblySubparts = apps.get_model('bom', 'AssemblySubparts')
+    PartRevisionClosure = apps.get_model('bom', 'PartRevisionClosure')
+    PartRevisionCycleEdge = apps.get_model('bom', 'PartRevisionCycleEdge')
+    rebuild_closure(PartRevision, AssemblySubparts, PartRevisionClosure, PartRevisionCycleEdge)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bom', '0053_partrevisionparameter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartRevisionCycleEdge',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=1)),
+                ('child', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cycle_parent_edges', to='bom.partrevision')),
+                ('parent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cycle_child_edges', to='bom.partrevision')),
+            ],
+            options={
+                'unique_together': {('parent', 'child')},
+            },
+        ),
+        migrations.RunPython(build_part_revision_cycle_edges, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 
 import logging
+from collections import defaultdict
 from math import ceil
 
 from django.conf import settings
@@ -8,13 +9,15 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from django.core.cache import cache
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
 from djmoney.models.fields import CURRENCY_CHOICES, CurrencyField, MoneyField
 from social_django.models import UserSocialAuth
 
 from .base_classes import AsDictModel
+from .closure import rebuild_closure
+from .content_hash import EMPTY_ASSEMBLY_HASH, assembly_content_hash, rebuild_content_hashes
 from .constants import (
     CONFIGURATION_TYPES,
     CURRENT_UNITS,
@@ -45,7 +48,11 @@ from .constants import (
     WEIGHT_UNITS,
 )
 from .csv_headers import PartsListCSVHeaders, PartsListCSVHeadersSemiIntelligent
+from .exchange_rates import ExchangeRates
+from .parameters import part_revision_parameters, rebuild_parameters
 from .part_bom import PartBom, PartBomItem, PartIndentedBomItem
+from .price_breaks import PriceBreaks, price_breaks_by_part
+from .trigrams import TrigramIndex
 from .utils import increment_str, listify_string, prep_for_sorting_nicely, stringify_list, strip_trailing_zeros
 from .validators import alphanumeric, numeric, validate_pct
 
@@ -157,6 +164,10 @@ class Manufacturer(models.Model, AsDictModel):
     class Meta:
         ordering = ['name']
 
+    @staticmethod
+    def name_trigrams():
+        return TrigramIndex(Manufacturer, 'name', ManufacturerTrigram, 'manufacturer')
+
     def __str__(self):
         return u'%s' % self.name
 
@@ -317,16 +328,7 @@ class Part(models.Model):
         return used_in_prs
 
     def where_used_full(self):
-        def where_used_given_part(used_in_parts, part):
-            where_used = part.where_used()
-            used_in_parts.update(where_used)
-            for p in where_used:
-                where_used_given_part(used_in_parts, p)
-            return used_in_parts
-
-        used_in_parts = set()
-        where_used_given_part(used_in_parts, self)
-        return list(used_in_parts)
+        return list(PartRevision.objects.filter(descendant_closures__descendant__part=self, descendant_closures__depth__gt=0).distinct())
 
     def indented(self, part_revision=None):
         if part_revision is None:
@@ -344,6 +346,24 @@ class Part(models.Model):
         # sellerparts = SellerPart.objects.filter(manufacturer_part__part=self)
         return SellerPart.optimal(sellerparts, int(quantity))
 
+    def cost_curve(self, exchange_rates=None):
+        # The optimal seller part of this part from each quantity at which it changes, with what buying that quantity
+        # from it costs in the organization's currency, see PriceBreaks.curve
+        currency = self.organization.currency
+        exchange_rates = exchange_rates if exchange_rates is not None else ExchangeRates()
+        seller_parts = SellerPart.by_part([self.id])[self.id]
+        curve = []
+        for quantity, seller_part in PriceBreaks(seller_parts, currency=currency, exchange_rates=exchange_rates).curve():
+            if seller_part is not None:
+                unit_cost = exchange_rates.convert(seller_part.unit_cost, currency)
+                curve.append({
+                    'quantity': quantity,
+                    'seller_part': seller_part,
+                    'unit_cost': unit_cost,
+                    'cost': unit_cost * max(quantity, seller_part.minimum_order_quantity),
+                })
+        return curve
+
     def assign_part_number(self):
         if self.number_item is None or self.number_item == '':
             last_number_item = Part.objects.filter(
@@ -378,8 +398,8 @@ class Part(models.Model):
             self.assign_part_number()
         super(Part, self).save()
 
-    def verbose_str(self):
-        return f'{self.full_part_number()} ┆ {self.description()}'
+    def verbose_str(self, description=None):
+        return f'{self.full_part_number()} ┆ {self.description() if description is None else description}'
 
     def __str__(self):
         return u'%s' % (self.full_part_number())
@@ -501,95 +521,75 @@ class PartRevision(models.Model):
         self.displayable_synopsis = self.generate_synopsis(False)
         super(PartRevision, self).save(*args, **kwargs)
 
-    def indented(self, top_level_quantity=100):
-        def indented_given_bom(bom, part_revision, parent_id=None, parent=None, qty=1, parent_qty=1, indent_level=0, subpart=None, reference='', do_not_load=False):
-            bom_item_id = (parent_id or '') + (str(part_revision.id) + '-dnl' if do_not_load else str(part_revision.id))
-            extended_quantity = parent_qty * qty
-            total_extended_quantity = top_level_quantity * extended_quantity
-
-            try:
-                seller_part = part_revision.part.optimal_seller(quantity=total_extended_quantity)
-            except AttributeError:
-                seller_part = None
-
-            bom.append_item_and_update(PartIndentedBomItem(
-                bom_id=bom_item_id,
-                part=part_revision.part,
-                part_revision=part_revision,
-                do_not_load=do_not_load,
-                references=reference,
-                quantity=qty,
-                extended_quantity=extended_quantity,
-                parent_quantity=parent_qty,  # Do we need this?
-                indent_level=indent_level,
-                parent_id=parent_id,
-                subpart=subpart,
-                seller_part=seller_part,
-            ))
-
-            indent_level = indent_level + 1
-            if part_revision is None or part_revision.assembly is None or part_revision.assembly.subparts.count() == 0:
-                return
-            else:
-                parent_qty *= qty
-                # TODO: Cache Me!
-                for sp in part_revision.assembly.subparts.all():
-                    qty = sp.count
-                    reference = sp.reference
-                    indented_given_bom(bom, sp.part_revision, parent_id=bom_item_id, parent=part_revision, qty=qty, parent_qty=parent_qty,
-                                       indent_level=indent_level, subpart=sp, reference=reference, do_not_load=sp.do_not_load)
+    def explode(self, top_level_quantity=100, sort=False):
+        # Walk the BOM once and build both views from it, for callers that show both
+        return self.boms(top_level_quantity=top_level_quantity, sort=sort)
 
-        bom = PartBom(part_revision=self, quantity=top_level_quantity)
-        indented_given_bom(bom, self)
-
-        return bom
+    def indented(self, top_level_quantity=100):
+        indented_bom, _ = self.boms(top_level_quantity=top_level_quantity, flat=False)
+        return indented_bom
 
     def flat(self, top_level_quantity=100, sort=False):
-        def flat_given_bom(bom, part_revision, parent=None, qty=1, parent_qty=1, subpart=None, reference=''):
-            extended_quantity = parent_qty * qty
-            total_extended_quantity = top_level_quantity * extended_quantity
-
-            try:
-                seller_part = part_revision.part.optimal_seller(quantity=total_extended_quantity)
-            except AttributeError:
-                seller_part = None
-
-            try:
-                do_not_load = subpart.do_not_load
-            except AttributeError:
-                do_not_load = False
+        _, flat_bom = self.boms(top_level_quantity=top_level_quantity, sort=sort, indented=False)
+        return flat_bom
 
-            bom_item_id = str(part_revision.id) + '-dnl' if do_not_load else str(part_revision.id)
-            bom.append_item_and_update(PartBomItem(
-                bom_id=bom_item_id,
-                part=part_revision.part,
-                part_revision=part_revision,
-                do_not_load=do_not_load,
-                references=reference,
-                quantity=qty,
-                extended_quantity=extended_quantity,
-                seller_part=seller_part,
-            ))
+    def boms(self, top_level_quantity=100, sort=False, indented=True, flat=True):
+        # The indented and flat BOMs from a single explosion, None for a view that isn't asked for. The flat BOM
+        # aggregates the indented lines by part revision and do_not_load, so both share one load of the seller parts.
+        from .bom_cache import exploded_bom
 
-            if part_revision is None or part_revision.assembly is None or part_revision.assembly.subparts.count() == 0:
-                return
-            else:
-                parent_qty *= qty
-                for sp in part_revision.assembly.subparts.all():
-                    qty = sp.count
-                    reference = sp.reference
-                    flat_given_bom(bom, sp.part_revision, parent=part_revision, qty=qty, parent_qty=parent_qty, subpart=sp, reference=reference)
+        lines, seller_parts = exploded_bom(self)
+        # A cached explosion comes with its own copy of this part revision, which already has its part loaded
+        part_revision = lines[0].part_revision
+        price_breaks = price_breaks_by_part(seller_parts, currency=part_revision.part.organization.currency)
+        indented_bom = PartRevision.indented_bom(part_revision, lines, top_level_quantity) if indented else None
+        flat_bom = PartRevision.flat_bom(part_revision, lines, top_level_quantity) if flat else None
 
-        flat_bom = PartBom(part_revision=self, quantity=top_level_quantity)
-        flat_given_bom(flat_bom, self)
+        # Only the costing depends on the quantity
+        for bom in (indented_bom, flat_bom):
+            if bom is not None:
+                bom.recost(top_level_quantity, seller_parts=seller_parts, price_breaks=price_breaks)
 
         # Sort by references, if no references then use part number.
         # Note that need to convert part number to a list so can be compared with the 
         # list-ified string returned by prep_for_sorting_nicely.
         def sort_by_references(p):
             return prep_for_sorting_nicely(p.references) if p.references else p.__str__().split()
-        if sort:
+        if sort and flat_bom is not None:
             flat_bom.parts = sorted(flat_bom.parts.values(), key=sort_by_references)
+        return indented_bom, flat_bom
+
+    @staticmethod
+    def indented_bom(part_revision, lines, top_level_quantity):
+        indented_bom = PartBom(part_revision=part_revision, quantity=top_level_quantity)
+        for line in lines:
+            indented_bom.append_item(PartIndentedBomItem(
+                bom_id=line.bom_id,
+                part_revision=line.part_revision,
+                do_not_load=line.do_not_load,
+                references=line.references,
+                quantity=line.quantity,
+                extended_quantity=line.extended_quantity,
+                parent_quantity=line.parent_quantity,  # Do we need this?
+                indent_level=line.level,
+                parent_id=line.parent_id,
+                subpart=line.subpart,
+            ))
+        return indented_bom
+
+    @staticmethod
+    def flat_bom(part_revision, lines, top_level_quantity):
+        flat_bom = PartBom(part_revision=part_revision, quantity=top_level_quantity)
+        for line in lines:
+            bom_item_id = str(line.part_revision.id) + '-dnl' if line.do_not_load else str(line.part_revision.id)
+            flat_bom.append_item(PartBomItem(
+                bom_id=bom_item_id,
+                part_revision=line.part_revision,
+                do_not_load=line.do_not_load,
+                references=line.references,
+                quantity=line.quantity,
+                extended_quantity=line.extended_quantity,
+            ))
         return flat_bom
 
     def where_used(self):
@@ -602,16 +602,16 @@ class PartRevision(models.Model):
         return used_in_pr
 
     def where_used_full(self):
-        def where_used_given_part(used_in_parts, part):
-            where_used = part.where_used()
-            used_in_parts.update(where_used)
-            for p in where_used:
-                where_used_given_part(used_in_parts, p)
-            return used_in_parts
+        return list(PartRevision.objects.filter(descendant_closures__descendant=self, descendant_closures__depth__gt=0).distinct())
 
-        used_in_parts = set()
-        where_used_given_part(used_in_parts, self)
-        return list(used_in_parts)
+    def contains(self, part_revision):
+        return PartRevisionClosure.objects.filter(ancestor=self, descendant=part_revision, depth__gt=0).exists()
+
+    def would_create_cycle(self, part_revision):
+        # Whether using part_revision in this revision's assembly would make a part revision contain itself. Every
+        # revision that shares the assembly gets the new subpart too.
+        parents = PartRevision.objects.filter(assembly_id=self.assembly_id) if self.assembly_id else PartRevision.objects.filter(id=self.id)
+        return PartRevisionClosure.would_create_cycle(part_revision, parents)
 
     def next_revision(self):
         try:
@@ -653,6 +653,225 @@ class Subpart(models.Model):
 
 class Assembly(models.Model):
     subparts = models.ManyToManyField(Subpart, related_name='assemblies', through='AssemblySubparts')
+    # Hash of the whole BOM below this assembly, see assembly_content_hash. Kept current by the receivers in signals.py.
+    content_hash = models.CharField(max_length=64, default=EMPTY_ASSEMBLY_HASH, db_index=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        # content_hash is kept current by update_content_hashes, an instance loaded before a change mustn't write its
+        # stale hash back
+        if not self._state.adding and 'update_fields' not in kwargs:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields if not field.primary_key and field.name != 'content_hash']
+        super(Assembly, self).save(*args, **kwargs)
+
+    def copy(self):
+        # A new assembly with a copy of each subpart, for a new part revision to edit without changing this one. It has
+        # the same content, so it takes this content hash as is. The subparts and their rows in the assembly are inserted
+        # in bulk, which sends no signals: the BOM closure is linked once the copy is given to a part revision.
+        with transaction.atomic():
+            assembly = Assembly.objects.create(content_hash=self.content_hash)
+            subparts = [Subpart(part_revision_id=subpart.part_revision_id, count=subpart.count, reference=subpart.reference, do_not_load=subpart.do_not_load)
+                        for subpart in Subpart.objects.filter(assemblies=self).order_by('assemblysubparts__id')]
+            subparts = Subpart.objects.bulk_create(subparts)
+            subpart_ids = [subpart.id for subpart in subparts]
+            if None in subpart_ids:
+                # Backends that don't return the ids of rows inserted in bulk: the subparts are the last ones inserted, no
+                # other transaction can insert any until this one commits
+                subpart_ids = sorted(Subpart.objects.order_by('-id').values_list('id', flat=True)[:len(subparts)])
+            AssemblySubparts.objects.bulk_create([AssemblySubparts(assembly=assembly, subpart_id=subpart_id) for subpart_id in subpart_ids])
+        return assembly
+
+    def compute_content_hash(self):
+        return assembly_content_hash(Subpart.objects.filter(assemblies=self).values_list(
+            'part_revision_id', 'count', 'reference', 'do_not_load', 'part_revision__assembly__content_hash'))
+
+    @staticmethod
+    def update_content_hashes(assembly_ids):
+        # Rehashes assembly_ids and then every assembly that uses a part revision above them, ordered by their longest
+        # path down to one of assembly_ids, so that each assembly is rehashed after all of its children that changed
+        assembly_ids = set(assembly_ids) - {None}
+        if not assembly_ids:
+            return
+        depths = {assembly_id: 0 for assembly_id in assembly_ids}
+        parents = PartRevisionClosure.objects.filter(descendant__assembly_id__in=assembly_ids)\
+            .exclude(ancestor__assembly_subpart__assemblies=None)\
+            .values_list('ancestor__assembly_subpart__assemblies').annotate(max_depth=models.Max('depth'))
+        for assembly_id, depth in parents:
+            depths[assembly_id] = max(depth + 1, depths.get(assembly_id, 0))
+
+        for assembly in sorted(Assembly.objects.filter(id__in=depths.keys()), key=lambda a: depths[a.id]):
+            content_hash = assembly.compute_content_hash()
+            if content_hash != assembly.content_hash:
+                Assembly.objects.filter(id=assembly.id).update(content_hash=content_hash)
+
+    @staticmethod
+    def rebuild_content_hashes():
+        rebuild_content_hashes(PartRevision, AssemblySubparts, Assembly)
+
+
+class PartRevisionSnapshot(models.Model):
+    """
+    The indented BOM of a released PartRevision, frozen when it was released. See encode_bom_snapshot for the format.
+    """
+    part_revision = models.OneToOneField(PartRevision, related_name='bom_snapshot', on_delete=models.CASCADE)
+    timestamp = models.DateTimeField(default=timezone.now)
+    data = models.BinaryField()
+
+    @staticmethod
+    def take(part_revision):
+        from .explosion import encode_bom_snapshot, live_bom_tree
+
+        data = encode_bom_snapshot(live_bom_tree(part_revision).lines())
+        PartRevisionSnapshot.objects.update_or_create(part_revision=part_revision, defaults={'data': data, 'timestamp': timezone.now()})
+
+
+# Every (ancestor, descendant) pair of part revisions in the BOM graph, with the number of paths between them at each
+# depth. Each part revision is its own ancestor at depth 0. Kept current by the receivers in signals.py.
+class PartRevisionClosure(models.Model):
+    ancestor = models.ForeignKey(PartRevision, related_name='descendant_closures', on_delete=models.CASCADE)
+    descendant = models.ForeignKey(PartRevision, related_name='ancestor_closures', on_delete=models.CASCADE)
+    depth = models.PositiveIntegerField(default=0)
+    path_count = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = (('ancestor', 'descendant', 'depth'),)
+        index_together = [['descendant', 'depth']]
+
+    @staticmethod
+    def adjust(parent_ids, child_id, paths=1):
+        """
+        Adds the paths that go through an edge from each of parent_ids to child_id, paths times over, or removes them
+        for negative paths. An edge that would close a cycle is left out of the closure, as in closure_rows, and recorded as a
+        PartRevisionCycleEdge instead. Removing an edge takes it off that record first, so that only paths that were
+        added are removed, and the recorded edges that no longer close a cycle then go into the closure.
+        """
+        parent_ids = list(parent_ids)
+        if child_id is None or not parent_ids or not paths:
+            return
+        if paths > 0:
+            cycle_parent_ids = set(PartRevisionClosure.objects.filter(ancestor_id=child_id, descendant_id__in=parent_ids)
+                                   .values_list('descendant_id', flat=True))
+            for parent_id in cycle_parent_ids:
+                PartRevisionCycleEdge.record(parent_id, child_id, paths)
+            PartRevisionClosure.add_paths([parent_id for parent_id in parent_ids if parent_id not in cycle_parent_ids], child_id, paths)
+            return
+
+        parent_ids_by_paths = defaultdict(list)
+        edges = {edge.parent_id: edge for edge in PartRevisionCycleEdge.objects.filter(parent_id__in=parent_ids, child_id=child_id)}
+        for parent_id in parent_ids:
+            recorded_paths = edges[parent_id].take(-paths) if parent_id in edges else 0
+            parent_ids_by_paths[paths + recorded_paths].append(parent_id)
+        for parent_paths, paths_parent_ids in parent_ids_by_paths.items():
+            PartRevisionClosure.add_paths(paths_parent_ids, child_id, parent_paths)
+        if any(parent_ids_by_paths.keys()):
+            PartRevisionCycleEdge.add_acyclic()
+
+    @staticmethod
+    def add_paths(parent_ids, child_id, paths):
+        # Adds or removes the paths through edges from parent_ids to child_id that close no cycle
+        if not parent_ids or not paths:
+            return
+        ancestors = list(PartRevisionClosure.objects.filter(descendant_id__in=parent_ids).values_list('ancestor_id', 'depth', 'path_count'))
+        descendants = list(PartRevisionClosure.objects.filter(ancestor_id=child_id).values_list('descendant_id', 'depth', 'path_count'))
+
+        deltas = defaultdict(int)
+        for ancestor_id, ancestor_depth, ancestor_paths in ancestors:
+            for descendant_id, descendant_depth, descendant_paths in descendants:
+                deltas[(ancestor_id, descendant_id, ancestor_depth + descendant_depth + 1)] += ancestor_paths * descendant_paths * paths
+
+        existing = {(row.ancestor_id, row.descendant_id, row.depth): row for row in PartRevisionClosure.objects.filter(
+            ancestor_id__in={key[0] for key in deltas}, descendant_id__in={key[1] for key in deltas})}
+        created, updated, deleted_ids = [], [], []
+        for (ancestor_id, descendant_id, depth), delta in deltas.items():
+            row = existing.get((ancestor_id, descendant_id, depth))
+            if row is None:
+                if delta > 0:
+                    created.append(PartRevisionClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=depth, path_count=delta))
+            elif row.path_count + delta > 0:
+                row.path_count += delta
+                updated.append(row)
+            else:
+                deleted_ids.append(row.id)
+        PartRevisionClosure.objects.bulk_create(created)
+        PartRevisionClosure.objects.bulk_update(updated, ['path_count'])
+        PartRevisionClosure.objects.filter(id__in=deleted_ids).delete()
+
+    @staticmethod
+    def would_create_cycle(part_revision, parents):
+        # A part revision can go below parents unless it already contains, or is, one of them
+        return PartRevisionClosure.objects.filter(ancestor=part_revision, descendant__in=parents).exists()
+
+    @staticmethod
+    def rebuild():
+        rebuild_closure(PartRevision, AssemblySubparts, PartRevisionClosure, PartRevisionCycleEdge)
+
+
+# An edge of the BOM graph from parent to child, count times over, that closed a cycle when it was added and so was left
+# out of PartRevisionClosure. See PartRevisionClosure.adjust.
+class PartRevisionCycleEdge(models.Model):
+    parent = models.ForeignKey(PartRevision, related_name='cycle_child_edges', on_delete=models.CASCADE)
+    child = models.ForeignKey(PartRevision, related_name='cycle_parent_edges', on_delete=models.CASCADE)
+    count = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = (('parent', 'child'),)
+
+    @staticmethod
+    def record(parent_id, child_id, count):
+        edge, created = PartRevisionCycleEdge.objects.get_or_create(parent_id=parent_id, child_id=child_id, defaults={'count': count})
+        if not created:
+            edge.count += count
+            edge.save()
+
+    def take(self, count):
+        # Takes up to count of this edge off the record, returning how many were
+        count = min(count, self.count)
+        self.count -= count
+        if self.count > 0:
+            self.save()
+        else:
+            self.delete()
+        return count
+
+    @staticmethod
+    def add_acyclic():
+        # Moves the recorded edges that no longer close a cycle, now that paths were removed, into the closure
+        for edge in PartRevisionCycleEdge.objects.all():
+            if not PartRevisionClosure.objects.filter(ancestor_id=edge.child_id, descendant_id=edge.parent_id).exists():
+                edge.delete()
+                PartRevisionClosure.add_paths([edge.parent_id], edge.child_id, edge.count)
+
+
+# The numeric fields of each part revision that have units, in the SI base unit of their quantity, so that ranges such
+# as '10k-100k Ω' can be searched across units. Kept current by part_revision_post_save in signals.py.
+class PartRevisionParameter(models.Model):
+    part_revision = models.ForeignKey(PartRevision, related_name='parameters', on_delete=models.CASCADE)
+    name = models.CharField(max_length=32)
+    quantity = models.CharField(max_length=16)
+    value = models.FloatField()
+
+    class Meta:
+        index_together = [['quantity', 'value']]
+
+    @staticmethod
+    def update(part_revisions):
+        part_revisions = list(part_revisions)
+        PartRevisionParameter.objects.filter(part_revision__in=part_revisions).delete()
+        PartRevisionParameter.objects.bulk_create([
+            PartRevisionParameter(part_revision=part_revision, name=name, quantity=quantity, value=value)
+            for part_revision in part_revisions for name, quantity, value in part_revision_parameters(part_revision)
+        ])
+
+    @staticmethod
+    def matching(filters):
+        # Part revisions with a parameter in the range of every one of filters, see parameters.ParameterFilter
+        part_revisions = PartRevision.objects.all()
+        for parameter_filter in filters:
+            part_revisions = part_revisions.filter(id__in=PartRevisionParameter.objects.filter(**parameter_filter.lookups()).values('part_revision_id'))
+        return part_revisions
+
+    @staticmethod
+    def rebuild():
+        rebuild_parameters(PartRevision, PartRevisionParameter)
 
 
 class ManufacturerPart(models.Model, AsDictModel):
@@ -671,6 +890,18 @@ class ManufacturerPart(models.Model, AsDictModel):
     def seller_parts(self):
         return SellerPart.objects.filter(manufacturer_part=self).order_by('seller', 'minimum_order_quantity')
 
+    @staticmethod
+    def manufacturer_part_number_trigrams():
+        return TrigramIndex(ManufacturerPart, 'manufacturer_part_number', ManufacturerPartTrigram, 'manufacturer_part')
+
+    @staticmethod
+    def by_part(part_ids):
+        # Manufacturer parts of each of part_ids by part id, with their manufacturers, in a single query
+        manufacturer_parts = defaultdict(list)
+        for manufacturer_part in ManufacturerPart.objects.filter(part_id__in=part_ids).select_related('manufacturer').order_by('id'):
+            manufacturer_parts[manufacturer_part.part_id].append(manufacturer_part)
+        return manufacturer_parts
+
     def optimal_seller(self, quantity=None):
         if quantity is None:
             qty_cache_key = str(self.part.id) + '_qty'
@@ -688,6 +919,24 @@ class ManufacturerPart(models.Model, AsDictModel):
         return u'%s' % (self.manufacturer_part_number)
 
 
+# Trigrams of manufacturer names and manufacturer part numbers for substring and fuzzy search, see TrigramIndex. They
+# are kept up to date by signals, except on PostgreSQL where pg_trgm indexes the fields themselves.
+class ManufacturerTrigram(models.Model):
+    manufacturer = models.ForeignKey(Manufacturer, on_delete=models.CASCADE)
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        unique_together = (('trigram', 'manufacturer'),)
+
+
+class ManufacturerPartTrigram(models.Model):
+    manufacturer_part = models.ForeignKey(ManufacturerPart, on_delete=models.CASCADE)
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        unique_together = (('trigram', 'manufacturer_part'),)
+
+
 class Seller(models.Model, AsDictModel):
     organization = models.ForeignKey(Organization, on_delete=models.CASCADE)
     name = models.CharField(max_length=128, default=None)
@@ -727,6 +976,34 @@ class SellerPart(models.Model, AsDictModel):
             'nre_cost': self.nre_cost
         }
 
+    @staticmethod
+    def by_part(part_ids):
+        # Seller parts of each of part_ids by part id, with what BOM costing and exports use loaded in the same query
+        seller_parts = defaultdict(list)
+        for seller_part in SellerPart.objects.filter(manufacturer_part__part_id__in=part_ids)\
+                .select_related('seller', 'manufacturer_part__manufacturer').order_by('id'):
+            seller_parts[seller_part.manufacturer_part.part_id].append(seller_part)
+        return seller_parts
+
+    @staticmethod
+    def optimal_for(part_quantities, seller_parts=None, price_breaks=None):
+        """
+        The optimal seller part for each (part id, total extended quantity) of part_quantities, in the same order, or
+        None for a part that has none. Seller parts are looked up in price_breaks, as returned by price_breaks_by_part,
+        which is built from seller_parts, as returned by by_part, or from seller parts loaded in a single query. A part
+        bought in the same quantity more than once is only resolved once.
+        """
+        part_quantities = list(part_quantities)
+        if price_breaks is None:
+            if seller_parts is None:
+                seller_parts = SellerPart.by_part({part_id for part_id, _ in part_quantities})
+            price_breaks = price_breaks_by_part(seller_parts)
+        optimal = {}
+        for part_id, quantity in part_quantities:
+            if (part_id, quantity) not in optimal:
+                optimal[(part_id, quantity)] = price_breaks[part_id].optimal(quantity) if part_id in price_breaks else None
+        return [optimal[part_quantity] for part_quantity in part_quantities]
+
     @staticmethod
     def optimal(sellerparts, quantity):
         seller = None
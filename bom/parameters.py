@@ -0,0 +1,154 @@
+import re
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+
+# Stored values are compared with this much relative slack, for quantities that went through different float roundings
+PARAMETER_TOLERANCE = 1e-9
+
+# How the unit choices of each PartRevision field convert to the quantity's SI base unit: a value in the unit is
+# value * scale + offset in the base unit. Temperatures are kept in kelvin, masses in kilograms and memory in bytes.
+RESISTANCE = {'Ohms': (1,), 'mOhms': ('1e-3',), 'kOhms': ('1e3',), 'MOhms': ('1e6',)}
+CAPACITANCE = {'F': (1,), 'pF': ('1e-12',), 'nF': ('1e-9',), 'uF': ('1e-6',)}
+VOLTAGE = {'V': (1,), 'uV': ('1e-6',), 'mV': ('1e-3',), 'kV': ('1e3',), 'MV': ('1e6',)}
+CURRENT = {'A': (1,), 'uA': ('1e-6',), 'mA': ('1e-3',), 'kA': ('1e3',), 'MA': ('1e6',)}
+INDUCTANCE = {'H': (1,), 'nH': ('1e-9',), 'mH': ('1e-3',), 'uH': ('1e-6',)}
+FREQUENCY = {'Hz': (1,), 'kHz': ('1e3',), 'MHz': ('1e6',), 'GHz': ('1e9',)}
+POWER = {'W': (1,), 'uW': ('1e-6',), 'mW': ('1e-3',), 'kW': ('1e3',), 'MW': ('1e6',)}
+TEMPERATURE = {'C': (1, '273.15'), 'F': (Decimal(5) / 9, Decimal('273.15') - Decimal(32) * 5 / 9)}
+LENGTH = {'mil': ('0.0000254',), 'in': ('0.0254',), 'ft': ('0.3048',), 'yd': ('0.9144',), 'km': ('1e3',), 'm': (1,), 'cm': ('1e-2',),
+          'mm': ('1e-3',), 'um': ('1e-6',), 'nm': ('1e-9',), 'A': ('1e-10',)}
+MASS = {'mg': ('1e-6',), 'g': ('1e-3',), 'kg': (1,), 'oz': ('0.028349523125',), 'lb': ('0.45359237',)}
+MEMORY = {'KB': ('1e3',), 'MB': ('1e6',), 'GB': ('1e9',), 'TB': ('1e12',)}
+
+# The quantity of the value of a part revision depends on its units. 'F' is in VALUE_UNITS both as farads and as
+# degrees Fahrenheit, it is taken to be farads.
+VALUE_QUANTITIES = {
+    'resistance': RESISTANCE,
+    'capacitance': CAPACITANCE,
+    'voltage': VOLTAGE,
+    'current': CURRENT,
+    'temperature': {'C': TEMPERATURE['C']},
+    'inductance': INDUCTANCE,
+    'frequency': FREQUENCY,
+}
+
+# PartRevision fields with units, other than value, and the quantity and units of each
+PARAMETER_FIELDS = {
+    'length': ('length', LENGTH),
+    'width': ('length', LENGTH),
+    'height': ('length', LENGTH),
+    'wavelength': ('length', LENGTH),
+    'weight': ('mass', MASS),
+    'temperature_rating': ('temperature', TEMPERATURE),
+    'frequency': ('frequency', FREQUENCY),
+    'memory': ('memory', MEMORY),
+    'power_rating': ('power', POWER),
+    'supply_voltage': ('voltage', VOLTAGE),
+    'voltage_rating': ('voltage', VOLTAGE),
+    'current_rating': ('current', CURRENT),
+}
+
+# Units that can be searched for, with the quantity and conversion of each, and the SI prefixes they can take
+SEARCH_UNITS = {
+    'Ω': ('resistance', (1,)), 'ohm': ('resistance', (1,)), 'ohms': ('resistance', (1,)),
+    'F': ('capacitance', (1,)), 'H': ('inductance', (1,)), 'V': ('voltage', (1,)), 'A': ('current', (1,)),
+    'W': ('power', (1,)), 'Hz': ('frequency', (1,)), 'm': ('length', (1,)), 'g': ('mass', ('1e-3',)),
+    'B': ('memory', (1,)), '°C': ('temperature', TEMPERATURE['C']), '°F': ('temperature', TEMPERATURE['F']),
+}
+SI_PREFIXES = {'': 1, 'p': '1e-12', 'n': '1e-9', 'u': '1e-6', 'µ': '1e-6', 'μ': '1e-6', 'm': '1e-3', 'k': '1e3', 'K': '1e3', 'M': '1e6',
+               'G': '1e9', 'T': '1e12'}
+
+NUMBER = r'\d+(?:\.\d+)?|\.\d+'
+PREFIX = f'[{"".join(prefix for prefix in SI_PREFIXES if prefix)}]?'
+# Longest units first, so that 'Hz' isn't taken for 'H'. Ohms can be spelled in any case.
+UNIT = '|'.join(f'(?i:{unit})' if unit.startswith('ohm') else re.escape(unit) for unit in sorted(SEARCH_UNITS, key=len, reverse=True))
+PARAMETER_FILTER = re.compile(
+    rf'(?<![\w.])(?:(?P<operator>>=|<=|≥|≤|>|<)\s*)?(?P<low>{NUMBER})\s*(?P<low_prefix>{PREFIX})'
+    rf'(?:\s*(?:-|–|—|\.\.|to)\s*(?P<high>{NUMBER})\s*(?P<high_prefix>{PREFIX}))?\s*(?P<unit>{UNIT})(?!\w)')
+
+
+def to_base_units(value, conversion):
+    scale, offset = (tuple(Decimal(str(factor)) for factor in conversion) + (Decimal(0),))[:2]
+    return float(Decimal(value) * scale + offset)
+
+
+def part_revision_parameters(part_revision):
+    # (field name, quantity, value in SI base units) for each field of part_revision with a value and known units
+    parameters = []
+    for quantity, units in VALUE_QUANTITIES.items():
+        if part_revision.value_units in units:
+            try:
+                value = Decimal((part_revision.value or '').strip())
+            except InvalidOperation:
+                break  # Not a number, such as a value with its units typed in
+            if value.is_finite():
+                parameters.append(('value', quantity, to_base_units(value, units[part_revision.value_units])))
+            break
+    for name, (quantity, units) in PARAMETER_FIELDS.items():
+        value, value_units = getattr(part_revision, name), getattr(part_revision, f'{name}_units')
+        if value is not None and value_units in units:
+            parameters.append((name, quantity, to_base_units(value, units[value_units])))
+    return parameters
+
+
+def rebuild_parameters(part_revision_model, parameter_model, batch_size=1000):
+    # Model classes are passed in so that migrations can use their historical models
+    parameter_model.objects.all().delete()
+    parameter_model.objects.bulk_create([
+        parameter_model(part_revision_id=part_revision.id, name=name, quantity=quantity, value=value)
+        for part_revision in part_revision_model.objects.all().iterator() for name, quantity, value in part_revision_parameters(part_revision)
+    ], batch_size=batch_size)
+
+
+class ParameterFilter(namedtuple('ParameterFilter', ['quantity', 'low', 'high', 'low_inclusive', 'high_inclusive'])):
+    """
+    A range of a quantity in SI base units, either end of which may be open (None), parsed from searches such as
+    '10k-100k Ω', '>=50 V' or '4.7uF'.
+    """
+
+    @classmethod
+    def from_match(cls, match):
+        quantity, conversion = SEARCH_UNITS[match['unit'].lower() if match['unit'].lower().startswith('ohm') else match['unit']]
+
+        def value(number, prefix):
+            return to_base_units(Decimal(number) * Decimal(str(SI_PREFIXES[prefix])), conversion)
+
+        low = value(match['low'], match['low_prefix'])
+        if match['high'] is not None:
+            low, high = sorted((low, value(match['high'], match['high_prefix'])))
+            return cls(quantity, low, high, True, True)
+        operator = match['operator']
+        if operator in ('>=', '≥', '>'):
+            return cls(quantity, low, None, operator != '>', False)
+        if operator in ('<=', '≤', '<'):
+            return cls(quantity, None, low, False, operator != '<')
+        return cls(quantity, low, low, True, True)
+
+    def lookups(self):
+        # Field lookups of PartRevisionParameter for the values in the range
+        lookups = {'quantity': self.quantity}
+        if self.low is not None:
+            slack = abs(self.low) * PARAMETER_TOLERANCE
+            lookups.update({'value__gte': self.low - slack} if self.low_inclusive else {'value__gt': self.low + slack})
+        if self.high is not None:
+            slack = abs(self.high) * PARAMETER_TOLERANCE
+            lookups.update({'value__lte': self.high + slack} if self.high_inclusive else {'value__lt': self.high - slack})
+        return lookups
+
+
+def parse_parameter_filters(query):
+    """
+    Takes the ranges of quantities with units out of a search query, returning them as ParameterFilters along with
+    the rest of the query. Anything inside double quotes is left as it is.
+    """
+    quoted = [match.span() for match in re.finditer(r'"[^"]*"', query)]
+    filters, rest, position = [], [], 0
+    for match in PARAMETER_FILTER.finditer(query):
+        if any(start < match.end() and match.start() < end for start, end in quoted):
+            continue
+        filters.append(ParameterFilter.from_match(match))
+        rest.append(query[position:match.start()])
+        position = match.end()
+    rest.append(query[position:])
+    return filters, ' '.join(rest)
@@ -1,13 +1,68 @@
 import logging
 from collections import OrderedDict
+from decimal import Decimal
+from itertools import groupby
+from math import ceil
+
+from django.core.cache import cache
 
 from djmoney.money import Money
 
 from .base_classes import AsDictModel
+from .exchange_rates import ExchangeRates
 
 
 logger = logging.getLogger(__name__)
 
+ZERO = Decimal(0)
+
+
+def decimal_quantity(quantity):
+    # The Decimal that Money multiplies by for a quantity, floats going through their shortest repr
+    if isinstance(quantity, Decimal):
+        return quantity
+    return Decimal(quantity) if isinstance(quantity, int) else Decimal(str(quantity))
+
+
+def top_level_quantity_buying(item_quantity, extended_quantity):
+    # The lowest top level quantity at which an item of extended_quantity is bought in item_quantity or more
+    quantity = ceil(item_quantity / extended_quantity)
+    while int(quantity * extended_quantity) < item_quantity:
+        quantity += 1
+    while int((quantity - 1) * extended_quantity) >= item_quantity:
+        quantity -= 1
+    return quantity
+
+
+class CostTotal:
+    """
+    A running total of costs, kept as a plain Decimal amount per currency code so that adding to it doesn't create
+    Money objects or check currencies. It only becomes Money when read, in the currency of the BOM, with any other
+    currency converted at that point.
+    """
+    __slots__ = ('currency', 'amounts')
+
+    def __init__(self, currency, money=None):
+        self.currency = str(currency)
+        self.amounts = {}
+        if money is not None:
+            self.add(money)
+
+    def add(self, money, quantity=1):
+        if money is None:
+            return
+        amount = money.amount if quantity == 1 else money.amount * decimal_quantity(quantity)
+        currency = money.currency.code
+        self.amounts[currency] = self.amounts.get(currency, ZERO) + amount
+
+    def money(self, exchange_rates=None):
+        amount = self.amounts.get(self.currency, ZERO)
+        for currency, other_amount in self.amounts.items():
+            if currency != self.currency:
+                exchange_rates = exchange_rates or ExchangeRates()
+                amount += other_amount * exchange_rates.rate(currency, self.currency)
+        return Money(amount, self.currency)
+
 
 class PartBom(AsDictModel):
     def __init__(self, part_revision, quantity, unit_cost=None, missing_item_costs=0, nre_cost=None, out_of_pocket_cost=None):
@@ -15,17 +70,39 @@ class PartBom(AsDictModel):
         self.parts = OrderedDict()
         self.quantity = quantity
         self._currency = self.part_revision.part.organization.currency
-        if unit_cost is None:
-            unit_cost = Money(0, self._currency)
-        if nre_cost is None:
-            nre_cost = Money(0, self._currency)
-        if out_of_pocket_cost is None:
-            out_of_pocket_cost = Money(0, self._currency)
-
-        self.unit_cost = unit_cost
+        self._unit_cost = CostTotal(self._currency, unit_cost)
         self.missing_item_costs = missing_item_costs  # count of items that have no cost
-        self.nre_cost = nre_cost
-        self.out_of_pocket_cost = out_of_pocket_cost  # cost of buying self.quantity with MOQs
+        self._nre_cost = CostTotal(self._currency, nre_cost)
+        self._out_of_pocket_cost = CostTotal(self._currency, out_of_pocket_cost)  # cost of buying self.quantity with MOQs
+        self._seller_parts = None
+        self._price_breaks = None
+        self._manufacturer_parts = None
+        self._exchange_rates = ExchangeRates()
+
+    # Costs are totalled in CostTotals while the BOM is costed, and only made Money when read
+    @property
+    def unit_cost(self):
+        return self._unit_cost.money(self._exchange_rates)
+
+    @unit_cost.setter
+    def unit_cost(self, value):
+        self._unit_cost = CostTotal(self._currency, value)
+
+    @property
+    def nre_cost(self):
+        return self._nre_cost.money(self._exchange_rates)
+
+    @nre_cost.setter
+    def nre_cost(self, value):
+        self._nre_cost = CostTotal(self._currency, value)
+
+    @property
+    def out_of_pocket_cost(self):
+        return self._out_of_pocket_cost.money(self._exchange_rates)
+
+    @out_of_pocket_cost.setter
+    def out_of_pocket_cost(self, value):
+        self._out_of_pocket_cost = CostTotal(self._currency, value)
 
     def cost(self):
         return self.unit_cost * self.quantity
@@ -33,7 +110,8 @@ class PartBom(AsDictModel):
     def total_out_of_pocket_cost(self):
         return self.out_of_pocket_cost + self.nre_cost
 
-    def append_item_and_update(self, item):
+    def append_item(self, item):
+        # Adds an item to the structure of this BOM without costing it, repeated items are merged into the first one
         if item.bom_id in self.parts:
             self.parts[item.bom_id].extended_quantity += item.extended_quantity
             ref = ', ' + item.references
@@ -41,40 +119,217 @@ class PartBom(AsDictModel):
         else:
             self.parts[item.bom_id] = item
 
-            item.total_extended_quantity = int(self.quantity) * item.extended_quantity
-            self.update_bom_for_part(item)
-
     def update_bom_for_part(self, bom_part):
         if bom_part.do_not_load:
             bom_part.order_quantity = 0
-            bom_part.order_cost = 0
             return
 
-        if bom_part.seller_part:
-            try:
-                bom_part.order_quantity = bom_part.seller_part.order_quantity(bom_part.total_extended_quantity)
-                bom_part.order_cost = bom_part.total_extended_quantity * bom_part.seller_part.unit_cost
-            except AttributeError:
-                pass
-            self.unit_cost = (self.unit_cost + bom_part.seller_part.unit_cost * bom_part.extended_quantity) if bom_part.seller_part.unit_cost is not None else self.unit_cost
-            self.out_of_pocket_cost = self.out_of_pocket_cost + bom_part.out_of_pocket_cost()
-            self.nre_cost = (self.nre_cost + bom_part.seller_part.nre_cost) if bom_part.seller_part.nre_cost is not None else self.nre_cost
+        seller_part = bom_part.seller_part
+        if seller_part:
+            if bom_part.total_extended_quantity is not None:
+                bom_part.order_quantity = seller_part.order_quantity(bom_part.total_extended_quantity)
+            self._unit_cost.add(seller_part.unit_cost, bom_part.extended_quantity)
+            if bom_part.order_quantity is not None:
+                self._out_of_pocket_cost.add(seller_part.unit_cost, bom_part.order_quantity)
+            self._nre_cost.add(seller_part.nre_cost)
         else:
             self.missing_item_costs += 1
 
     def update(self):
         self.missing_item_costs = 0
-        self.unit_cost = Money(0, self._currency)
-        self.out_of_pocket_cost = Money(0, self._currency)
-        self.nre_cost = Money(0, self._currency)
-        for _, bom_part in self.parts.items():
+        self._unit_cost = CostTotal(self._currency)
+        self._out_of_pocket_cost = CostTotal(self._currency)
+        self._nre_cost = CostTotal(self._currency)
+        for bom_part in self.items():
             self.update_bom_for_part(bom_part)
 
+    def items(self):
+        # parts is a list rather than a dict once a flat BOM has been sorted
+        return list(self.parts.values()) if isinstance(self.parts, dict) else list(self.parts)
+
+    def seller_parts(self):
+        # Every seller part of every part in this BOM, by part id, loaded in a single query and kept for recosting
+        from .models import SellerPart
+
+        if self._seller_parts is None:
+            self._seller_parts = SellerPart.by_part({item.part_revision.part_id for item in self.items()})
+        return self._seller_parts
+
+    def price_breaks(self):
+        # The seller parts of every part in this BOM indexed for optimal seller lookups, kept for recosting
+        from .price_breaks import price_breaks_by_part
+
+        if self._price_breaks is None:
+            self._price_breaks = price_breaks_by_part(self.seller_parts(), currency=self._currency, exchange_rates=self._exchange_rates)
+        return self._price_breaks
+
+    def exchange_rates(self):
+        # The exchange rates this BOM converts its costs into the organization's currency with
+        return self._exchange_rates
+
+    def manufacturer_parts_by_part(self):
+        # Every manufacturer part of every part in this BOM, by part id, loaded in a single query
+        from .models import ManufacturerPart
+
+        if self._manufacturer_parts is None:
+            self._manufacturer_parts = ManufacturerPart.by_part({item.part_revision.part_id for item in self.items()})
+        return self._manufacturer_parts
+
+    def recost(self, quantity, seller_parts=None, price_breaks=None):
+        """
+        Costs this BOM for a new top level quantity. The structure and extended quantities don't depend on it, so only
+        the seller choice for each item and the update_bom_for_part totals are redone, without going to the database
+        once the seller parts are loaded.
+        """
+        from .models import SellerPart
+
+        if seller_parts is not None:
+            self._seller_parts = seller_parts
+            self._price_breaks = price_breaks
+        self.quantity = quantity
+        items = self.items()
+        optimal_seller_parts = SellerPart.optimal_for(
+            ((item.part_revision.part_id, int(quantity * item.extended_quantity)) for item in items), price_breaks=self.price_breaks())
+        for item, seller_part in zip(items, optimal_seller_parts):
+            item.seller_part = seller_part
+            item.total_extended_quantity = int(quantity) * item.extended_quantity
+            item.order_quantity = None
+        self.update()
+        return self
+
+    def quantity_sweep(self, quantities):
+        # Costs this BOM at each top level quantity from one load of the seller parts, rather than re-exploding it per
+        # quantity. Seller choice, order quantity and costs follow recost.
+        from .models import SellerPart
+
+        items = [item for item in self.items() if not item.do_not_load]
+        price_breaks = self.price_breaks()
+        sweep = []
+        for quantity in quantities:
+            unit_cost = CostTotal(self._currency)
+            out_of_pocket_cost = CostTotal(self._currency)
+            nre_cost = CostTotal(self._currency)
+            missing_item_costs = 0
+            optimal_seller_parts = SellerPart.optimal_for(
+                ((item.part_revision.part_id, int(quantity * item.extended_quantity)) for item in items), price_breaks=price_breaks)
+            for item, seller_part in zip(items, optimal_seller_parts):
+                if seller_part is None:
+                    missing_item_costs += 1
+                    continue
+                order_quantity = seller_part.order_quantity(int(quantity) * item.extended_quantity)
+                unit_cost.add(seller_part.unit_cost, item.extended_quantity)
+                out_of_pocket_cost.add(seller_part.unit_cost, order_quantity)
+                nre_cost.add(seller_part.nre_cost)
+            unit_cost = unit_cost.money(self._exchange_rates)
+            out_of_pocket_cost = out_of_pocket_cost.money(self._exchange_rates)
+            nre_cost = nre_cost.money(self._exchange_rates)
+            sweep.append({
+                'quantity': quantity,
+                'unit_cost': unit_cost,
+                'cost': unit_cost * quantity,
+                'out_of_pocket_cost': out_of_pocket_cost,
+                'nre_cost': nre_cost,
+                'total_out_of_pocket_cost': out_of_pocket_cost + nre_cost,
+                'missing_item_costs': missing_item_costs,
+            })
+        return sweep
+
+    def optimize_purchase(self, seller_order_cost=None):
+        """
+        Buys this BOM at its quantity from the seller parts a PurchasePlan chooses for the whole BOM, rather than the
+        optimal seller part of each item on its own, and recosts the items with them. Returns the plan, whose costs
+        count lines of the same part as one purchase.
+        """
+        from .purchase_plan import PurchasePlan
+
+        quantities = {}
+        items = [item for item in self.items() if not item.do_not_load]
+        for item in items:
+            part_id = item.part_revision.part_id
+            quantities[part_id] = quantities.get(part_id, 0) + int(self.quantity) * item.extended_quantity
+        plan = PurchasePlan(quantities, self.seller_parts(), self._currency, seller_order_cost=seller_order_cost,
+                            exchange_rates=self._exchange_rates)
+        seller_parts = plan.seller_parts()
+        for item in items:
+            item.seller_part = seller_parts.get(item.part_revision.part_id)
+            item.order_quantity = None
+        self.update()
+        return plan
+
+    def cost_curve(self):
+        """
+        The unit cost of this BOM against the top level quantity, as a point for 1 and for each quantity at which the
+        optimal seller part of any item changes. Each part's own price break curve says at which of its quantities
+        that happens, so the totals are only adjusted for the items that change, in order of the top level quantity at
+        which they do, rather than costed again for every quantity. Costs follow quantity_sweep, the cost at a point
+        being its unit cost times its quantity.
+        """
+        items = [item for item in self.items() if not item.do_not_load]
+        price_breaks = self.price_breaks()
+        seller_parts = [price_breaks[item.part_revision.part_id].optimal(int(item.extended_quantity))
+                        if item.part_revision.part_id in price_breaks else None for item in items]
+        unit_cost = CostTotal(self._currency)
+        nre_cost = CostTotal(self._currency)
+        for item, seller_part in zip(items, seller_parts):
+            if seller_part is not None:
+                unit_cost.add(seller_part.unit_cost, item.extended_quantity)
+                nre_cost.add(seller_part.nre_cost)
+        missing_item_costs = seller_parts.count(None)
+        changes = PartBom.cost_curve_changes(items, price_breaks)
+
+        def point(quantity):
+            point_unit_cost = unit_cost.money(self._exchange_rates)
+            return {
+                'quantity': quantity,
+                'unit_cost': point_unit_cost,
+                'cost': point_unit_cost * quantity,
+                'nre_cost': nre_cost.money(self._exchange_rates),
+                'missing_item_costs': missing_item_costs,
+            }
+
+        curve = [point(1)]
+        for quantity, quantity_changes in groupby(changes, key=lambda change: change[0]):
+            changed = False
+            for _, index, seller_part in quantity_changes:
+                previous = seller_parts[index]
+                if seller_part is previous:
+                    continue
+                extended_quantity = items[index].extended_quantity
+                unit_cost.add(previous.unit_cost, -extended_quantity)
+                nre_cost.add(previous.nre_cost, -1)
+                unit_cost.add(seller_part.unit_cost, extended_quantity)
+                nre_cost.add(seller_part.nre_cost)
+                seller_parts[index] = seller_part
+                changed = True
+            if changed:
+                curve.append(point(quantity))
+        return curve
+
+    @staticmethod
+    def cost_curve_changes(items, price_breaks):
+        # Each (top level quantity, item index, seller part) at which the optimal seller part of one of items may
+        # change, from its part's price break curve, sorted by quantity and then item
+        part_curves = {}
+        changes = []
+        for index, item in enumerate(items):
+            part_id = item.part_revision.part_id
+            extended_quantity = item.extended_quantity
+            if part_id not in price_breaks or extended_quantity <= 0:
+                continue
+            if part_id not in part_curves:
+                part_curves[part_id] = price_breaks[part_id].curve(start=0)
+            for item_quantity, seller_part in part_curves[part_id]:
+                if item_quantity > int(extended_quantity):
+                    changes.append((top_level_quantity_buying(item_quantity, extended_quantity), index, seller_part))
+        changes.sort(key=lambda change: change[:2])
+        return changes
+
     def mouser_parts(self):
         mouser_items = {}
+        manufacturer_parts = self.manufacturer_parts_by_part()
         for bom_id, item in self.parts.items():
             if item.part.id not in mouser_items and item.part.number_class.mouser_enabled:
-                for manufacturer_part in item.part.manufacturer_parts():
+                for manufacturer_part in manufacturer_parts.get(item.part.id, []):
                     mouser_items.update({bom_id: manufacturer_part})
                     if not manufacturer_part.mouser_disable:
                         mouser_items.update({bom_id: manufacturer_part})
@@ -99,11 +354,17 @@ class PartBom(AsDictModel):
 
 
 class PartBomItem(AsDictModel):
-    def __init__(self, bom_id, part, part_revision, do_not_load, references, quantity, extended_quantity, seller_part=None):
+    # Large BOMs hold thousands of items, so they keep to a fixed set of slots rather than an instance __dict__. The part
+    # revision and seller part are the model instances shared by every line of the explosion, not copies.
+    __slots__ = ('bom_id', 'part_revision', 'do_not_load', 'references', 'quantity', 'extended_quantity', 'total_extended_quantity',
+                 'order_quantity', 'seller_part', 'api_info')
+    as_dict_fields = ('api_info', 'bom_id', 'do_not_load', 'extended_quantity', 'order_cost', 'order_quantity', 'part', 'part_revision',
+                      'quantity', 'references', 'seller_part', 'total_extended_quantity')
+
+    def __init__(self, bom_id, part_revision, do_not_load, references, quantity, extended_quantity, seller_part=None):
         # top_level_quantity is the highest quantity, typically a order quantity for the highest assembly level in a BOM
         # A bom item should not care about its parent quantity
         self.bom_id = bom_id
-        self.part = part
         self.part_revision = part_revision
         self.do_not_load = do_not_load
         self.references = references
@@ -112,35 +373,52 @@ class PartBomItem(AsDictModel):
         self.extended_quantity = extended_quantity  # extended_quantity, is the item quantity used in the top level assembly (e.g. assuming PartBom.quantity = 1)
         self.total_extended_quantity = None  # extended_quantity * top_level_quantity (PartBom.quantity) - Set when appending to PartBom
         self.order_quantity = None  # order quantity taking into MOQ/MPQ constraints - Set when appending to PartBom
-
-        self._currency = self.part.organization.currency
-
-        self.order_cost = Money(0, self._currency)  # order_cost is updated similar to above order_quantity - Set when appending to PartBom
         self.seller_part = seller_part
 
         self.api_info = None
 
-    def extended_cost(self):
-        try:
-            return self.extended_quantity * self.seller_part.unit_cost
-        except (AttributeError, TypeError) as err:
-            logger.log(logging.INFO, '[part_bom.py] ' + str(err))
+    @property
+    def part(self):
+        return self.part_revision.part
+
+    @property
+    def _currency(self):
+        return self.part_revision.part.organization.currency
+
+    def as_dict_keys(self):
+        return self.as_dict_fields
+
+    @property
+    def order_cost(self):
+        # order_cost follows total_extended_quantity, which is set when appending to PartBom
+        if self.do_not_load:
+            return 0
+        return self.cost_of(self.total_extended_quantity)
+
+    def cost_of(self, quantity):
+        # The cost of quantity of this item from its seller part, or nothing when it has no price yet. Missing prices
+        # are only logged when debug logging is turned on for this module.
+        unit_cost = self.seller_part.unit_cost if self.seller_part is not None else None
+        if unit_cost is None or quantity is None:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('[part_bom.py] No cost for %s of %s', quantity, self)
             return Money(0, self._currency)
+        return Money(unit_cost.amount * decimal_quantity(quantity), unit_cost.currency)
+
+    def extended_cost(self):
+        return self.cost_of(self.extended_quantity)
 
     def out_of_pocket_cost(self):
-        try:
-            return self.order_quantity * self.seller_part.unit_cost
-        except (AttributeError, TypeError) as err:
-            logger.log(logging.INFO, '[part_bom.py] ' + str(err))
-            return Money(0, self._currency)
+        return self.cost_of(self.order_quantity)
 
     def as_dict(self, include_id=False):
         dict = super().as_dict()
         del dict['bom_id']
         return dict
 
-    def as_dict_for_export(self):
-        return {
+    def as_dict_for_export(self, exchange_rates=None):
+        # With costs in the organization's currency when given exchange_rates to convert them with
+        export = {
             'part_number': self.part.full_part_number(),
             'quantity': self.quantity,
             'do_not_load': self.do_not_load,
@@ -162,18 +440,49 @@ class PartBomItem(AsDictModel):
             'part_out_of_pocket_cost': self.out_of_pocket_cost(),
             'part_lead_time_days': self.seller_part.lead_time_days if self.seller_part is not None else 0,
         }
-
-    def manufacturer_parts_for_export(self):
-        return [mp.as_dict_for_export() for mp in self.part.manufacturer_parts(exclude_primary=True)]
-
-    def seller_parts_for_export(self):
-        return [sp.as_dict_for_export() for sp in self.part.seller_parts(exclude_primary=True)]
+        return exchange_rates.convert_values(export, self._currency) if exchange_rates is not None else export
+
+    def primary_optimal_seller(self, seller_parts):
+        # ManufacturerPart.optimal_seller of the primary manufacturer part, picked from the part's seller parts
+        from .models import SellerPart
+
+        primary_id = self.part.primary_manufacturer_part_id
+        if primary_id is None:
+            return None
+        quantity = int(cache.get(str(self.part.id) + '_qty', 100))
+        return SellerPart.optimal([sp for sp in seller_parts if sp.manufacturer_part_id == primary_id], quantity)
+
+    def manufacturer_parts_for_export(self, manufacturer_parts=None, seller_parts=None):
+        # Part.manufacturer_parts(exclude_primary=True), from the part's manufacturer and seller parts when the BOM has
+        # them loaded already
+        if manufacturer_parts is None or seller_parts is None:
+            return [mp.as_dict_for_export() for mp in self.part.manufacturer_parts(exclude_primary=True)]
+        if self.primary_optimal_seller(seller_parts) is not None:
+            manufacturer_parts = [mp for mp in manufacturer_parts if mp.id != self.part.primary_manufacturer_part_id]
+        return [mp.as_dict_for_export() for mp in manufacturer_parts]
+
+    def seller_parts_for_export(self, seller_parts=None, exchange_rates=None):
+        # Part.seller_parts(exclude_primary=True), from the part's seller parts when the BOM has them loaded already,
+        # with costs in the organization's currency when given exchange_rates to convert them with
+        if seller_parts is None:
+            seller_parts = list(self.part.seller_parts(exclude_primary=True))
+        else:
+            primary_optimal_seller = self.primary_optimal_seller(seller_parts)
+            if primary_optimal_seller is not None:
+                seller_parts = [sp for sp in seller_parts if sp.id != primary_optimal_seller.id]
+            seller_parts = sorted(seller_parts, key=lambda sp: (sp.seller_id, sp.minimum_order_quantity, sp.id))
+        if exchange_rates is None:
+            return [sp.as_dict_for_export() for sp in seller_parts]
+        return [exchange_rates.convert_values(sp.as_dict_for_export(), self._currency) for sp in seller_parts]
 
     def __str__(self):
         return f'{self.part.full_part_number()}, qty: {self.quantity}'
 
 
 class PartIndentedBomItem(PartBomItem, AsDictModel):
+    __slots__ = ('indent_level', 'parent_id', 'subpart', 'parent_quantity')
+    as_dict_fields = tuple(sorted(PartBomItem.as_dict_fields + __slots__))
+
     def __init__(self, indent_level, parent_id, subpart, parent_quantity, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.indent_level = indent_level
@@ -181,8 +490,8 @@ class PartIndentedBomItem(PartBomItem, AsDictModel):
         self.subpart = subpart
         self.parent_quantity = parent_quantity
 
-    def as_dict_for_export(self):
-        dict = super().as_dict_for_export()
+    def as_dict_for_export(self, exchange_rates=None):
+        dict = super().as_dict_for_export(exchange_rates=exchange_rates)
         dict.update({
             'level': self.indent_level,
         })
@@ -0,0 +1,84 @@
+from bisect import bisect_left
+
+from .exchange_rates import ExchangeRates
+from .part_bom import decimal_quantity
+
+
+class PriceBreaks:
+    """
+    The seller parts of one part or manufacturer part indexed by minimum order quantity, for picking the optimal one
+    for many quantities. Buying quantity from a seller part costs max(quantity, minimum order quantity) * unit cost, so
+    once the seller parts are sorted by minimum order quantity, the ones below a quantity are best compared by unit
+    cost and the rest by the cost of their minimum order. Both are kept as running minimums of plain Decimal amounts,
+    converted to one currency, making a lookup a bisect and one comparison. Ties go to the seller part that came
+    first, as with SellerPart.optimal.
+    """
+    __slots__ = ('seller_parts', 'minimum_order_quantities', 'lowest_unit_costs', 'lowest_minimum_order_costs')
+
+    def __init__(self, seller_parts, currency=None, exchange_rates=None):
+        # Unit costs are converted to currency, by default that of the first seller part, before they are compared
+        self.seller_parts = list(seller_parts)
+        if currency is None and self.seller_parts:
+            currency = self.seller_parts[0].unit_cost.currency
+        exchange_rates = exchange_rates if exchange_rates is not None else ExchangeRates()
+        unit_costs = [exchange_rates.convert(seller_part.unit_cost, currency).amount for seller_part in self.seller_parts]
+        order = sorted(range(len(self.seller_parts)), key=lambda index: self.seller_parts[index].minimum_order_quantity)
+        self.minimum_order_quantities = [self.seller_parts[index].minimum_order_quantity for index in order]
+
+        # lowest_unit_costs[i] is the lowest (unit cost, index) of the seller parts up to and including the ith
+        self.lowest_unit_costs = []
+        lowest = None
+        for index in order:
+            unit_cost = (unit_costs[index], index)
+            lowest = unit_cost if lowest is None or unit_cost < lowest else lowest
+            self.lowest_unit_costs.append(lowest)
+
+        # lowest_minimum_order_costs[i] is the lowest (minimum order cost, index) of the ith seller part and those after it
+        self.lowest_minimum_order_costs = [None] * len(order)
+        lowest = None
+        for position in reversed(range(len(order))):
+            index = order[position]
+            minimum_order_cost = (self.seller_parts[index].minimum_order_quantity * unit_costs[index], index)
+            lowest = minimum_order_cost if lowest is None or minimum_order_cost < lowest else lowest
+            self.lowest_minimum_order_costs[position] = lowest
+
+    def optimal(self, quantity):
+        # The seller part that buys quantity for the least, or None if there are no seller parts
+        position = bisect_left(self.minimum_order_quantities, quantity)
+        best = self.lowest_minimum_order_costs[position] if position < len(self.minimum_order_quantities) else None
+        if position > 0:
+            unit_cost, index = self.lowest_unit_costs[position - 1]
+            cost = (unit_cost * decimal_quantity(quantity), index)
+            best = cost if best is None or cost < best else best
+        return self.seller_parts[best[1]] if best is not None else None
+
+    def curve(self, start=1):
+        """
+        The optimal seller part for every whole quantity from start on, as (quantity, seller part) pairs for each
+        quantity at which it changes. Between two minimum order quantities the seller parts below both are bought at
+        their unit cost and the rest at their minimum order cost, so the optimal one can only change at a minimum
+        order quantity or where the lowest unit cost overtakes the lowest minimum order cost, and only those
+        quantities are looked up.
+        """
+        quantities = {start}
+        count = len(self.minimum_order_quantities)
+        for position, minimum_order_quantity in enumerate(self.minimum_order_quantities):
+            quantities.update((minimum_order_quantity, minimum_order_quantity + 1))
+            unit_cost = self.lowest_unit_costs[position][0]
+            if position + 1 < count and unit_cost > 0:
+                crossover = int(self.lowest_minimum_order_costs[position + 1][0] / unit_cost)
+                quantities.update((crossover, crossover + 1))
+
+        curve = []
+        for quantity in sorted(quantity for quantity in quantities if quantity >= start):
+            seller_part = self.optimal(quantity)
+            if not curve or curve[-1][1] is not seller_part:
+                curve.append((quantity, seller_part))
+        return curve
+
+
+def price_breaks_by_part(seller_parts, currency=None, exchange_rates=None):
+    # PriceBreaks for each part of seller_parts, as returned by SellerPart.by_part, comparing costs in currency
+    exchange_rates = exchange_rates if exchange_rates is not None else ExchangeRates()
+    return {part_id: PriceBreaks(part_seller_parts, currency=currency, exchange_rates=exchange_rates)
+            for part_id, part_seller_parts in seller_parts.items()}
@@ -0,0 +1,93 @@
+from djmoney.money import Money
+
+from .exchange_rates import ExchangeRates
+from .part_bom import ZERO, decimal_quantity
+
+
+class PurchasePlan:
+    """
+    What to buy to build a flat BOM, choosing the seller part of every part for the whole BOM at once rather than
+    line by line as SellerPart.optimal does.
+
+    Lines of the same part are bought together, so they share one minimum order, one order_quantity() rounding and
+    one NRE. Each part is first given the seller part that buys its total quantity for the least out-of-pocket cost.
+    Each seller used can also cost seller_order_cost, a fixed cost per distributor ordered from such as shipping. If
+    it does, sellers are then dropped greedily while that lowers the total cost: for each seller, starting with the
+    one supplying the fewest parts, its parts move to their cheapest seller part among the other sellers still used,
+    and the move is kept if what it saves in seller order costs outweighs what the parts cost more. This is the drop
+    heuristic for facility location. It isn't guaranteed to be optimal, but each pass is linear in the number of seller
+    parts, so it runs in well under a second for thousands of lines.
+    """
+
+    def __init__(self, quantities, seller_parts, currency, seller_order_cost=None, exchange_rates=None):
+        # quantities is the total quantity to buy of each part by part id, seller_parts the seller parts of each part by
+        # part id, as returned by SellerPart.by_part. Every cost is converted to currency before seller parts are
+        # compared.
+        exchange_rates = exchange_rates if exchange_rates is not None else ExchangeRates()
+        self.currency = currency
+        self.seller_order_cost = exchange_rates.convert(seller_order_cost, currency).amount if seller_order_cost is not None else ZERO
+        self.quantities = quantities
+        self.candidates = {}
+        self.missing_part_ids = []
+        for part_id, quantity in quantities.items():
+            candidates = []
+            for seller_part in seller_parts.get(part_id, []):
+                order_quantity = seller_part.order_quantity(quantity)
+                unit_cost = exchange_rates.convert(seller_part.unit_cost, currency).amount
+                nre_cost = exchange_rates.convert(seller_part.nre_cost, currency).amount
+                cost = unit_cost * decimal_quantity(order_quantity) + nre_cost
+                candidates.append((cost, len(candidates), seller_part, order_quantity))
+            if candidates:
+                self.candidates[part_id] = sorted(candidates, key=lambda candidate: candidate[:2])
+            else:
+                self.missing_part_ids.append(part_id)
+        self.assignments = {part_id: candidates[0] for part_id, candidates in self.candidates.items()}
+        if self.seller_order_cost > 0:
+            self.drop_sellers()
+
+    def parts_by_seller(self):
+        parts = {}
+        for part_id, (_, _, seller_part, _) in self.assignments.items():
+            parts.setdefault(seller_part.seller_id, []).append(part_id)
+        return parts
+
+    def cheapest(self, part_id, seller_ids):
+        # The cheapest candidate of part_id from one of seller_ids
+        return next((candidate for candidate in self.candidates[part_id] if candidate[2].seller_id in seller_ids), None)
+
+    def drop_sellers(self):
+        improved = True
+        while improved:
+            improved = False
+            parts_by_seller = self.parts_by_seller()
+            for seller_id, part_ids in sorted(parts_by_seller.items(), key=lambda seller_parts: (len(seller_parts[1]), seller_parts[0])):
+                other_seller_ids = set(parts_by_seller) - {seller_id}
+                moves = {part_id: self.cheapest(part_id, other_seller_ids) for part_id in part_ids}
+                if None in moves.values():
+                    continue
+                extra_cost = sum(moves[part_id][0] - self.assignments[part_id][0] for part_id in part_ids)
+                if extra_cost < self.seller_order_cost:
+                    self.assignments.update(moves)
+                    improved = True
+                    break
+
+    def seller_parts(self):
+        # The seller part to buy each part from, by part id
+        return {part_id: seller_part for part_id, (_, _, seller_part, _) in self.assignments.items()}
+
+    def purchases(self):
+        return [{
+            'part_id': part_id,
+            'seller_part': seller_part,
+            'quantity': self.quantities[part_id],
+            'order_quantity': order_quantity,
+            'cost': Money(cost, self.currency),
+        } for part_id, (cost, _, seller_part, order_quantity) in self.assignments.items()]
+
+    def seller_count(self):
+        return len({seller_part.seller_id for _, _, seller_part, _ in self.assignments.values()})
+
+    def total_cost(self):
+        # Out-of-pocket cost of every purchase, their NRE and the seller order costs
+        parts_cost = sum((cost for cost, _, _, _ in self.assignments.values()), ZERO)
+        return Money(parts_cost + self.seller_order_cost * self.seller_count(), self.currency)
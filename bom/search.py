@@ -0,0 +1,275 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.expressions import RawSQL
+
+from .constants import BOM_SEARCH_BACKEND_FULL_TEXT, BOM_SEARCH_BACKEND_ICONTAINS
+
+
+SEARCH_INDEX_TABLE = 'bom_partrevisionsearch'
+
+# The part revision a search rank is annotated on, by its column in the outer query
+PART_REVISION_ID_COLUMN = 'bom_partrevision.id'
+
+# The fields of a part revision that are searched
+SEARCH_DOCUMENT_FIELDS = (
+    'id',
+    'part_id',
+    'part__organization_id',
+    'searchable_synopsis',
+    'part__primary_manufacturer_part__manufacturer_part_number',
+    'part__primary_manufacturer_part__manufacturer__name',
+    'description',
+)
+
+
+def search_words(term):
+    # Letters and digits, split the way both databases tokenize them
+    return re.findall(r'[^\W_]+', term.lower())
+
+
+def search_documents(part_revision_model, part_revision_ids=None):
+    # (part revision id, part id, organization id, synopsis, manufacturer, description) for each part revision, the
+    # parameters of SearchIndex.insert_sql. The model is passed in so that migrations can use their historical model.
+    part_revisions = part_revision_model.objects.all()
+    if part_revision_ids is not None:
+        part_revisions = part_revisions.filter(id__in=part_revision_ids)
+    for part_revision_id, part_id, organization_id, synopsis, manufacturer_part_number, manufacturer_name, description \
+            in part_revisions.values_list(*SEARCH_DOCUMENT_FIELDS):
+        manufacturer = ' '.join(value for value in (manufacturer_part_number, manufacturer_name) if value)
+        yield part_revision_id, part_id, organization_id, synopsis or '', manufacturer, description or ''
+
+
+class SearchIndex:
+    """
+    A full text index of part revisions, one row per part revision with its synopsis, the part number and name of the
+    manufacturer of its primary manufacturer part and its description. The synopsis weighs the most and the
+    description the least when ranking. Searches are subqueries, for the database to filter, rank and paginate with.
+    """
+    vendor = None
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    @classmethod
+    def supported(cls, connection):
+        return connection.vendor == cls.vendor
+
+    def create(self):
+        with self.connection.cursor() as cursor:
+            for sql in self.create_sql():
+                cursor.execute(sql)
+
+    def drop(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_INDEX_TABLE}')
+
+    def update(self, part_revision_model, part_revision_ids=None):
+        documents = list(search_documents(part_revision_model, part_revision_ids))
+        with self.connection.cursor() as cursor:
+            if part_revision_ids is None:
+                cursor.execute(f'DELETE FROM {SEARCH_INDEX_TABLE}')
+            else:
+                self.delete(cursor, part_revision_ids)
+            cursor.executemany(self.insert_sql(), documents)
+
+    def count(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {SEARCH_INDEX_TABLE}')
+            return cursor.fetchone()[0]
+
+    def remove(self, part_revision_ids):
+        with self.connection.cursor() as cursor:
+            self.delete(cursor, part_revision_ids)
+
+    def part_ids(self, organization_id, terms):
+        query, params = self.query(terms)
+        return RawSQL(self.part_ids_sql(query), params + [organization_id]) if params else None
+
+    def rank(self, terms):
+        query, params = self.query(terms)
+        return RawSQL(self.rank_sql(query), params) if params else None
+
+    def create_sql(self):
+        raise NotImplementedError
+
+    def delete(self, cursor, part_revision_ids):
+        raise NotImplementedError
+
+    def insert_sql(self):
+        raise NotImplementedError
+
+    def query(self, terms):
+        # The match expression for terms, each a word or a quoted phrase as parsed by smart_split, and its parameters
+        raise NotImplementedError
+
+    def part_ids_sql(self, query):
+        # Ids of the parts with a matching part revision. Parameters are the query's, then the organization id.
+        raise NotImplementedError
+
+    def rank_sql(self, query):
+        # How well the part revision of the outer query matches, lower is more relevant, null if it doesn't match
+        raise NotImplementedError
+
+
+class PostgresSearchIndex(SearchIndex):
+    """
+    A tsvector per part revision with a GIN index, using the 'simple' configuration so that part numbers, values and
+    units aren't stemmed. A term of a single word also matches the words it begins, longer terms are matched as
+    phrases.
+    """
+    vendor = 'postgresql'
+
+    def create_sql(self):
+        return [
+            f'CREATE TABLE {SEARCH_INDEX_TABLE} (part_revision_id integer PRIMARY KEY, part_id integer NOT NULL, '
+            f'organization_id integer NOT NULL, document tsvector NOT NULL)',
+            f'CREATE INDEX {SEARCH_INDEX_TABLE}_document ON {SEARCH_INDEX_TABLE} USING GIN (document)',
+            f'CREATE INDEX {SEARCH_INDEX_TABLE}_organization_id ON {SEARCH_INDEX_TABLE} (organization_id)',
+        ]
+
+    def delete(self, cursor, part_revision_ids):
+        cursor.execute(f'DELETE FROM {SEARCH_INDEX_TABLE} WHERE part_revision_id = ANY(%s)', [list(part_revision_ids)])
+
+    def insert_sql(self):
+        return f"""
+            INSERT INTO {SEARCH_INDEX_TABLE} (part_revision_id, part_id, organization_id, document) VALUES (%s, %s, %s,
+                setweight(to_tsvector('simple', %s), 'A') ||
+                setweight(to_tsvector('simple', %s), 'B') ||
+                setweight(to_tsvector('simple', %s), 'C'))
+        """
+
+    def query(self, terms):
+        queries, params = [], []
+        for term in terms:
+            words = search_words(term)
+            if len(words) == 1 and words[0] == term.lower():
+                queries.append("to_tsquery('simple', %s)")
+                params.append(f"'{words[0]}':*")
+            elif words:
+                queries.append("phraseto_tsquery('simple', %s)")
+                params.append(term)
+        return ' || '.join(queries), params
+
+    def part_ids_sql(self, query):
+        return f"""
+            SELECT part_id FROM {SEARCH_INDEX_TABLE}, (SELECT {query} AS query) AS search
+            WHERE document @@ search.query AND organization_id = %s
+        """
+
+    def rank_sql(self, query):
+        return f"""
+            SELECT -ts_rank(document, search.query) FROM {SEARCH_INDEX_TABLE}, (SELECT {query} AS query) AS search
+            WHERE part_revision_id = {PART_REVISION_ID_COLUMN} AND document @@ search.query
+        """
+
+
+class SqliteSearchIndex(SearchIndex):
+    """
+    An FTS5 table keyed by part revision id, ranked by bm25. Every term is matched as a phrase whose last word may be
+    the beginning of a longer one.
+    """
+    vendor = 'sqlite'
+
+    @classmethod
+    def supported(cls, connection):
+        return connection.vendor == cls.vendor and sqlite_has_fts5(connection.alias)
+
+    def create_sql(self):
+        return [
+            f'CREATE VIRTUAL TABLE {SEARCH_INDEX_TABLE} USING fts5('
+            f'synopsis, manufacturer, description, part_id UNINDEXED, organization_id UNINDEXED)',
+        ]
+
+    def delete(self, cursor, part_revision_ids):
+        part_revision_ids = list(part_revision_ids)
+        for start in range(0, len(part_revision_ids), 500):
+            batch = part_revision_ids[start:start + 500]
+            cursor.execute(f'DELETE FROM {SEARCH_INDEX_TABLE} WHERE rowid IN ({", ".join(["%s"] * len(batch))})', batch)
+
+    def insert_sql(self):
+        return f"""
+            INSERT INTO {SEARCH_INDEX_TABLE} (rowid, part_id, organization_id, synopsis, manufacturer, description)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """
+
+    def query(self, terms):
+        phrases = ['"' + ' '.join(words) + '"*' for words in map(search_words, terms) if words]
+        return '%s', [' OR '.join(phrases)] if phrases else []
+
+    def part_ids_sql(self, query):
+        return f"""
+            SELECT part_id FROM {SEARCH_INDEX_TABLE}
+            WHERE {SEARCH_INDEX_TABLE} MATCH {query} AND organization_id = %s
+        """
+
+    def rank_sql(self, query):
+        # Looked up by rowid along with the match, so only the part revisions being ranked are scored
+        return f"""
+            SELECT bm25({SEARCH_INDEX_TABLE}, 4.0, 2.0, 1.0) FROM {SEARCH_INDEX_TABLE}
+            WHERE {SEARCH_INDEX_TABLE} MATCH {query} AND rowid = {PART_REVISION_ID_COLUMN}
+        """
+
+
+SEARCH_INDEXES = (PostgresSearchIndex, SqliteSearchIndex)
+
+
+@lru_cache(maxsize=None)
+def sqlite_has_fts5(alias):
+    with connections[alias].cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def search_index(using=DEFAULT_DB_ALIAS):
+    # The full text index for the database, or None if it has none
+    connection = connections[using]
+    index_class = next((index_class for index_class in SEARCH_INDEXES if index_class.supported(connection)), None)
+    return index_class(connection) if index_class is not None else None
+
+
+def bom_search_backend():
+    backend = settings.BOM_CONFIG.get('search_backend', BOM_SEARCH_BACKEND_ICONTAINS)
+    if backend == BOM_SEARCH_BACKEND_FULL_TEXT and search_index() is not None:
+        return BOM_SEARCH_BACKEND_FULL_TEXT
+    return BOM_SEARCH_BACKEND_ICONTAINS
+
+
+def search_parts(organization_id, terms):
+    # A subquery of the ids of the parts of an organization with a part revision matching any of terms, None if there
+    # are no words in terms
+    return search_index().part_ids(organization_id, terms)
+
+
+def search_rank(terms):
+    # An expression for how well each part revision matches any of terms, lower is more relevant, null for those that
+    # don't match. None if there are no words in terms.
+    return search_index().rank(terms)
+
+
+def update_search_index(part_revision_model, part_revision_ids):
+    part_revision_ids = list(part_revision_ids)
+    index = search_index()
+    if index is not None and part_revision_ids:
+        index.update(part_revision_model, part_revision_ids)
+
+
+def sync_search_index(part_revision_model, using=DEFAULT_DB_ALIAS):
+    # Indexes every part revision again if the index has been created but doesn't hold one row per part revision.
+    # Tables flushed outside of the ORM, by the flush command or between tests, don't send delete signals and leave
+    # rows behind, so this is run after them and after migrate. An index that is in step is left as it is.
+    index = search_index(using)
+    if index is None or SEARCH_INDEX_TABLE not in index.connection.introspection.table_names():
+        return False
+    if index.count() == part_revision_model.objects.using(using).count():
+        return False
+    index.update(part_revision_model)
+    return True
+
+
+def remove_from_search_index(part_revision_ids):
+    index = search_index()
+    if index is not None:
+        index.remove(part_revision_ids)
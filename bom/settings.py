@@ -214,6 +214,10 @@ EXCHANGE_BACKEND = 'djmoney.contrib.exchange.backends.FixerBackend'
 BOM_CONFIG_DEFAULT = {
     'base_template': 'base.html',
     'mouser_api_key': None,
+    'bom_explosion_backend': 'level',  # 'level' (one query per BOM level) or 'cte' (single recursive query, PostgreSQL and SQLite only)
+    'bom_cache': True,  # cache exploded BOMs and their seller parts per part revision in the default cache
+    'bom_cache_timeout': 60 * 60 * 24 * 7,  # seconds, entries for old versions of a BOM are left to expire
+    'search_backend': 'fulltext',  # 'fulltext' (ranked, indexed search on PostgreSQL and SQLite) or 'icontains' (substring search)
     'admin_dashboard': {
         'enable_autocomplete': True,
         'page_size': 50,
@@ -0,0 +1,240 @@
+from collections import Counter
+
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+
+from .autocomplete import invalidate_autocomplete, update_autocomplete
+from .bom_cache import invalidate_all_bom_caches, invalidate_bom_caches
+from .explosion import BomCycleError
+from .models import (
+    Assembly,
+    AssemblySubparts,
+    Manufacturer,
+    ManufacturerPart,
+    Organization,
+    Part,
+    PartClass,
+    PartRevision,
+    PartRevisionClosure,
+    PartRevisionParameter,
+    PartRevisionSnapshot,
+    Seller,
+    SellerPart,
+    Subpart,
+)
+from .search import remove_from_search_index, sync_search_index, update_search_index
+
+
+def parent_ids_for_assemblies(assembly_ids):
+    return list(PartRevision.objects.filter(assembly_id__in=assembly_ids).values_list('id', flat=True))
+
+
+def child_counts_for_assembly(assembly_id):
+    return Counter(Subpart.objects.filter(assemblies=assembly_id).exclude(part_revision=None).values_list('part_revision_id', flat=True))
+
+
+def update_part_revision_snapshot(part_revision):
+    # Releasing a revision freezes its BOM, reverting it to working drops the frozen copy
+    if part_revision.configuration == 'R':
+        try:
+            PartRevisionSnapshot.take(part_revision)
+        except BomCycleError:
+            pass  # Nothing to freeze, the BOM is reported as broken wherever it is shown
+    else:
+        PartRevisionSnapshot.objects.filter(part_revision=part_revision).delete()
+
+
+@receiver(post_init, sender=PartRevision)
+def part_revision_post_init(sender, instance, **kwargs):
+    instance._closure_assembly_id = instance.__dict__.get('assembly_id')
+    instance._snapshot_configuration = instance.__dict__.get('configuration')
+
+
+@receiver(post_save, sender=PartRevision)
+def part_revision_post_save(sender, instance, created, **kwargs):
+    invalidate_bom_caches([instance.id])
+    update_search_index(PartRevision, [instance.id])
+    PartRevisionParameter.update([instance])
+    if not created and instance._snapshot_configuration != instance.configuration:
+        update_part_revision_snapshot(instance)
+    instance._snapshot_configuration = instance.configuration
+
+    if created:
+        PartRevisionClosure.objects.create(ancestor=instance, descendant=instance, depth=0)
+    elif instance._closure_assembly_id == instance.assembly_id:
+        return
+    elif instance._closure_assembly_id is not None:
+        for child_id, count in child_counts_for_assembly(instance._closure_assembly_id).items():
+            PartRevisionClosure.adjust([instance.id], child_id, -count)
+
+    if instance.assembly_id is not None:
+        for child_id, count in child_counts_for_assembly(instance.assembly_id).items():
+            PartRevisionClosure.adjust([instance.id], child_id, count)
+    instance._closure_assembly_id = instance.assembly_id
+    if not created:
+        Assembly.update_content_hashes(Assembly.objects.filter(subparts__part_revision=instance).values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=PartRevision)
+def part_revision_pre_delete(sender, instance, **kwargs):
+    # Takes the part revision out of the closure while its rows are still there to say which paths go through it. Its
+    # own rows go too, in the same transaction as the delete, so the edges the cascade deletes after this, and those
+    # of other part revisions deleted with it, adjust nothing through it.
+    invalidate_bom_caches([instance.id])
+    parent_ids = Counter(PartRevision.objects.filter(assembly__subparts__part_revision=instance).values_list('id', flat=True))
+    for parent_id, count in parent_ids.items():
+        PartRevisionClosure.adjust([parent_id], instance.id, -count)
+    PartRevisionClosure.objects.filter(Q(ancestor=instance) | Q(descendant=instance)).delete()
+
+
+@receiver(post_delete, sender=PartRevision)
+def part_revision_post_delete(sender, instance, **kwargs):
+    remove_from_search_index([instance.id])
+
+
+@receiver(post_init, sender=Subpart)
+def subpart_post_init(sender, instance, **kwargs):
+    instance._closure_part_revision_id = instance.__dict__.get('part_revision_id')
+
+
+@receiver(post_save, sender=Subpart)
+def subpart_post_save(sender, instance, created, **kwargs):
+    # A new subpart isn't in an assembly yet, it is linked when added to one
+    if created:
+        instance._closure_part_revision_id = instance.part_revision_id
+        return
+    assembly_ids = list(instance.assemblies.values_list('id', flat=True))
+    parent_ids = parent_ids_for_assemblies(assembly_ids)
+    if instance._closure_part_revision_id != instance.part_revision_id:
+        PartRevisionClosure.adjust(parent_ids, instance._closure_part_revision_id, -1)
+        PartRevisionClosure.adjust(parent_ids, instance.part_revision_id, 1)
+        instance._closure_part_revision_id = instance.part_revision_id
+    Assembly.update_content_hashes(assembly_ids)
+    invalidate_bom_caches(parent_ids)
+
+
+@receiver(post_save, sender=AssemblySubparts)
+def assembly_subparts_post_save(sender, instance, created, **kwargs):
+    if created:
+        parent_ids = parent_ids_for_assemblies([instance.assembly_id])
+        PartRevisionClosure.adjust(parent_ids, instance.subpart.part_revision_id, 1)
+        Assembly.update_content_hashes([instance.assembly_id])
+        invalidate_bom_caches(parent_ids)
+
+
+@receiver(post_delete, sender=AssemblySubparts)
+def assembly_subparts_post_delete(sender, instance, **kwargs):
+    child_id = Subpart.objects.filter(id=instance.subpart_id).values_list('part_revision_id', flat=True).first()
+    parent_ids = parent_ids_for_assemblies([instance.assembly_id])
+    PartRevisionClosure.adjust(parent_ids, child_id, -1)
+    Assembly.update_content_hashes([instance.assembly_id])
+    invalidate_bom_caches(parent_ids)
+
+
+@receiver(m2m_changed, sender=Assembly.subparts.through)
+def assembly_subparts_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Removals delete AssemblySubparts rows one by one and are handled by assembly_subparts_post_delete
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        parent_ids = parent_ids_for_assemblies(pk_set)
+        PartRevisionClosure.adjust(parent_ids, instance.part_revision_id, 1)
+        Assembly.update_content_hashes(pk_set)
+    else:
+        parent_ids = parent_ids_for_assemblies([instance.id])
+        child_ids = Counter(Subpart.objects.filter(id__in=pk_set).exclude(part_revision=None).values_list('part_revision_id', flat=True))
+        for child_id, count in child_ids.items():
+            PartRevisionClosure.adjust(parent_ids, child_id, count)
+        Assembly.update_content_hashes([instance.id])
+    invalidate_bom_caches(parent_ids)
+
+
+@receiver(post_save, sender=Part)
+@receiver(post_delete, sender=Part)
+def part_changed(sender, instance, **kwargs):
+    # Covers changes of the primary manufacturer part too
+    part_revision_ids = list(PartRevision.objects.filter(part_id=instance.id).values_list('id', flat=True))
+    invalidate_bom_caches(part_revision_ids)
+    update_search_index(PartRevision, part_revision_ids)
+
+
+@receiver(post_save, sender=ManufacturerPart)
+@receiver(post_delete, sender=ManufacturerPart)
+def manufacturer_part_changed(sender, instance, **kwargs):
+    part_revision_ids = list(PartRevision.objects.filter(part_id=instance.part_id).values_list('id', flat=True))
+    invalidate_bom_caches(part_revision_ids)
+    update_search_index(PartRevision, part_revision_ids)
+
+
+@receiver(post_save, sender=SellerPart)
+@receiver(post_delete, sender=SellerPart)
+def seller_part_changed(sender, instance, **kwargs):
+    part_ids = ManufacturerPart.objects.filter(id=instance.manufacturer_part_id).values_list('part_id', flat=True)
+    invalidate_bom_caches(PartRevision.objects.filter(part_id__in=part_ids).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=ManufacturerPart)
+def manufacturer_part_saved(sender, instance, **kwargs):
+    ManufacturerPart.manufacturer_part_number_trigrams().update([instance.id])
+
+
+@receiver(post_save, sender=Manufacturer)
+def manufacturer_saved(sender, instance, **kwargs):
+    Manufacturer.name_trigrams().update([instance.id])
+    # Manufacturer names are searched with the part revisions of the parts they make, deleting a manufacturer deletes
+    # its manufacturer parts, which takes care of their part revisions
+    part_revisions = PartRevision.objects.filter(part__primary_manufacturer_part__manufacturer=instance)
+    update_search_index(PartRevision, part_revisions.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Organization)
+def organization_saved(sender, instance, **kwargs):
+    invalidate_autocomplete([instance.id])
+
+
+@receiver(post_save, sender=PartClass)
+@receiver(post_delete, sender=PartClass)
+def organization_data_changed(sender, instance, **kwargs):
+    # Part class codes are in the part numbers of all of their parts
+    invalidate_autocomplete([instance.organization_id])
+
+
+@receiver(post_save, sender=Part)
+@receiver(post_delete, sender=Part)
+def part_autocomplete_changed(sender, instance, **kwargs):
+    update_autocomplete(instance.organization_id, part_ids=[instance.id])
+
+
+@receiver(post_save, sender=Manufacturer)
+@receiver(post_delete, sender=Manufacturer)
+def manufacturer_autocomplete_changed(sender, instance, **kwargs):
+    update_autocomplete(instance.organization_id, manufacturer_ids=[instance.id])
+
+
+@receiver(post_save, sender=PartRevision)
+@receiver(post_delete, sender=PartRevision)
+@receiver(post_save, sender=ManufacturerPart)
+@receiver(post_delete, sender=ManufacturerPart)
+def part_data_changed(sender, instance, **kwargs):
+    for organization_id in Part.objects.filter(id=instance.part_id).values_list('organization_id', flat=True):
+        update_autocomplete(organization_id, part_ids=[instance.part_id])
+
+
+@receiver(post_migrate)
+def bom_migrated(sender, using, **kwargs):
+    if sender.name == 'bom':
+        sync_search_index(PartRevision, using)
+
+
+@receiver(post_save, sender=Organization)
+@receiver(post_save, sender=PartClass)
+@receiver(post_delete, sender=PartClass)
+@receiver(post_save, sender=Manufacturer)
+@receiver(post_delete, sender=Manufacturer)
+@receiver(post_save, sender=Seller)
+@receiver(post_delete, sender=Seller)
+def bom_cache_shared_data_changed(sender, instance, **kwargs):
+    # Currencies, part classes, manufacturer and seller names are shown in many BOMs, they rarely change so every
+    # cached BOM is dropped rather than finding the ones that use them
+    invalidate_all_bom_caches()
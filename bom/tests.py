@@ -1,18 +1,36 @@
 import csv
+import sys
+from bisect import bisect_right
+from collections import defaultdict
+from decimal import Decimal
+from itertools import product
 from re import finditer, search
 from unittest import skip
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.db.models.signals import pre_delete
 from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from djmoney.contrib.exchange.models import ExchangeBackend, Rate, get_default_backend_name
+from djmoney.money import Money
 
 from . import constants
-from .forms import AddSubpartForm, PartFormSemiIntelligent, PartInfoForm, SellerPartForm
+from .bom_cache import bom_cache_versions
+from .bom_diff import bom_diff
+from .exchange_rates import ExchangeRates
+from .explosion import BomCycleError, bom_tree
+from .forms import AddSubpartForm, PartFormSemiIntelligent, PartInfoForm, SellerPartForm, SubpartForm
 from .helpers import (
     create_a_fake_assembly,
+    create_a_fake_assembly_with_subpart,
     create_a_fake_organization,
     create_a_fake_part_revision,
+    create_a_fake_seller_part,
     create_a_fake_subpart,
     create_some_fake_manufacturers,
     create_some_fake_part_classes,
@@ -20,7 +38,11 @@ from .helpers import (
     create_some_fake_sellers,
     create_user_and_organization,
 )
-from .models import ManufacturerPart, Part, PartClass, Seller, SellerPart, Subpart
+from .models import Assembly, AssemblySubparts, Manufacturer, ManufacturerPart, Part, PartClass, PartRevision, PartRevisionClosure, PartRevisionCycleEdge, PartRevisionParameter, PartRevisionSnapshot, Seller, SellerPart, Subpart
+from .parameters import ParameterFilter, parse_parameter_filters
+from .price_breaks import PriceBreaks
+from .search import search_index, sync_search_index
+from .trigrams import similarity, substring_trigrams, trigrams
 
 
 TEST_FILES_DIR = "bom/test_files"
@@ -104,6 +126,149 @@ class TestBOM(TransactionTestCase):
         response = self.client.get(reverse('bom:home'), {'q': f'"{p1.full_part_number()}"'})
         self.assertEqual(len(response.context['part_revs']), 1)
 
+    def test_home_search(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        p5 = Part.objects.filter(organization=self.organization).exclude(id__in=[p1.id, p2.id, p3.id, p4.id]).get()
+
+        def home_search(query):
+            response = self.client.get(reverse('bom:home'), {'q': query})
+            self.assertEqual(response.status_code, 200)
+            return [part_rev.part for part_rev in response.context['part_revs']]
+
+        brown_dog_parts = {p1, p2, p3, p5}
+        for backend in (constants.BOM_SEARCH_BACKEND_ICONTAINS, constants.BOM_SEARCH_BACKEND_FULL_TEXT):
+            with self.settings(BOM_CONFIG=dict(settings.BOM_CONFIG_DEFAULT, search_backend=backend)):
+                self.assertEqual(home_search('STM32F401CEU6'), [p1])
+                self.assertEqual(home_search('stm32'), [p1])
+                self.assertEqual(home_search('Nordic'), [p2])
+                self.assertEqual(set(home_search('"Brown dog"')), brown_dog_parts)
+                self.assertEqual(set(home_search('Nordic Murata')), {p2})
+                self.assertEqual(set(home_search('nordic stm32')), {p1, p2})
+                self.assertEqual(home_search('"dog brown"'), [])
+                self.assertEqual(home_search(f'"{p1.full_part_number()}"'), [p1])
+
+        with self.settings(BOM_CONFIG=dict(settings.BOM_CONFIG_DEFAULT, search_backend=constants.BOM_SEARCH_BACKEND_FULL_TEXT)):
+            # Matches are ranked and paginated by the database, only the page shown is loaded
+            response = self.client.get(reverse('bom:home'), {'q': 'dog'})
+            self.assertIsInstance(response.context['part_revs'].paginator.object_list, QuerySet)
+
+            # Full text search matches whole words and their beginnings, ranking synopses above manufacturers
+            self.assertEqual(home_search('dog'), home_search('"brown dog"'))
+            self.assertEqual(home_search('og'), [])
+            pr2 = p2.latest()
+            pr2.description = 'STM32 Nucleo'
+            pr2.save()
+            self.assertEqual(home_search('stm32'), [p2, p1])
+            self.assertEqual(set(home_search('"Brown dog"')), brown_dog_parts - {p2})
+
+            # The index follows the revisions, manufacturer parts and manufacturers it was built from
+            p1.primary_manufacturer_part.manufacturer.name = 'ST'
+            p1.primary_manufacturer_part.manufacturer.save()
+            self.assertEqual(home_search('STMicroelectronics'), [])
+            p1.primary_manufacturer_part.manufacturer_part_number = 'STM32L476'
+            p1.primary_manufacturer_part.save()
+            self.assertEqual(home_search('STM32F401CEU6'), [])
+            self.assertEqual(home_search('STM32L476'), [p1])
+            pr2.delete()
+            self.assertEqual(home_search('Nucleo'), [])
+
+            # Only primary manufacturer parts are searched
+            self.assertEqual(home_search('NRF51822 Murata'), [])
+
+            # After migrate the index is only rebuilt if it has fallen out of step with the part revisions
+            self.assertFalse(sync_search_index(PartRevision))
+            search_index().remove([p1.latest().id])
+            self.assertEqual(PartRevision.objects.count() - 1, search_index().count())
+            self.assertTrue(sync_search_index(PartRevision))
+            self.assertEqual(PartRevision.objects.count(), search_index().count())
+
+    def test_trigram_search(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        self.assertEqual(trigrams('LSM6-DS'), {'  l', ' ls', 'lsm', 'sm6', 'm6 ', '  d', ' ds', 'ds '})
+        self.assertEqual(substring_trigrams('LSM6-DS'), {'lsm', 'sm6'})
+
+        # Substrings are found through the trigrams as icontains finds them
+        manufacturer_parts = ManufacturerPart.objects.filter(part__organization=self.organization)
+        index = ManufacturerPart.manufacturer_part_number_trigrams()
+        for term in ('401CE', 'stm32f401ceu6', 'C1H100', '0JA01', 'ha', 'NRF51822 ', '401XE', ''):
+            self.assertEqual(set(index.contains(manufacturer_parts, term)),
+                             set(manufacturer_parts.filter(manufacturer_part_number__icontains=term)), term)
+        self.assertEqual(set(index.contains(manufacturer_parts, 'f401')), {p1.primary_manufacturer_part})
+        self.assertEqual(set(index.contains(manufacturer_parts.exclude(part=p1), 'f401')), set())
+
+        # Similarities are pg_trgm's, for values at least as similar as the threshold
+        similarities = index.similar(manufacturer_parts, 'STM32F410CEU6')
+        self.assertEqual(list(similarities), [p1.primary_manufacturer_part.id])
+        self.assertAlmostEqual(similarities[p1.primary_manufacturer_part.id], similarity(trigrams('STM32F410CEU6'), trigrams('STM32F401CEU6')))
+        self.assertEqual(index.similar(manufacturer_parts, 'STM32F410CEU6', threshold=0.9), {})
+
+        # The trigrams follow the values they come from
+        mp = p1.primary_manufacturer_part
+        mp.manufacturer_part_number = 'LSM6DSOX'
+        mp.save()
+        self.assertEqual(list(index.contains(manufacturer_parts, 'm6dso')), [mp])
+        self.assertEqual(list(index.contains(manufacturer_parts, '401CE')), [])
+
+        for backend in (constants.BOM_SEARCH_BACKEND_ICONTAINS, constants.BOM_SEARCH_BACKEND_FULL_TEXT):
+            with self.settings(BOM_CONFIG=dict(settings.BOM_CONFIG_DEFAULT, search_backend=backend)):
+                response = self.client.get(reverse('bom:home'), {'q': 'M6DS C1H100'})
+                self.assertEqual({part_rev.part for part_rev in response.context['part_revs']}, {p1, p2})
+                response = self.client.get(reverse('bom:home'), {'q': 'emiconduct'})
+                self.assertEqual([part_rev.part for part_rev in response.context['part_revs']], [p2])
+
+        # Manufacturers containing the query come first, then misspellings of it
+        manufacturer = Manufacturer.objects.get(organization=self.organization, name='Nordic Semiconductor')
+        Manufacturer.objects.create(organization=self.organization, name='Nordik Semi')
+        response = self.client.get(reverse('bom:manufacturers'), {'q': 'nordic semi'})
+        self.assertEqual([m.name for m in response.context['manufacturers']], ['Nordic Semiconductor', 'Nordik Semi'])
+        manufacturer.name = 'Nordic'
+        manufacturer.save()
+        response = self.client.get(reverse('bom:manufacturers'), {'q': 'nordik'})
+        self.assertEqual([m.name for m in response.context['manufacturers']], ['Nordik Semi', 'Nordic'])
+
+    def test_parametric_search(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        filters, rest = parse_parameter_filters('10k–100k Ω, ≥50 V, 0603 "4.7uF"')
+        self.assertEqual(filters, [ParameterFilter('resistance', 1e4, 1e5, True, True), ParameterFilter('voltage', 50, None, True, False)])
+        self.assertEqual(rest.split(), [',', ',', '0603', '"4.7uF"'])
+        self.assertEqual(parse_parameter_filters('< 10 mA')[0], [ParameterFilter('current', None, 0.01, False, False)])
+        self.assertEqual(parse_parameter_filters('4.7 kohms')[0], [ParameterFilter('resistance', 4700, 4700, True, True)])
+        self.assertEqual(parse_parameter_filters('>85°C')[0], [ParameterFilter('temperature', 358.15, None, False, False)])
+        self.assertEqual(parse_parameter_filters('STM32F401CEU6 3.3 SOT-23 10k-100k'), ([], 'STM32F401CEU6 3.3 SOT-23 10k-100k'))
+
+        for part, value, value_units, voltage_rating in ((p1, '47', 'kOhms', None), (p2, '10', 'uF', 50), (p3, '4.7', 'kOhms', 25)):
+            part_revision = part.latest()
+            part_revision.value, part_revision.value_units, part_revision.package = value, value_units, '0603 smd'
+            part_revision.voltage_rating, part_revision.voltage_rating_units = voltage_rating, 'V'
+            part_revision.save()
+        self.assertEqual(set(PartRevisionParameter.objects.filter(part_revision=p3.latest()).values_list('name', 'quantity', 'value')),
+                         {('value', 'resistance', 4700), ('voltage_rating', 'voltage', 25)})
+
+        def home_search(query):
+            response = self.client.get(reverse('bom:home'), {'q': query})
+            self.assertEqual(response.status_code, 200)
+            return {part_rev.part for part_rev in response.context['part_revs']}
+
+        for backend in (constants.BOM_SEARCH_BACKEND_ICONTAINS, constants.BOM_SEARCH_BACKEND_FULL_TEXT):
+            with self.settings(BOM_CONFIG=dict(settings.BOM_CONFIG_DEFAULT, search_backend=backend)):
+                self.assertEqual(home_search('10k–100k Ω'), {p1})
+                self.assertEqual(home_search('≥4.7kΩ'), {p1, p3})
+                self.assertEqual(home_search('>4.7kΩ'), {p1})
+                self.assertEqual(home_search('>=20V'), {p2, p3})
+                self.assertEqual(home_search('1k-10k ohms, >=20 V, 0603'), {p3})
+                self.assertEqual(home_search('10000 nF'), {p2})
+                self.assertEqual(home_search('10uF Nordic'), {p2})
+                self.assertEqual(home_search('10uF STM32'), set())
+
+        # The parameters follow the part revisions they come from
+        part_revision = p3.latest()
+        part_revision.voltage_rating = 100
+        part_revision.save()
+        self.assertEqual(home_search('≥50 V'), {p2, p3})
+        part_revision.value = 'Other'
+        part_revision.save()
+        self.assertEqual(home_search('1k-10k ohms'), set())
+
     def test_part_info(self):
         (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
 
@@ -1504,3 +1669,836 @@ class TestJsonViews(TestCase):
         response = self.client.get(reverse('json:mouser-part-match-bom', kwargs={'part_revision_id': p3.latest().id}))
 
         self.assertEqual(response.status_code, 200)
+
+        # A BOM with a cycle is reported with a 400, and not to later requests
+        p2.latest().assembly.subparts.add(create_a_fake_subpart(p3.latest(), reference='', count=1))
+        response = self.client.get(reverse('json:mouser-part-match-bom', kwargs={'part_revision_id': p3.latest().id}))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(1, len(response.json()['errors']))
+        response = self.client.get(reverse('json:mouser-part-match-bom', kwargs={'part_revision_id': p1.latest().id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([], response.json()['errors'])
+
+    def test_autocomplete(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+
+        def suggestions(query, **params):
+            response = self.client.get(reverse('json:autocomplete'), dict(params, q=query))
+            self.assertEqual(response.status_code, 200)
+            return response.json()['content']['suggestions']
+
+        self.assertEqual(suggestions('stm'), ['STM32F401CEU6', 'STMicroelectronics'])
+        self.assertEqual(suggestions('STM', limit=1), ['STM32F401CEU6'])
+        self.assertEqual(suggestions(p1.full_part_number()), [p1.full_part_number()])
+        self.assertEqual(suggestions('3.3 brown'), [p1.latest().searchable_synopsis.strip()])
+        self.assertEqual(suggestions('nordic', kind=constants.AUTOCOMPLETE_MANUFACTURERS), ['Nordic Semiconductor'])
+        self.assertEqual(suggestions('grm', kind=constants.AUTOCOMPLETE_MANUFACTURERS), [])
+        self.assertEqual(suggestions(' '), [])
+
+        # Built once, then served without going to the database
+        with CaptureQueriesContext(connection) as queries:
+            suggestions('nrf')
+        self.assertEqual([query for query in queries.captured_queries if 'bom_part' in query['sql']], [])
+
+        # and updated in place for the part or manufacturer that changes once its transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            p2.primary_manufacturer_part.manufacturer_part_number = 'STM8S003'
+            p2.primary_manufacturer_part.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            Manufacturer.objects.create(name='Nexperia', organization=self.organization)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(suggestions('stm'), ['STM32F401CEU6', 'STM8S003', 'STMicroelectronics'])
+            self.assertEqual(suggestions('n', kind=constants.AUTOCOMPLETE_MANUFACTURERS), ['Nexperia', 'Nordic Semiconductor'])
+            self.assertEqual(suggestions('grm'), [])
+        self.assertEqual([query for query in queries.captured_queries if 'bom_part' in query['sql'] or 'bom_manufacturer' in query['sql']], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            p2.delete()
+        self.assertEqual(suggestions('stm'), ['STM32F401CEU6', 'STMicroelectronics'])
+        self.assertEqual(suggestions(p1.full_part_number()), [p1.full_part_number()])
+
+        # A part class change touches every part number, the index is built again
+        p1.number_class.code = '999'
+        p1.number_class.save()
+        self.assertEqual(suggestions(p1.full_part_number()), [p1.full_part_number()])
+
+        for params in ({'limit': 0}, {'limit': constants.AUTOCOMPLETE_LIMIT_MAX + 1}, {'limit': 'ten'}, {'kind': 'sellers'}):
+            response = self.client.get(reverse('json:autocomplete'), dict(params, q='stm'))
+            self.assertEqual(response.status_code, 400)
+
+    def test_autocomplete_options(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        parts = sorted(Part.objects.filter(organization=self.organization), key=lambda part: part.full_part_number())
+
+        def options(source, **params):
+            response = self.client.get(reverse('json:autocomplete-options', kwargs={'source': source}), params)
+            self.assertEqual(response.status_code, 200)
+            return [option['value'] for option in response.json()['content']['options']], response.json()['content']['has_more']
+
+        self.assertEqual(options(constants.AUTOCOMPLETE_OPTIONS_PARTS), ([part.full_part_number() for part in parts], False))
+        self.assertEqual(options(constants.AUTOCOMPLETE_OPTIONS_PARTS, limit=2), ([part.full_part_number() for part in parts[:2]], True))
+        self.assertEqual(options(constants.AUTOCOMPLETE_OPTIONS_PARTS, limit=2, offset=2), ([part.full_part_number() for part in parts[2:4]], True))
+        self.assertEqual(options(constants.AUTOCOMPLETE_OPTIONS_PARTS, q=p2.full_part_number()[1:]), ([p2.full_part_number()], False))
+        self.assertEqual(options(constants.AUTOCOMPLETE_OPTIONS_PARTS, q='brown DOG', exclude=[p1.id, p2.id])[0],
+                         [part.full_part_number() for part in parts if part not in (p1, p2) and part.latest() is not None])
+        self.assertEqual(options(constants.AUTOCOMPLETE_OPTIONS_PART_CLASSES, q=p1.number_class.name.upper()), ([str(p1.number_class)], False))
+
+        response = self.client.get(reverse('json:autocomplete-options', kwargs={'source': constants.AUTOCOMPLETE_OPTIONS_PARTS}), {'q': p1.full_part_number()})
+        self.assertEqual(response.json()['content']['options'], [{'label': p1.verbose_str(), 'value': p1.full_part_number()}])
+        for source, params in ((constants.AUTOCOMPLETE_OPTIONS_PARTS, {'offset': -1}), (constants.AUTOCOMPLETE_OPTIONS_PARTS, {'exclude': 'p1'}),
+                               ('sellers', {})):
+            response = self.client.get(reverse('json:autocomplete-options', kwargs={'source': source}), params)
+            self.assertEqual(response.status_code, 400)
+
+        # The widget renders without looking at the parts it can autocomplete to
+        form = AddSubpartForm(organization=self.organization, part_id=p3.id)
+        with CaptureQueriesContext(connection) as queries:
+            html = str(form['subpart_part_number'])
+        self.assertEqual(len(queries), 0)
+        self.assertNotIn(p1.full_part_number(), html)
+
+@override_settings(BOM_CONFIG=settings.BOM_CONFIG_DEFAULT)
+class TestPartRevisionBom(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('kasper', 'kasper@McFadden.com', 'ghostpassword')
+        self.organization = create_a_fake_organization(self.user)
+        self.profile = self.user.bom_profile(organization=self.organization)
+
+    def test_indented(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        indented_bom = p3.latest().indented(top_level_quantity=10)
+
+        items = list(indented_bom.parts.values())
+        self.assertEqual([0, 1, 2, 1], [item.indent_level for item in items])
+        self.assertEqual([p3, p2, p1, p1], [item.part for item in items])
+        self.assertEqual([1, 7, 28, 10], [item.extended_quantity for item in items])
+        self.assertEqual(items[1].bom_id, items[2].parent_id)
+
+        # Only the views asked for are built from the explosion
+        self.assertIsNone(p3.latest().boms(top_level_quantity=10, flat=False)[1])
+        self.assertIsNone(p3.latest().boms(top_level_quantity=10, indented=False)[0])
+        self.assertEqual(list(p3.latest().explode(top_level_quantity=10)[1].parts), list(p3.latest().flat(top_level_quantity=10).parts))
+
+    def test_indented_queries_scale_with_depth(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        part_revision = p3.latest()
+        with CaptureQueriesContext(connection) as small_bom_queries:
+            part_revision.indented()
+        small_bom_structure_queries = [q for q in small_bom_queries.captured_queries if 'bom_assembly_subparts' in q['sql']]
+
+        for count in range(20):
+            part_revision.assembly.subparts.add(create_a_fake_subpart(p1.latest(), reference='', count=count + 1))
+        with CaptureQueriesContext(connection) as large_bom_queries:
+            part_revision.indented()
+        large_bom_structure_queries = [q for q in large_bom_queries.captured_queries if 'bom_assembly_subparts' in q['sql']]
+
+        self.assertEqual(len(small_bom_structure_queries), len(large_bom_structure_queries))
+
+    def test_indented_cte_backend(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        part_revision = p3.latest()
+        level_indented = part_revision.indented(top_level_quantity=10)
+        level_flat = part_revision.flat(top_level_quantity=10)
+
+        bom_config = dict(settings.BOM_CONFIG_DEFAULT, bom_explosion_backend=constants.BOM_EXPLOSION_BACKEND_CTE)
+        with override_settings(BOM_CONFIG=bom_config), CaptureQueriesContext(connection) as queries:
+            cte_indented = part_revision.indented(top_level_quantity=10)
+        self.assertEqual(0, len([q for q in queries.captured_queries if 'bom_assembly_subparts' in q['sql'] and 'RECURSIVE' not in q['sql']]))
+
+        with override_settings(BOM_CONFIG=bom_config):
+            cte_flat = part_revision.flat(top_level_quantity=10)
+
+        for level_bom, cte_bom in [(level_indented, cte_indented), (level_flat, cte_flat)]:
+            self.assertEqual(list(level_bom.parts.keys()), list(cte_bom.parts.keys()))
+            for bom_id, item in level_bom.parts.items():
+                self.assertEqual(item.extended_quantity, cte_bom.parts[bom_id].extended_quantity)
+                self.assertEqual(item.references, cte_bom.parts[bom_id].references)
+            self.assertEqual(level_bom.unit_cost, cte_bom.unit_cost)
+
+    def test_explode(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        part_revision = p3.latest()
+        part_revision.explode(top_level_quantity=10)
+        with CaptureQueriesContext(connection) as separate_queries:
+            part_revision.indented(top_level_quantity=10)
+            part_revision.flat(top_level_quantity=10)
+        with CaptureQueriesContext(connection) as queries:
+            indented_bom, flat_bom = part_revision.explode(top_level_quantity=10)
+        self.assertEqual(len(separate_queries.captured_queries), 2 * len(queries.captured_queries))
+
+        self.assertEqual(list(part_revision.indented(top_level_quantity=10).parts.keys()), list(indented_bom.parts.keys()))
+        self.assertEqual(['4', '2', '1'], list(flat_bom.parts.keys()))
+        self.assertEqual([1, 7, 38], [item.extended_quantity for item in flat_bom.parts.values()])
+        self.assertEqual(indented_bom.unit_cost, flat_bom.unit_cost)
+
+    def test_indented_shared_subassembly(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        part_revision = p3.latest()
+        part_revision.assembly.subparts.add(create_a_fake_subpart(p2.latest(), reference='', count=2))
+        bom_config = dict(settings.BOM_CONFIG_DEFAULT, bom_cache=False)
+        with override_settings(BOM_CONFIG=bom_config):
+            part_revision.indented()
+            with CaptureQueriesContext(connection) as queries:
+                part_revision.indented()
+
+            for count in range(20):
+                part_revision.assembly.subparts.add(create_a_fake_subpart(p2.latest(), reference='', count=2))
+            with CaptureQueriesContext(connection) as shared_queries:
+                part_revision.indented()
+
+        self.assertEqual(len(queries.captured_queries), len(shared_queries.captured_queries))
+        lines = list(bom_tree(part_revision).lines())
+        self.assertEqual(6 + 2 * 21, len(lines))
+        self.assertEqual([8] * 21, [line.extended_quantity for line in lines if line.level == 2][-21:])
+
+    def test_indented_cycle(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        part_revision = p3.latest()
+        p2.latest().assembly.subparts.add(create_a_fake_subpart(part_revision, reference='', count=1))
+
+        bom_config = dict(settings.BOM_CONFIG_DEFAULT, bom_explosion_backend=constants.BOM_EXPLOSION_BACKEND_CTE)
+        for config in [settings.BOM_CONFIG_DEFAULT, bom_config]:
+            with override_settings(BOM_CONFIG=config):
+                with self.assertRaises(BomCycleError) as cm:
+                    part_revision.indented()
+                self.assertEqual([part_revision, p2.latest(), part_revision], cm.exception.part_revisions)
+                self.assertIn(f'{part_revision} > {p2.latest()} > {part_revision}', str(cm.exception))
+
+        self.client.login(username='kasper', password='ghostpassword')
+        response = self.client.get(reverse('bom:part-info', kwargs={'part_id': p3.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'{part_revision} > {p2.latest()} > {part_revision}', response.content.decode())
+
+    def test_indented_deeper_than_recursion_limit(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        depth = 300
+        part_revision = p1.latest()
+        for revision in range(depth):
+            assembly = create_a_fake_assembly()
+            assembly.subparts.add(create_a_fake_subpart(part_revision, reference='', count=1))
+            part_revision = create_a_fake_part_revision(p4, assembly, revision=str(revision + 10))
+
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(depth - 100)
+        try:
+            indented_bom = part_revision.indented()
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+        self.assertEqual(depth, max(item.indent_level for item in indented_bom.parts.values()))
+
+    def assertClosureIsCurrent(self):
+        closure = set(PartRevisionClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth', 'path_count'))
+        cycle_edges = set(PartRevisionCycleEdge.objects.values_list('parent_id', 'child_id', 'count'))
+        PartRevisionClosure.rebuild()
+        self.assertEqual(set(PartRevisionClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth', 'path_count')), closure)
+        self.assertEqual(set(PartRevisionCycleEdge.objects.values_list('parent_id', 'child_id', 'count')), cycle_edges)
+
+    def test_closure(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        pr1, pr2, pr3 = p1.latest(), p2.latest(), p3.latest()
+        self.assertClosureIsCurrent()
+        self.assertEqual({pr2, pr3, PartRevision.objects.get(part=p3, revision='1')}, set(pr1.where_used_full()))
+        self.assertEqual(set(pr1.where_used_full()), set(p1.where_used_full()))
+        self.assertTrue(pr3.contains(pr1))
+        self.assertFalse(pr1.contains(pr3))
+        # pr1 is used in pr3 directly and through both uses of pr2
+        self.assertEqual(1, PartRevisionClosure.objects.get(ancestor=pr3, descendant=pr1, depth=1).path_count)
+        self.assertEqual(2, PartRevisionClosure.objects.get(ancestor=pr3, descendant=pr1, depth=2).path_count)
+
+        with CaptureQueriesContext(connection) as queries:
+            pr1.where_used_full()
+        self.assertEqual(1, len(queries.captured_queries))
+
+        pr4 = create_a_fake_part_revision(p4, create_a_fake_assembly_with_subpart(pr3))
+        self.assertClosureIsCurrent()
+        self.assertTrue(pr4.contains(pr1))
+
+        leaf = create_a_fake_part_revision(p4, None, revision='2')
+        subpart = create_a_fake_subpart(pr1, reference='', count=1)
+        AssemblySubparts.objects.create(assembly=pr1.assembly, subpart=create_a_fake_subpart(leaf, reference='', count=1))
+        pr2.assembly.subparts.add(subpart)
+        self.assertClosureIsCurrent()
+        self.assertTrue(pr4.contains(leaf))
+
+        subpart.part_revision = leaf
+        subpart.save()
+        self.assertClosureIsCurrent()
+
+        pr2.assembly.subparts.remove(subpart)
+        self.assertClosureIsCurrent()
+
+        pr4.assembly = create_a_fake_assembly_with_subpart(pr2)
+        pr4.save()
+        self.assertClosureIsCurrent()
+        self.assertFalse(pr4.contains(pr3))
+
+        # A delete that fails part way leaves pr2 in the closure, and edits to it are still followed
+        def fail_delete(**kwargs):
+            raise ValueError
+        pre_delete.connect(fail_delete, sender=Subpart)
+        try:
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    PartRevision.objects.get(id=pr2.id).delete()
+        finally:
+            pre_delete.disconnect(fail_delete, sender=Subpart)
+        self.assertClosureIsCurrent()
+        self.assertTrue(pr4.contains(pr1))
+
+        pr3.assembly.subparts.filter(part_revision=pr2).delete()
+        self.assertClosureIsCurrent()
+
+        pr2.delete()
+        self.assertClosureIsCurrent()
+        self.assertFalse(pr4.contains(pr1))
+        self.assertTrue(pr3.contains(pr1))
+
+        p3.delete()
+        self.assertClosureIsCurrent()
+
+    def test_closure_cycle(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        pr1, pr3 = p1.latest(), p3.latest()
+        pr5 = create_a_fake_part_revision(p4, create_a_fake_assembly_with_subpart(pr1), revision='5')
+        closure = set(PartRevisionClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth', 'path_count'))
+
+        # pr1 > pr5 closes a cycle, it is left out of the closure and recorded
+        cycle_subpart = create_a_fake_subpart(pr5, reference='', count=1)
+        pr1.assembly.subparts.add(cycle_subpart)
+        self.assertEqual(closure, set(PartRevisionClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth', 'path_count')))
+        self.assertEqual([(pr1.id, pr5.id, 1)], list(PartRevisionCycleEdge.objects.values_list('parent_id', 'child_id', 'count')))
+
+        # Removing pr5 > pr1 first breaks the cycle, pr1 > pr5 goes into the closure
+        pr5.assembly.subparts.all().delete()
+        self.assertClosureIsCurrent()
+        self.assertFalse(PartRevisionCycleEdge.objects.exists())
+        self.assertTrue(pr3.contains(pr5))
+
+        pr1.assembly.subparts.remove(cycle_subpart)
+        self.assertClosureIsCurrent()
+        self.assertFalse(pr3.contains(pr5))
+
+        # Removing the edge that closed the cycle takes only the record
+        pr5.assembly.subparts.add(create_a_fake_subpart(pr1, reference='', count=1))
+        pr1.assembly.subparts.add(cycle_subpart)
+        pr1.assembly.subparts.remove(cycle_subpart)
+        self.assertClosureIsCurrent()
+        self.assertFalse(PartRevisionCycleEdge.objects.exists())
+
+    def test_would_create_cycle(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        pr1, pr2, pr3 = p1.latest(), p2.latest(), p3.latest()
+        self.assertTrue(pr3.would_create_cycle(pr3))
+        self.assertTrue(pr2.would_create_cycle(pr3))
+        self.assertTrue(pr1.would_create_cycle(pr2))
+        self.assertTrue(pr2.would_create_cycle(PartRevision.objects.get(part=p3, revision='1')))
+        self.assertFalse(pr3.would_create_cycle(pr1))
+        with CaptureQueriesContext(connection) as queries:
+            pr2.would_create_cycle(pr3)
+        self.assertEqual(1, len(queries.captured_queries))
+
+        subpart = pr2.assembly.subparts.first()
+        form = SubpartForm({'part_revision': pr3.id, 'reference': '', 'count': 1, 'do_not_load': False}, instance=subpart, organization=self.organization, part_id=p3.id)
+        self.assertFalse(form.is_valid())
+        self.assertIn("Infinite recursion!", str(form.errors))
+        self.assertEqual(pr1, Subpart.objects.get(id=subpart.id).part_revision)
+
+    def test_part_revision_new_roll_cycle(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        pr1, pr2 = p1.latest(), p2.latest()
+        # The latest revision of p1 uses p2, which still uses the first revision of p1
+        create_a_fake_part_revision(p1, create_a_fake_assembly_with_subpart(pr2), revision='2')
+
+        self.client.login(username='kasper', password='ghostpassword')
+        new_part_revision_form_data = {
+            'description': 'new rev',
+            'revision': '3',
+            'part': p1.id,
+            'configuration': 'W',
+            'copy_assembly': 'False',
+            'roll': [pr2.id],
+        }
+        response = self.client.post(reverse('bom:part-revision-new', kwargs={'part_id': p1.id}), new_part_revision_form_data)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(any("Infinite recursion!" in str(m) for m in response.wsgi_request._messages))
+        self.assertEqual([pr1], [sp.part_revision for sp in pr2.assembly.subparts.all()])
+
+    def test_bom_items_use_slots(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        indented_bom, flat_bom = p3.latest().explode(top_level_quantity=10)
+        for item in list(indented_bom.parts.values()) + list(flat_bom.parts.values()):
+            self.assertFalse(hasattr(item, '__dict__'))
+            self.assertEqual(item.part_revision.part, item.part)
+
+        item = list(indented_bom.parts.values())[1]
+        item_dict = item.as_dict()
+        self.assertEqual(set(item.as_dict_fields), set(item_dict.keys()) | {'bom_id'})
+        self.assertEqual(1, item_dict['indent_level'])
+        self.assertEqual(str(p2), item_dict['part'])
+
+    def test_quantity_sweep(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        part_revision = p2.latest()
+        quantities = [10, 100, 1000, 5000]
+        flat_bom = part_revision.flat(top_level_quantity=1)
+        with self.assertNumQueries(0):
+            sweep = flat_bom.quantity_sweep(quantities)
+
+        self.assertEqual(quantities, [row['quantity'] for row in sweep])
+        for row in sweep:
+            flat_bom = part_revision.flat(top_level_quantity=row['quantity'])
+            self.assertEqual(flat_bom.unit_cost, row['unit_cost'])
+            self.assertEqual(flat_bom.cost(), row['cost'])
+            self.assertEqual(flat_bom.out_of_pocket_cost, row['out_of_pocket_cost'])
+            self.assertEqual(flat_bom.nre_cost, row['nre_cost'])
+            self.assertEqual(flat_bom.missing_item_costs, row['missing_item_costs'])
+
+    def test_recost(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        part_revision = p3.latest()
+        indented_bom, flat_bom = part_revision.explode(top_level_quantity=10)
+
+        for quantity in [1, 1000, 10]:
+            with self.assertNumQueries(0):
+                indented_bom.recost(quantity)
+                flat_bom.recost(quantity)
+            expected_indented_bom, expected_flat_bom = part_revision.explode(top_level_quantity=quantity)
+            for bom, expected_bom in [(indented_bom, expected_indented_bom), (flat_bom, expected_flat_bom)]:
+                self.assertEqual(quantity, bom.quantity)
+                self.assertEqual(expected_bom.unit_cost, bom.unit_cost)
+                self.assertEqual(expected_bom.out_of_pocket_cost, bom.out_of_pocket_cost)
+                self.assertEqual(expected_bom.missing_item_costs, bom.missing_item_costs)
+                for bom_id, item in bom.parts.items():
+                    expected_item = expected_bom.parts[bom_id]
+                    self.assertEqual(expected_item.seller_part, item.seller_part)
+                    self.assertEqual(expected_item.total_extended_quantity, item.total_extended_quantity)
+                    self.assertEqual(expected_item.order_quantity, item.order_quantity)
+
+    def test_bom_costs(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        indented_bom, flat_bom = p3.latest().explode(top_level_quantity=100)
+        currency = self.organization.currency
+
+        for bom in [indented_bom, flat_bom]:
+            unit_cost, out_of_pocket_cost, nre_cost = Money(0, currency), Money(0, currency), Money(0, currency)
+            for item in bom.parts.values():
+                if item.seller_part is not None and not item.do_not_load:
+                    unit_cost += item.seller_part.unit_cost * item.extended_quantity
+                    out_of_pocket_cost += item.seller_part.unit_cost * item.order_quantity
+                    nre_cost += item.seller_part.nre_cost
+                    self.assertEqual(item.order_cost, item.seller_part.unit_cost * item.total_extended_quantity)
+            self.assertEqual(unit_cost, bom.unit_cost)
+            self.assertEqual(out_of_pocket_cost, bom.out_of_pocket_cost)
+            self.assertEqual(nre_cost, bom.nre_cost)
+            self.assertEqual(unit_cost * 100, bom.cost())
+
+        # An item without a price costs nothing, and isn't logged unless debug logging is on
+        item = next(iter(flat_bom.parts.values()))
+        item.seller_part = None
+        with self.assertNoLogs('bom.part_bom', level='INFO'):
+            self.assertEqual(Money(0, currency), item.extended_cost())
+            self.assertEqual(Money(0, currency), item.out_of_pocket_cost())
+        with self.assertLogs('bom.part_bom', level='DEBUG'):
+            item.extended_cost()
+
+    def test_optimal_sellers_in_bulk(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        indented_bom, flat_bom = p3.latest().explode(top_level_quantity=100)
+
+        part_quantities = [(item.part.id, item.total_extended_quantity) for item in indented_bom.parts.values()] + [(p4.id, 10)]
+        with self.assertNumQueries(1):
+            optimal_seller_parts = SellerPart.optimal_for(part_quantities)
+        self.assertEqual([Part.objects.get(id=part_id).optimal_seller(quantity) for part_id, quantity in part_quantities], optimal_seller_parts)
+        self.assertIsNone(optimal_seller_parts[-1])
+
+        seller_parts = flat_bom.seller_parts()
+        manufacturer_parts = flat_bom.manufacturer_parts_by_part()
+        for item in flat_bom.parts.values():
+            part_seller_parts = seller_parts.get(item.part.id, [])
+            with self.assertNumQueries(0):
+                item_seller_parts = item.seller_parts_for_export(part_seller_parts)
+                item_manufacturer_parts = item.manufacturer_parts_for_export(manufacturer_parts.get(item.part.id, []), part_seller_parts)
+            self.assertEqual(item.seller_parts_for_export(), item_seller_parts)
+            self.assertEqual(item.manufacturer_parts_for_export(), item_manufacturer_parts)
+
+    def test_price_breaks(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        seller = Seller.objects.first()
+        # Same price as an existing break, to check that ties go to the first seller part
+        create_a_fake_seller_part(seller, p2.primary_manufacturer_part, moq=200, mpq=200, unit_cost=0.5, lead_time_days=1, nre_cost=0)
+        for part in [p1, p2, p3]:
+            seller_parts = list(SellerPart.objects.filter(manufacturer_part__part=part).order_by('id'))
+            price_breaks = PriceBreaks(seller_parts)
+            for quantity in [0, 1, 2, 199, 200, 201, 999, 1000, 1001, 2000, 2500.5, 3000, 10000]:
+                self.assertEqual(SellerPart.optimal(seller_parts, quantity), price_breaks.optimal(quantity))
+
+    def test_cost_curve(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        self.client.login(username='kasper', password='ghostpassword')
+
+        for part in [p1, p2]:
+            seller_parts = list(SellerPart.objects.filter(manufacturer_part__part=part).order_by('id'))
+            curve = PriceBreaks(seller_parts).curve()
+            breakpoints = [quantity for quantity, _ in curve]
+            for quantity in range(1, 4000):
+                _, seller_part = curve[bisect_right(breakpoints, quantity) - 1]
+                self.assertEqual(SellerPart.optimal(seller_parts, quantity), seller_part)
+            self.assertEqual([point['seller_part'] for point in part.cost_curve()], [seller_part for _, seller_part in curve])
+
+        flat_bom = p3.latest().flat(top_level_quantity=1)
+        curve = flat_bom.cost_curve()
+        self.assertEqual(1, curve[0]['quantity'])
+        self.assertGreater(len(curve), 1)
+        breakpoints = [point['quantity'] for point in curve]
+        sweep = flat_bom.quantity_sweep(range(1, 600))
+        for row in sweep:
+            point = curve[bisect_right(breakpoints, row['quantity']) - 1]
+            self.assertEqual((row['unit_cost'], row['nre_cost'], row['missing_item_costs']),
+                             (point['unit_cost'], point['nre_cost'], point['missing_item_costs']))
+        # Each point is a quantity at which the cost changes
+        for previous, point in zip(curve, curve[1:]):
+            self.assertNotEqual((previous['unit_cost'], previous['nre_cost']), (point['unit_cost'], point['nre_cost']))
+
+        response = self.client.get(reverse('json:part-cost-curve', kwargs={'part_id': p1.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['content']['cost_curve']), len(p1.cost_curve()))
+        response = self.client.get(reverse('json:part-revision-cost-curve', kwargs={'part_revision_id': p3.latest().id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(breakpoints, [point['quantity'] for point in response.json()['content']['cost_curve']])
+
+    def test_optimize_purchase(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        self.client.login(username='kasper', password='ghostpassword')
+        currency = self.organization.currency
+
+        def brute_force_cost(flat_bom, seller_order_cost):
+            quantities = defaultdict(int)
+            for item in flat_bom.parts.values():
+                quantities[item.part.id] += item.total_extended_quantity
+            seller_parts = flat_bom.seller_parts()
+            costs = []
+            for choice in product(*[seller_parts[part_id] for part_id in quantities if seller_parts.get(part_id)]):
+                cost = sum(sp.unit_cost * sp.order_quantity(quantities[sp.manufacturer_part.part_id]) + sp.nre_cost for sp in choice)
+                costs.append(cost + seller_order_cost * len({sp.seller_id for sp in choice}))
+            return min(costs)
+
+        for quantity, seller_order_cost in [(10, 0), (100, 0), (1000, 0), (100, 50), (1000, 1000), (3000, 100000)]:
+            flat_bom = p3.latest().flat(top_level_quantity=quantity)
+            plan = flat_bom.optimize_purchase(seller_order_cost=Money(seller_order_cost, currency))
+            self.assertEqual(brute_force_cost(flat_bom, Money(seller_order_cost, currency)), plan.total_cost())
+            seller_parts = plan.seller_parts()
+            for item in flat_bom.parts.values():
+                self.assertEqual(seller_parts.get(item.part.id), item.seller_part)
+        self.assertEqual(1, plan.seller_count())
+
+        response = self.client.get(reverse('json:part-revision-purchase-plan', kwargs={'part_revision_id': p3.latest().id}),
+                                   {'quantity': 1000, 'seller_order_cost': '1000'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(1, response.json()['content']['seller_count'])
+        self.assertEqual(2, len(response.json()['content']['purchases']))
+        response = self.client.get(reverse('json:part-revision-purchase-plan', kwargs={'part_revision_id': p3.latest().id}), {'quantity': 'many'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_exchange_rates(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        backend = ExchangeBackend.objects.create(name=get_default_backend_name(), base_currency='USD')
+        Rate.objects.create(currency='EUR', value=Decimal('0.5'), backend=backend)
+        Rate.objects.create(currency='GBP', value=Decimal('0.25'), backend=backend)
+        cache.clear()
+
+        exchange_rates = ExchangeRates()
+        with self.assertNumQueries(2):
+            converted = exchange_rates.convert_all([Money(i, 'EUR') for i in range(100)] + [Money(1, 'GBP'), Money(3, 'USD')], 'USD')
+        self.assertEqual([Money(2 * i, 'USD') for i in range(100)] + [Money(4, 'USD'), Money(3, 'USD')], converted)
+        self.assertEqual(Money(2, 'EUR'), exchange_rates.convert(Money(1, 'GBP'), 'EUR'))
+        self.assertEqual({'a': Money(4, 'USD'), 'b': 'EUR'}, exchange_rates.convert_values({'a': Money(2, 'EUR'), 'b': 'EUR'}, 'USD'))
+
+        # A BOM totals seller parts priced in other currencies in the organization's
+        total_cost = p3.latest().flat(top_level_quantity=100).optimize_purchase().total_cost()
+        seller_part = SellerPart.objects.filter(manufacturer_part__part=p2).first()
+        seller_part.unit_cost = Money(seller_part.unit_cost.amount * Decimal('0.5'), 'EUR')
+        seller_part.save()
+        # and a purchase plan compares and totals them converted, so repricing at the exchange rate changes nothing
+        plan = p3.latest().flat(top_level_quantity=100).optimize_purchase(seller_order_cost=Money(0, 'EUR'))
+        self.assertEqual(total_cost, plan.total_cost())
+        # and a part's cost curve compares and prices them in the organization's currency
+        curve = p2.cost_curve(exchange_rates=exchange_rates)
+        self.assertEqual([point['seller_part'] for point in curve], [seller_part for _, seller_part in PriceBreaks(
+            SellerPart.by_part([p2.id])[p2.id], currency='USD').curve()])
+        for point in curve:
+            self.assertEqual(exchange_rates.convert(point['seller_part'].unit_cost, 'USD'), point['unit_cost'])
+            self.assertEqual('USD', str(point['cost'].currency))
+        indented_bom, flat_bom = p3.latest().explode(top_level_quantity=100)
+        expected_unit_cost = Money(0, self.organization.currency)
+        for item in flat_bom.parts.values():
+            if item.seller_part is not None:
+                expected_unit_cost += exchange_rates.convert(item.seller_part.unit_cost, 'USD') * item.extended_quantity
+        self.assertEqual(expected_unit_cost, flat_bom.unit_cost)
+        for item in flat_bom.parts.values():
+            export = item.as_dict_for_export(exchange_rates=flat_bom.exchange_rates())
+            for key in ['part_cost', 'part_ext_cost', 'part_out_of_pocket_cost']:
+                if isinstance(export[key], Money):
+                    self.assertEqual('USD', str(export[key].currency))
+
+    def test_bom_cache(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        pr1, pr2, pr3 = p1.latest(), p2.latest(), p3.latest()
+        pr3.explode()
+        with self.assertNumQueries(0):
+            indented_bom, flat_bom = pr3.explode(top_level_quantity=25)
+            flat_bom.as_dict()
+        self.assertEqual([1, 7, 28, 10], [item.extended_quantity for item in indented_bom.parts.values()])
+
+        # Sourcing edits move the BOMs that use the part to a new version
+        seller_part = indented_bom.parts[f'{pr3.id}{pr2.id}'].seller_part
+        seller_part.unit_cost = Money(0.01, seller_part.unit_cost.currency)
+        seller_part.save()
+        self.assertEqual(seller_part.unit_cost, pr3.flat(top_level_quantity=25).parts[str(pr2.id)].seller_part.unit_cost)
+
+        manufacturer_part = ManufacturerPart.objects.create(part=p2, manufacturer=None, manufacturer_part_number='NEW-MPN')
+        p2.primary_manufacturer_part = manufacturer_part
+        p2.save()
+        self.assertEqual('NEW-MPN', pr3.flat().parts[str(pr2.id)].as_dict_for_export()['part_manufacturer_part_number'])
+
+        seller_part.seller.name = 'Renamed Seller'
+        seller_part.seller.save()
+        self.assertEqual('Renamed Seller', pr3.flat(top_level_quantity=25).parts[str(pr2.id)].seller_part.seller.name)
+
+        # Versions move again once an edit is committed, a BOM another connection read and cached before then is dropped
+        with self.captureOnCommitCallbacks(execute=True):
+            seller_part.save()
+            versions = bom_cache_versions(pr3.id)
+        self.assertNotEqual(versions, bom_cache_versions(pr3.id))
+
+        # Bulk updates of part classes send no signals, the settings view drops every cached BOM for them
+        self.profile.role = 'A'
+        self.profile.save()
+        self.client.login(username='kasper', password='ghostpassword')
+        mouser_enabled = pr3.flat().parts[str(pr2.id)].part.number_class.mouser_enabled
+        self.client.post(reverse('bom:settings'), {'part-class-action': 'submit-part-class-disable-mouser' if mouser_enabled else 'submit-part-class-enable-mouser',
+                                                   'actions': [p2.number_class.id]})
+        self.assertEqual(not mouser_enabled, pr3.flat().parts[str(pr2.id)].part.number_class.mouser_enabled)
+
+        # Edits anywhere below a part revision clear its cached structure
+        subpart = pr2.assembly.subparts.get(part_revision=pr1)
+        subpart.count = 5
+        subpart.save()
+        self.assertEqual([1, 7, 35, 10], [item.extended_quantity for item in pr3.indented().parts.values()])
+
+        pr4 = create_a_fake_part_revision(p4, None)
+        pr1.assembly = create_a_fake_assembly_with_subpart(pr4)
+        pr1.save()
+        self.assertEqual([p3, p2, p1, p4, p1, p4], [item.part for item in pr3.indented().parts.values()])
+
+        pr1.assembly.subparts.add(create_a_fake_subpart(pr4, reference='', count=1))
+        self.assertEqual([1, 7, 35, 175, 10, 50], [item.extended_quantity for item in pr3.indented().parts.values()])
+
+        pr2.assembly.subparts.remove(subpart)
+        self.assertEqual([p3, p2, p1, p4], [item.part for item in pr3.indented().parts.values()])
+
+    def test_quantity_sweep_views(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        self.client.login(username='kasper', password='ghostpassword')
+        url = reverse('json:part-revision-quantity-sweep', kwargs={'part_revision_id': p3.latest().id})
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        sweep = response.json()['content']['quantity_sweep']
+        self.assertEqual(list(constants.QUANTITY_SWEEP_DEFAULT), [row['quantity'] for row in sweep])
+
+        response = self.client.get(url, {'quantities': '25, 250'})
+        self.assertEqual([25, 250], [row['quantity'] for row in response.json()['content']['quantity_sweep']])
+
+        response = self.client.get(url, {'quantities': '25, -1'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(reverse('bom:part-revision-export-quantity-sweep', kwargs={'part_revision_id': p3.latest().id}), {'quantities': '10,100'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Disposition'].endswith('_quantity_sweep.csv"'))
+        rows = list(csv.DictReader(response.content.decode('utf-8').splitlines()))
+        self.assertEqual(['10', '100'], [row['quantity'] for row in rows])
+
+        # Too many quantities are refused, as by the JSON endpoint, rather than cut short
+        quantities = ','.join(str(quantity) for quantity in range(1, constants.QUANTITY_SWEEP_MAX + 2))
+        response = self.client.get(url, {'quantities': quantities})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('bom:part-revision-export-quantity-sweep', kwargs={'part_revision_id': p3.latest().id}), {'quantities': quantities})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(any(f"At most {constants.QUANTITY_SWEEP_MAX} quantities" in str(m) for m in response.wsgi_request._messages))
+
+    def test_released_snapshot(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        pr1, pr2, pr3 = p1.latest(), p2.latest(), p3.latest()
+        self.client.login(username='kasper', password='ghostpassword')
+        response = self.client.post(reverse('bom:part-revision-release', kwargs={'part_id': p3.id, 'part_revision_id': pr3.id}))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(PartRevisionSnapshot.objects.filter(part_revision=pr3).exists())
+        pr3 = PartRevision.objects.get(id=pr3.id)
+        released_bom = pr3.indented(top_level_quantity=10)
+
+        # Edits to the working revisions it uses don't change the released BOM
+        subpart = pr2.assembly.subparts.get(part_revision=pr1)
+        subpart.count = 5
+        subpart.save()
+        pr2.assembly.subparts.add(create_a_fake_subpart(create_a_fake_part_revision(p4, None), reference='', count=1))
+        bom_config = dict(settings.BOM_CONFIG_DEFAULT, bom_cache=False)
+        with override_settings(BOM_CONFIG=bom_config), CaptureQueriesContext(connection) as queries:
+            indented_bom = pr3.indented(top_level_quantity=10)
+        self.assertEqual(0, len([q for q in queries.captured_queries if 'bom_assembly_subparts' in q['sql']]))
+        self.assertEqual(list(released_bom.parts.keys()), list(indented_bom.parts.keys()))
+        self.assertEqual([1, 7, 28, 10], [item.extended_quantity for item in indented_bom.parts.values()])
+        self.assertEqual([item.subpart.id if item.subpart else None for item in released_bom.parts.values()],
+                         [item.subpart.id if item.subpart else None for item in indented_bom.parts.values()])
+        self.assertEqual(released_bom.unit_cost, indented_bom.unit_cost)
+
+        response = self.client.get(reverse('bom:part-revision-export-bom-flat', kwargs={'part_revision_id': pr3.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(3, len(list(csv.DictReader(response.content.decode('utf-8').splitlines()))))
+
+        # The released BOM itself can't be changed, and subparts deleted below it lose their ids
+        self.profile.role = 'A'
+        self.profile.save()
+        subpart_ids = list(pr3.assembly.subparts.values_list('id', flat=True))
+        response = self.client.post(reverse('bom:part-add-subpart', kwargs={'part_id': p3.id, 'part_revision_id': pr3.id}),
+                                    {'subpart_part_number': p4.full_part_number(), 'count': 1, 'reference': '', 'do_not_load': False})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get(reverse('bom:part-remove-subpart', kwargs={'part_id': p3.id, 'part_revision_id': pr3.id, 'subpart_id': subpart_ids[0]}))
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get(reverse('bom:part-remove-all-subparts', kwargs={'part_id': p3.id, 'part_revision_id': pr3.id}))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(subpart_ids, list(pr3.assembly.subparts.values_list('id', flat=True)))
+        response = self.client.get(reverse('bom:part-manage-bom', kwargs={'part_id': p3.id, 'part_revision_id': pr3.id}))
+        self.assertFalse(response.context['editable'])
+        deleted_subpart_id = subpart.id
+        subpart.delete()
+        indented_bom = pr3.indented(top_level_quantity=10)
+        self.assertEqual(list(released_bom.parts.keys()), list(indented_bom.parts.keys()))
+        self.assertNotIn(deleted_subpart_id, [item.subpart.id for item in indented_bom.parts.values() if item.subpart])
+        self.assertIn(None, [item.subpart.id for item in indented_bom.parts.values() if item.subpart])
+
+        response = self.client.get(reverse('bom:part-revision-revert', kwargs={'part_id': p3.id, 'part_revision_id': pr3.id}))
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(PartRevisionSnapshot.objects.filter(part_revision=pr3).exists())
+        self.assertEqual([1, 7, 7, 10], [item.extended_quantity for item in PartRevision.objects.get(id=pr3.id).indented(top_level_quantity=10).parts.values()])
+
+    def assertContentHashesAreCurrent(self):
+        content_hashes = dict(Assembly.objects.values_list('id', 'content_hash'))
+        Assembly.rebuild_content_hashes()
+        self.assertEqual(dict(Assembly.objects.values_list('id', 'content_hash')), content_hashes)
+
+    def test_assembly_content_hash(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        pr1, pr2, pr3 = p1.latest(), p2.latest(), p3.latest()
+        self.assertContentHashesAreCurrent()
+        self.assertNotEqual(pr2.assembly.content_hash, pr3.assembly.content_hash)
+
+        # The same subparts in another order hash the same
+        assembly = create_a_fake_assembly()
+        for subpart in reversed(list(pr3.assembly.subparts.all())):
+            assembly.subparts.add(create_a_fake_subpart(subpart.part_revision, reference=subpart.reference, count=subpart.count))
+        self.assertEqual(Assembly.objects.get(id=pr3.assembly_id).content_hash, Assembly.objects.get(id=assembly.id).content_hash)
+
+        # Changes deep in the BOM reach every assembly above them
+        content_hashes = dict(Assembly.objects.values_list('id', 'content_hash'))
+        pr1.assembly.subparts.add(create_a_fake_subpart(create_a_fake_part_revision(p4, None), reference='', count=1))
+        self.assertContentHashesAreCurrent()
+        for assembly_id in [pr1.assembly_id, pr2.assembly_id, pr3.assembly_id, assembly.id]:
+            self.assertNotEqual(content_hashes[assembly_id], Assembly.objects.get(id=assembly_id).content_hash)
+
+        subpart = pr3.assembly.subparts.get(part_revision=pr1)
+        subpart.reference = 'U1'
+        subpart.save()
+        self.assertContentHashesAreCurrent()
+        self.assertNotEqual(Assembly.objects.get(id=pr3.assembly_id).content_hash, Assembly.objects.get(id=assembly.id).content_hash)
+
+        pr2.assembly.subparts.remove(pr2.assembly.subparts.get(part_revision=pr1))
+        self.assertContentHashesAreCurrent()
+        pr1.delete()
+        self.assertContentHashesAreCurrent()
+
+    def test_part_revision_new_copies_content_hash(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        self.client.login(username='kasper', password='ghostpassword')
+        new_part_revision_form_data = {
+            'description': 'new rev',
+            'revision': '3',
+            'part': p3.id,
+            'configuration': 'W',
+            'copy_assembly': 'true'
+        }
+        previous = p3.latest()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('bom:part-revision-new', kwargs={'part_id': p3.id}), new_part_revision_form_data)
+        self.assertEqual(response.status_code, 302)
+        # The subparts and their rows in the assembly are each copied in one insert
+        inserts = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('INSERT')]
+        self.assertEqual(len([sql for sql in inserts if sql.startswith('INSERT INTO "bom_subpart"')]), 1)
+        self.assertEqual(len([sql for sql in inserts if sql.startswith('INSERT INTO "bom_assembly_subparts"')]), 1)
+
+        latest = p3.latest()
+        self.assertNotEqual(previous.assembly_id, latest.assembly_id)
+        subpart_fields = ('part_revision_id', 'count', 'reference', 'do_not_load')
+        self.assertEqual(list(previous.assembly.subparts.order_by('assemblysubparts__id').values_list(*subpart_fields)),
+                         list(latest.assembly.subparts.order_by('assemblysubparts__id').values_list(*subpart_fields)))
+        self.assertFalse(set(previous.assembly.subparts.values_list('id', flat=True)) & set(latest.assembly.subparts.values_list('id', flat=True)))
+        self.assertEqual(previous.assembly.content_hash, latest.assembly.content_hash)
+        self.assertEqual([(item.part, item.extended_quantity) for item in previous.indented().parts.values()][1:],
+                         [(item.part, item.extended_quantity) for item in latest.indented().parts.values()][1:])
+        self.assertContentHashesAreCurrent()
+        self.assertClosureIsCurrent()
+
+    def test_bom_diff(self):
+        (p1, p2, p3, p4) = create_some_fake_parts(organization=self.organization)
+        self.client.login(username='kasper', password='ghostpassword')
+        rev1, rev2 = p3.revisions().order_by('id')
+        self.assertEqual(bom_diff(rev1, rev2), [])
+
+        new_part_revision_form_data = {
+            'description': 'new rev',
+            'revision': '3',
+            'part': p3.id,
+            'configuration': 'W',
+            'copy_assembly': 'true'
+        }
+        response = self.client.post(reverse('bom:part-revision-new', kwargs={'part_id': p3.id}), new_part_revision_form_data)
+        self.assertEqual(response.status_code, 302)
+        rev3 = p3.latest()
+        self.assertEqual(bom_diff(rev2, rev3), [])
+
+        pr1 = p1.latest()
+        pr2 = p2.latest()
+        pr4 = create_a_fake_part_revision(p4, None)
+        rev3.assembly.subparts.filter(part_revision=pr1).delete()
+        rev3.assembly.subparts.filter(part_revision=pr2, count=3).delete()
+        rev3.assembly.subparts.add(create_a_fake_subpart(pr4, count=2, reference='U1, U2'))
+
+        diff = bom_diff(rev2, rev3)
+        # The sub-assembly of p2 is the same in both, so nothing below it shows up
+        self.assertEqual([(line['status'], line['path'], line['changes']) for line in diff], [
+            ('changed', [p2.full_part_number()], ['quantity']),
+            ('removed', [p1.full_part_number()], []),
+            ('added', [p4.full_part_number()], []),
+        ])
+        self.assertEqual((diff[0]['old']['quantity'], diff[0]['new']['quantity']), (7, 4))
+        self.assertEqual(diff[2]['new']['references'], 'U1, U2')
+        self.assertIsNone(diff[2]['old'])
+
+        # A part revision without an assembly has an empty BOM
+        PartRevision.objects.filter(id=pr4.id).update(assembly=None)
+        pr4 = PartRevision.objects.get(id=pr4.id)
+        self.assertEqual([(line['status'], line['path']) for line in bom_diff(pr4, rev3)],
+                         [('added', [p2.full_part_number()]), ('added', [p2.full_part_number(), p1.full_part_number()]), ('added', [p4.full_part_number()])])
+        self.assertEqual(['removed'] * 3, [line['status'] for line in bom_diff(rev3, pr4)])
+        self.assertEqual(bom_diff(pr4, create_a_fake_part_revision(p4, None, revision='2')), [])
+
+        response = self.client.get(reverse('json:part-revision-compare', kwargs={'part_revision_id': rev3.id, 'other_part_revision_id': rev2.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([line['status'] for line in response.json()['content']['diff']], ['changed', 'removed', 'added'])
+
+        response = self.client.get(reverse('bom:part-revision-compare', kwargs={'part_id': p3.id, 'part_revision_id': rev3.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['against'], rev2)
+        self.assertContains(response, p4.full_part_number())
+
+        response = self.client.get(reverse('bom:part-revision-compare', kwargs={'part_id': p3.id, 'part_revision_id': rev3.id}), {'against': rev1.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['diff']), 3)
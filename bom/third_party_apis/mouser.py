@@ -1,9 +1,10 @@
 from moneyed import Money
 
 from bom.utils import parse_number
-from djmoney.contrib.exchange.models import convert_money
 from .base_api import BaseApi, BaseApiError
+from ..exchange_rates import ExchangeRates
 from ..models import SellerPart, Seller
+from ..price_breaks import PriceBreaks
 import json
 
 
@@ -65,6 +66,8 @@ class MouserApi(BaseApi):
 class Mouser:
     def __init__(self):
         self.api = MouserApi()
+        # Every price break of every part matched is converted, so rates are looked up once per Mouser instance
+        self.exchange_rates = ExchangeRates()
 
     def search_and_match(self, manufacturer_part, quantity=1, currency=None):
         manufacturer = manufacturer_part.manufacturer
@@ -107,7 +110,7 @@ class Mouser:
                     unit_currency = pb['Currency']
                     unit_cost = Money(unit_price_raw, unit_currency)
                     if currency:
-                        unit_cost = convert_money(unit_cost, currency)
+                        unit_cost = self.exchange_rates.convert(unit_cost, currency)
                     seller_part = SellerPart(
                         seller=seller,
                         seller_part_number=part['MouserPartNumber'],
@@ -128,5 +131,5 @@ class Mouser:
         seller_parts.extend(local_seller_parts)
         return {
             'mouser_parts': mouser_parts,
-            'optimal_seller_part': SellerPart.optimal(seller_parts, quantity),
+            'optimal_seller_part': PriceBreaks(seller_parts).optimal(quantity),
         }
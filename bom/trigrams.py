@@ -0,0 +1,106 @@
+import re
+from math import ceil
+
+from django.db import connection
+from django.db.models import Count
+from django.db.models.expressions import RawSQL
+
+
+# Fuzzy matches are at least this similar, pg_trgm's default similarity threshold
+SIMILARITY_THRESHOLD = 0.3
+
+
+def trigrams(value):
+    # The trigrams of value as pg_trgm makes them: each word of letters and digits, lower cased, with two spaces in
+    # front and one behind
+    return {padded[i:i + 3] for word in re.findall(r'[^\W_]+', (value or '').lower()) for padded in [f'  {word} ']
+            for i in range(len(padded) - 2)}
+
+
+def substring_trigrams(value):
+    # The trigrams that any value containing value has, those within its words. Empty if no word has three characters.
+    return {word[i:i + 3] for word in re.findall(r'[^\W_]+', (value or '').lower()) for i in range(len(word) - 2)}
+
+
+def similarity(value_trigrams, other_trigrams):
+    union = len(value_trigrams | other_trigrams)
+    return len(value_trigrams & other_trigrams) / union if union else 0
+
+
+def rebuild_trigrams(model, field, trigram_model, related_field, batch_size=1000):
+    # Model classes are passed in so that migrations can use their historical models
+    trigram_model.objects.all().delete()
+    trigram_model.objects.bulk_create([
+        trigram_model(**{f'{related_field}_id': object_id, 'trigram': trigram})
+        for object_id, value in model.objects.values_list('id', field) for trigram in trigrams(value)
+    ], batch_size=batch_size)
+
+
+class TrigramIndex:
+    """
+    Substring and fuzzy search on a text field. On PostgreSQL the field has a pg_trgm GIN index that icontains lookups
+    and similarity() use directly. Elsewhere the trigrams of each value are kept in a side table, with a row per
+    trigram indexed by trigram: a substring can only be in values that have all of its trigrams, so icontains only
+    scans those, and similarity counts the trigrams a value shares with the search term.
+    """
+
+    def __init__(self, model, field, trigram_model, related_field):
+        self.model = model
+        self.field = field
+        self.trigram_model = trigram_model
+        self.related_field = related_field
+
+    @staticmethod
+    def uses_pg_trgm():
+        return connection.vendor == 'postgresql'
+
+    def update(self, object_ids):
+        object_ids = list(object_ids)
+        if self.uses_pg_trgm() or not object_ids:
+            return
+        self.trigram_model.objects.filter(**{f'{self.related_field}_id__in': object_ids}).delete()
+        self.trigram_model.objects.bulk_create([
+            self.trigram_model(**{f'{self.related_field}_id': object_id, 'trigram': trigram})
+            for object_id, value in self.model.objects.filter(id__in=object_ids).values_list('id', self.field)
+            for trigram in trigrams(value)
+        ])
+
+    def rebuild(self):
+        if not self.uses_pg_trgm():
+            rebuild_trigrams(self.model, self.field, self.trigram_model, self.related_field)
+
+    def contains(self, queryset, term):
+        # queryset filtered to values containing term, ignoring case
+        queryset = queryset.filter(**{f'{self.field}__icontains': term})
+        term_trigrams = substring_trigrams(term)
+        if self.uses_pg_trgm() or not term_trigrams:
+            return queryset
+        candidates = self.trigram_model.objects.filter(trigram__in=term_trigrams).values(self.related_field) \
+            .annotate(trigram_count=Count('id')).filter(trigram_count=len(term_trigrams)).values(self.related_field)
+        return queryset.filter(id__in=candidates)
+
+    def similar(self, queryset, term, threshold=SIMILARITY_THRESHOLD):
+        # The similarity of each value of queryset at least threshold similar to term, by id, as pg_trgm's similarity()
+        term_trigrams = trigrams(term)
+        if not term_trigrams:
+            return {}
+        if self.uses_pg_trgm():
+            column = f'{self.model._meta.db_table}.{self.model._meta.get_field(self.field).column}'
+            return dict(queryset.annotate(similarity=RawSQL(f'similarity(UPPER({column}::text), UPPER(%s))', [term]))
+                        .filter(similarity__gte=threshold).values_list('id', 'similarity'))
+
+        # A value sharing n trigrams is at most n / len(term_trigrams) similar, so the rest aren't looked at
+        shared_counts = dict(self.trigram_model.objects
+                             .filter(trigram__in=term_trigrams, **{f'{self.related_field}__in': queryset.values('id')})
+                             .values(self.related_field).annotate(trigram_count=Count('id'))
+                             .filter(trigram_count__gte=ceil(threshold * len(term_trigrams)))
+                             .values_list(self.related_field, 'trigram_count'))
+        trigram_counts = self.trigram_model.objects.filter(**{f'{self.related_field}__in': list(shared_counts)}) \
+            .values(self.related_field).annotate(trigram_count=Count('id')).values_list(self.related_field, 'trigram_count')
+        similarities = {}
+        for object_id, trigram_count in trigram_counts:
+            shared_count = shared_counts[object_id]
+            value_similarity = shared_count / (len(term_trigrams) + trigram_count - shared_count)
+            if value_similarity >= threshold:
+                similarities[object_id] = value_similarity
+        return similarities
@@ -45,6 +45,7 @@ bom_patterns = [
     path('part/<int:part_id>/rev/<int:part_revision_id>/edit/', views.part_revision_edit, name='part-revision-edit'),
     path('part/<int:part_id>/rev/<int:part_revision_id>/delete/', views.part_revision_delete, name='part-revision-delete'),
     path('part/<int:part_id>/rev/<int:part_revision_id>/release/', views.part_revision_release, name='part-revision-release'),
+    path('part/<int:part_id>/rev/<int:part_revision_id>/compare/', views.part_revision_compare, name='part-revision-compare'),
     path('part/<int:part_id>/rev/<int:part_revision_id>/revert/', views.part_revision_revert, name='part-revision-revert'),
     path('part/<int:part_id>/rev/<int:part_revision_id>/remove-all-subparts/', views.remove_all_subparts, name='part-remove-all-subparts'),
     path('part/<int:part_id>/rev/<int:part_revision_id>/edit-subpart/<int:subpart_id>', views.edit_subpart, name='part-edit-subpart'),
@@ -58,6 +59,7 @@ bom_patterns = [
     path('part-rev/<int:part_revision_id>/export-flat/', views.part_export_bom, name='part-revision-export-bom-flat', kwargs={'flat': True}),
     path('part-rev/<int:part_revision_id>/export-flat-sourcing/', views.part_export_bom, name='part-revision-export-bom-flat-sourcing', kwargs={'flat': True, 'sourcing': True}),
     path('part-rev/<int:part_revision_id>/export-flat-sourcing-detailed/', views.part_export_bom, name='part-revision-export-bom-flat-sourcing-detailed', kwargs={'flat': True, 'sourcing_detailed': True}),
+    path('part-rev/<int:part_revision_id>/export-quantity-sweep/', views.part_export_quantity_sweep, name='part-revision-export-quantity-sweep'),
 
     path('sellerpart/<int:sellerpart_id>/edit/', views.sellerpart_edit, name='sellerpart-edit'),
     path('sellerpart/<int:sellerpart_id>/delete/', views.sellerpart_delete, name='sellerpart-delete'),
@@ -71,7 +73,14 @@ google_drive_patterns = [
 ]
 
 json_patterns = [
-    path('mouser-part-match-bom/<int:part_revision_id>/', json_views.MouserPartMatchBOM.as_view(), name='mouser-part-match-bom')
+    path('autocomplete/', json_views.Autocomplete.as_view(), name='autocomplete'),
+    path('autocomplete-options/<str:source>/', json_views.AutocompleteOptions.as_view(), name='autocomplete-options'),
+    path('mouser-part-match-bom/<int:part_revision_id>/', json_views.MouserPartMatchBOM.as_view(), name='mouser-part-match-bom'),
+    path('part-cost-curve/<int:part_id>/', json_views.PartCostCurve.as_view(), name='part-cost-curve'),
+    path('part-revision-cost-curve/<int:part_revision_id>/', json_views.PartRevisionCostCurve.as_view(), name='part-revision-cost-curve'),
+    path('part-revision-compare/<int:part_revision_id>/<int:other_part_revision_id>/', json_views.PartRevisionCompare.as_view(), name='part-revision-compare'),
+    path('part-revision-purchase-plan/<int:part_revision_id>/', json_views.PartRevisionPurchasePlan.as_view(), name='part-revision-purchase-plan'),
+    path('part-revision-quantity-sweep/<int:part_revision_id>/', json_views.PartRevisionQuantitySweep.as_view(), name='part-revision-quantity-sweep'),
 ]
 
 urlpatterns = [
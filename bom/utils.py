@@ -99,6 +99,14 @@ def strip_trailing_zeros(num):
     return ('%f' % float(num)).rstrip('0').rstrip('.') if found else num
 
 
+# Input a comma separated string of quantities, e.g. '10, 100, 1000', return them as a list of positive ints
+def listify_quantities(st):
+    quantities = [int(q) for q in listify_string(st)]
+    if any(q <= 0 for q in quantities):
+        raise ValueError('Quantities must be positive')
+    return quantities
+
+
 # Input a dict with a list of key options, return the value if it exists, else None
 def get_from_dict(input_dict, key_options):
     for key in key_options:
@@ -1,3 +1,5 @@
+from decimal import Decimal, InvalidOperation
+
 from django.contrib.auth.decorators import login_required
 from django.core.cache import cache
 from django.http import JsonResponse
@@ -5,18 +7,82 @@ from django.shortcuts import get_object_or_404
 from django.utils.decorators import method_decorator
 from django.views import View
 
+from djmoney.money import Money
+
+from bom.autocomplete import autocomplete, autocomplete_options
+from bom.bom_diff import bom_diff
+from bom.constants import (
+    AUTOCOMPLETE_KINDS,
+    AUTOCOMPLETE_LIMIT_DEFAULT,
+    AUTOCOMPLETE_LIMIT_MAX,
+    AUTOCOMPLETE_OPTIONS_SOURCES,
+    AUTOCOMPLETE_PARTS,
+    QUANTITY_SWEEP_DEFAULT,
+    QUANTITY_SWEEP_MAX,
+)
+from bom.explosion import BomCycleError
 from bom.models import Part, PartClass, Subpart, SellerPart, Organization, Manufacturer, ManufacturerPart, User, UserMeta, PartRevision, Assembly, AssemblySubparts
 from bom.third_party_apis.mouser import Mouser
 from bom.third_party_apis.base_api import BaseApiError
+from bom.utils import listify_quantities
 
 
 class BomJsonResponse(View):
     response = {'errors': [], 'content': {}}
 
 
+@method_decorator(login_required, name='dispatch')
+class Autocomplete(BomJsonResponse):
+    def get(self, request):
+        self.response = {'errors': [], 'content': {}}
+        organization = request.user.bom_profile().organization
+        if organization is None:
+            self.response['errors'].append("You aren't part of an organization.")
+            return JsonResponse(self.response, status=403)
+
+        kind = request.GET.get('kind', AUTOCOMPLETE_PARTS)
+        try:
+            limit = int(request.GET.get('limit', AUTOCOMPLETE_LIMIT_DEFAULT))
+        except ValueError:
+            limit = 0
+        if kind not in AUTOCOMPLETE_KINDS or not 0 < limit <= AUTOCOMPLETE_LIMIT_MAX:
+            self.response['errors'].append(f"Kind must be one of {', '.join(AUTOCOMPLETE_KINDS)} and limit a whole number from 1 to {AUTOCOMPLETE_LIMIT_MAX}.")
+            return JsonResponse(self.response, status=400)
+
+        query = request.GET.get('q', '').strip()
+        self.response['content']['suggestions'] = autocomplete(organization, kind, query, limit) if query else []
+        return JsonResponse(self.response)
+
+
+@method_decorator(login_required, name='dispatch')
+class AutocompleteOptions(BomJsonResponse):
+    def get(self, request, source):
+        self.response = {'errors': [], 'content': {}}
+        organization = request.user.bom_profile().organization
+        if organization is None:
+            self.response['errors'].append("You aren't part of an organization.")
+            return JsonResponse(self.response, status=403)
+
+        try:
+            limit = int(request.GET.get('limit', AUTOCOMPLETE_LIMIT_DEFAULT))
+            offset = int(request.GET.get('offset', 0))
+            exclude_ids = [int(exclude_id) for exclude_id in request.GET.getlist('exclude')]
+        except ValueError:
+            limit, offset, exclude_ids = 0, 0, []
+        if source not in AUTOCOMPLETE_OPTIONS_SOURCES or not 0 < limit <= AUTOCOMPLETE_LIMIT_MAX or offset < 0:
+            self.response['errors'].append(f"Source must be one of {', '.join(AUTOCOMPLETE_OPTIONS_SOURCES)}, limit a whole number from 1 to "
+                                           f"{AUTOCOMPLETE_LIMIT_MAX} and offset a whole number.")
+            return JsonResponse(self.response, status=400)
+
+        options, has_more = autocomplete_options(organization, source, request.GET.get('q', '').strip(), exclude_ids, offset, limit)
+        self.response['content'].update({'options': options, 'has_more': has_more})
+        return JsonResponse(self.response)
+
+
 @method_decorator(login_required, name='dispatch')
 class MouserPartMatchBOM(BomJsonResponse):
     def get(self, request, part_revision_id):
+        self.response = {'errors': [], 'content': {}}
         part_revision = get_object_or_404(PartRevision, pk=part_revision_id)  # get all of the pricing for manufacturer parts, marked with mouser in this part
         user = request.user
         profile = user.bom_profile()
@@ -28,7 +94,11 @@ class MouserPartMatchBOM(BomJsonResponse):
         qty_cache_key = str(part.id) + '_qty'
         assy_quantity = cache.get(qty_cache_key, 100)
 
-        flat_bom = part_revision.flat(assy_quantity)
+        try:
+            flat_bom = part_revision.flat(assy_quantity)
+        except BomCycleError as err:
+            self.response['errors'].append(str(err))
+            return JsonResponse(self.response, status=400)
 
         mouser = Mouser()
         manufacturer_parts = flat_bom.mouser_parts()
@@ -53,3 +123,148 @@ class MouserPartMatchBOM(BomJsonResponse):
         flat_bom_dict = flat_bom.as_dict()
         self.response['content'].update({'flat_bom': flat_bom_dict})
         return JsonResponse(self.response)
+
+
+@method_decorator(login_required, name='dispatch')
+class PartRevisionQuantitySweep(BomJsonResponse):
+    def get(self, request, part_revision_id):
+        self.response = {'errors': [], 'content': {}}
+        part_revision = get_object_or_404(PartRevision, pk=part_revision_id)
+        organization = request.user.bom_profile().organization
+        if part_revision.part.organization != organization:
+            self.response['errors'].append("Can't access a part that is not yours!")
+            return JsonResponse(self.response, status=403)
+
+        try:
+            quantities = listify_quantities(request.GET.get('quantities')) or QUANTITY_SWEEP_DEFAULT
+        except ValueError:
+            self.response['errors'].append("Quantities must be a comma separated list of positive whole numbers.")
+            return JsonResponse(self.response, status=400)
+        if len(quantities) > QUANTITY_SWEEP_MAX:
+            self.response['errors'].append(f"At most {QUANTITY_SWEEP_MAX} quantities can be swept at once.")
+            return JsonResponse(self.response, status=400)
+
+        try:
+            flat_bom = part_revision.flat(top_level_quantity=1)
+        except BomCycleError as err:
+            self.response['errors'].append(str(err))
+            return JsonResponse(self.response)
+
+        sweep = [{k: v.amount if isinstance(v, Money) else v for k, v in row.items()} for row in flat_bom.quantity_sweep(quantities)]
+        self.response['content'].update({'currency': str(organization.currency), 'quantity_sweep': sweep})
+        return JsonResponse(self.response)
+
+
+@method_decorator(login_required, name='dispatch')
+class PartCostCurve(BomJsonResponse):
+    def get(self, request, part_id):
+        self.response = {'errors': [], 'content': {}}
+        part = get_object_or_404(Part, pk=part_id)
+        organization = request.user.bom_profile().organization
+        if part.organization != organization:
+            self.response['errors'].append("Can't access a part that is not yours!")
+            return JsonResponse(self.response, status=403)
+
+        curve = [{
+            'quantity': point['quantity'],
+            'seller_part': {
+                'id': point['seller_part'].id,
+                'seller': point['seller_part'].seller.name,
+                'seller_part_number': point['seller_part'].seller_part_number,
+                'manufacturer_part_number': point['seller_part'].manufacturer_part.manufacturer_part_number,
+                'minimum_order_quantity': point['seller_part'].minimum_order_quantity,
+                'minimum_pack_quantity': point['seller_part'].minimum_pack_quantity,
+            },
+            'unit_cost': point['unit_cost'].amount,
+            'cost': point['cost'].amount,
+        } for point in part.cost_curve()]
+        self.response['content'].update({'currency': str(organization.currency), 'cost_curve': curve})
+        return JsonResponse(self.response)
+
+
+@method_decorator(login_required, name='dispatch')
+class PartRevisionCostCurve(BomJsonResponse):
+    def get(self, request, part_revision_id):
+        self.response = {'errors': [], 'content': {}}
+        part_revision = get_object_or_404(PartRevision, pk=part_revision_id)
+        organization = request.user.bom_profile().organization
+        if part_revision.part.organization != organization:
+            self.response['errors'].append("Can't access a part that is not yours!")
+            return JsonResponse(self.response, status=403)
+
+        try:
+            flat_bom = part_revision.flat(top_level_quantity=1)
+        except BomCycleError as err:
+            self.response['errors'].append(str(err))
+            return JsonResponse(self.response)
+
+        curve = [{k: v.amount if isinstance(v, Money) else v for k, v in point.items()} for point in flat_bom.cost_curve()]
+        self.response['content'].update({'currency': str(organization.currency), 'cost_curve': curve})
+        return JsonResponse(self.response)
+
+
+@method_decorator(login_required, name='dispatch')
+class PartRevisionPurchasePlan(BomJsonResponse):
+    def get(self, request, part_revision_id):
+        self.response = {'errors': [], 'content': {}}
+        part_revision = get_object_or_404(PartRevision, pk=part_revision_id)
+        organization = request.user.bom_profile().organization
+        if part_revision.part.organization != organization:
+            self.response['errors'].append("Can't access a part that is not yours!")
+            return JsonResponse(self.response, status=403)
+
+        try:
+            quantity = int(request.GET.get('quantity', 100))
+            seller_order_cost = Decimal(request.GET.get('seller_order_cost', 0))
+        except (ValueError, InvalidOperation):
+            quantity, seller_order_cost = 0, None
+        if quantity <= 0 or seller_order_cost is None or not seller_order_cost.is_finite() or seller_order_cost < 0:
+            self.response['errors'].append("Quantity must be a positive whole number and seller order cost an amount of zero or more.")
+            return JsonResponse(self.response, status=400)
+
+        try:
+            flat_bom = part_revision.flat(top_level_quantity=quantity)
+        except BomCycleError as err:
+            self.response['errors'].append(str(err))
+            return JsonResponse(self.response)
+
+        plan = flat_bom.optimize_purchase(seller_order_cost=Money(seller_order_cost, organization.currency))
+        purchases = [{
+            'part_id': purchase['part_id'],
+            'seller_part_id': purchase['seller_part'].id,
+            'seller': purchase['seller_part'].seller.name,
+            'seller_part_number': purchase['seller_part'].seller_part_number,
+            'quantity': purchase['quantity'],
+            'order_quantity': purchase['order_quantity'],
+            'cost': purchase['cost'].amount,
+        } for purchase in plan.purchases()]
+        self.response['content'].update({
+            'currency': str(organization.currency),
+            'quantity': quantity,
+            'purchases': purchases,
+            'seller_count': plan.seller_count(),
+            'total_cost': plan.total_cost().amount,
+            'missing_part_ids': plan.missing_part_ids,
+        })
+        return JsonResponse(self.response)
+
+
+@method_decorator(login_required, name='dispatch')
+class PartRevisionCompare(BomJsonResponse):
+    def get(self, request, part_revision_id, other_part_revision_id):
+        self.response = {'errors': [], 'content': {}}
+        part_revision = get_object_or_404(PartRevision, pk=part_revision_id)
+        other_part_revision = get_object_or_404(PartRevision, pk=other_part_revision_id)
+        organization = request.user.bom_profile().organization
+        if part_revision.part.organization != organization or other_part_revision.part.organization != organization:
+            self.response['errors'].append("Can't access a part that is not yours!")
+            return JsonResponse(self.response, status=403)
+
+        try:
+            diff = bom_diff(other_part_revision, part_revision)
+        except BomCycleError as err:
+            self.response['errors'].append(str(err))
+            return JsonResponse(self.response)
+
+        self.response['content'].update({'diff': diff})
+        return JsonResponse(self.response)
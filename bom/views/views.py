@@ -11,7 +11,7 @@ from django.contrib.auth.decorators import login_required
 from django.core.cache import cache
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.db import IntegrityError
-from django.db.models import Count, ProtectedError, Q, Subquery, prefetch_related_objects
+from django.db.models import Count, F, ProtectedError, Q, Subquery
 from django.db.models.aggregates import Max
 from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
@@ -24,14 +24,18 @@ from django.views.generic.base import TemplateView
 from social_django.models import UserSocialAuth
 
 import bom.constants as constants
+from bom.bom_cache import invalidate_all_bom_caches
+from bom.bom_diff import bom_diff
 from bom.csv_headers import (
     BOMFlatCSVHeaders,
     BOMIndentedCSVHeaders,
+    BOMQuantitySweepCSVHeaders,
     ManufacturerPartCSVHeaders,
     PartClassesCSVHeaders,
     SellerPartCSVHeaders,
 )
 from bom.decorators import organization_admin
+from bom.explosion import BomCycleError
 from bom.forms import (
     AddSubpartForm,
     BOMCSVForm,
@@ -67,12 +71,15 @@ from bom.models import (
     Part,
     PartClass,
     PartRevision,
+    PartRevisionParameter,
     SellerPart,
     Subpart,
     User,
     UserMeta,
 )
-from bom.utils import check_references_for_duplicates, listify_string, prep_for_sorting_nicely
+from bom.parameters import parse_parameter_filters
+from bom.search import bom_search_backend, search_parts, search_rank
+from bom.utils import check_references_for_duplicates, listify_quantities, listify_string, prep_for_sorting_nicely
 
 
 logger = logging.getLogger(__name__)
@@ -129,12 +136,10 @@ def home(request):
     else:
         parts = Part.objects.filter(organization=organization)
 
-    part_ids = list(parts.values_list('id', flat=True))
-
     part_revs = PartRevision.objects\
         .filter(id__in=Subquery(
             PartRevision.objects.filter(
-                part_id__in=part_ids
+                part_id__in=parts.values('id')
             ).annotate(max_id=Max('id')).values("id")
         )).order_by(
             "part__number_class__code",
@@ -142,27 +147,19 @@ def home(request):
             "part__number_variation",
         )
 
-    autocomplete_dict = {}
+    # Suggestions are fetched from json:autocomplete as the search is typed
     enable_autocomplete = settings.BOM_CONFIG.get('admin_dashboard', {}).get('enable_autocomplete', False)
-    if enable_autocomplete:
-        prefetch_related_objects(part_revs, 'part')
-        manufacturer_parts = ManufacturerPart.objects.filter(part__in=parts)
-
-        for pr in part_revs:
-            autocomplete_dict.update({pr.searchable_synopsis.replace('"', ''): None})
-            autocomplete_dict.update({pr.part.full_part_number(): None})
-
-        for mpn in manufacturer_parts:
-            if mpn.manufacturer_part_number:
-                autocomplete_dict.update({mpn.manufacturer_part_number.replace('"', ''): None})
-            if mpn.manufacturer is not None and mpn.manufacturer.name:
-                autocomplete_dict.update({mpn.manufacturer.name.replace('"', ''): None})
-
-    autocomplete = dumps(autocomplete_dict)
+    autocomplete_limit = constants.AUTOCOMPLETE_LIMIT_DEFAULT
 
     if query:
         query_stripped = query.strip()
 
+        # Take quantities with units out of the query, such as '10k-100k Ω', '>=50 V' or '4.7uF'. Parts have to match
+        # all of them, through the parameters of their part revisions, as well as any of the search terms that remain.
+        parameter_filters, query_stripped = parse_parameter_filters(query_stripped)
+        if parameter_filters:
+            parts = parts.filter(id__in=PartRevisionParameter.matching(parameter_filters).values('part_id'))
+
         # Parse terms separated by white space but keep together words inside of double quotes,
         # for example 
         #   "Big Company Inc." 
@@ -171,54 +168,64 @@ def home(request):
         # is parsed as 'Big' 'Company' 'Inc.'
         search_terms = query_stripped
         search_terms = list(smart_split(search_terms))
-        search_terms = [search_term.replace('"', '') for search_term in search_terms]
+        search_terms = [search_term.replace('"', '').strip(',') for search_term in search_terms]
+        search_terms = [search_term for search_term in search_terms if search_term]
         noqoutes_query = query_stripped.replace('"', '')
 
-        number_class = None
-        number_item = None
-        number_variation = None
-
-        # Scan for search terms that might represent a complete or partial part number
-        if organization.number_scheme == constants.NUMBER_SCHEME_SEMI_INTELLIGENT:
-            for search_term in search_terms:
-                try:
-                    (number_class, number_item, number_variation) = Part.parse_partial_part_number(search_term, organization, validate=False)
-                except AttributeError:
-                    pass
-
-        # Query searchable_synopsis by OR'ing search terms
-        part_synopsis_ids = PartRevision.objects.filter(reduce(operator.or_, (Q(searchable_synopsis__icontains=term) for term in search_terms))).values_list("part", flat=True)
-        # Prepare Part.primary_manufacturer_part.manufacturer_part_number query by OR'ing search terms
-        q_primary_mpn = reduce(operator.or_, (Q(primary_manufacturer_part__manufacturer_part_number__icontains=term) for term in search_terms))
-
-        # Prepare Part.primary_manufacturer.part__manufacturer.name query by OR'ing search terms
-        q_primary_mfg = reduce(operator.or_, (Q(primary_manufacturer_part__manufacturer__name__icontains=term) for term in search_terms))
-
-        if number_class and number_item and number_variation:
-            parts = parts.filter(
-                Q(number_class__code=number_class, number_item=number_item, number_variation=number_variation) |
-                Q(id__in=part_synopsis_ids) |
-                q_primary_mpn |
-                q_primary_mfg)
-        elif number_class and number_item:
-            parts = parts.filter(
-                Q(number_class__code=number_class, number_item=number_item) |
-                Q(id__in=part_synopsis_ids) |
-                q_primary_mpn |
-                q_primary_mfg)
-        else:
-            parts = parts.filter(
-                Q(number_item__in=search_terms) |
-                Q(id__in=part_synopsis_ids) |
-                q_primary_mpn |
-                q_primary_mfg)
+        search_rank_expression = None
+        if search_terms:
+            number_class = None
+            number_item = None
+            number_variation = None
 
-        part_ids = list(parts.values_list('id', flat=True))
+            # Scan for search terms that might represent a complete or partial part number
+            if organization.number_scheme == constants.NUMBER_SCHEME_SEMI_INTELLIGENT:
+                for search_term in search_terms:
+                    try:
+                        (number_class, number_item, number_variation) = Part.parse_partial_part_number(search_term, organization, validate=False)
+                    except AttributeError:
+                        pass
+
+            # Prepare Part.primary_manufacturer_part.manufacturer_part_number query by OR'ing search terms, matched as
+            # substrings through the trigram index
+            manufacturer_part_number_trigrams = ManufacturerPart.manufacturer_part_number_trigrams()
+            organization_manufacturer_parts = ManufacturerPart.objects.filter(part__organization=organization)
+            q_primary_mpn = reduce(operator.or_, (Q(primary_manufacturer_part__in=manufacturer_part_number_trigrams.contains(organization_manufacturer_parts, term))
+                                                  for term in search_terms))
+
+            # Prepare Part.primary_manufacturer.part__manufacturer.name query by OR'ing search terms
+            manufacturer_name_trigrams = Manufacturer.name_trigrams()
+            organization_manufacturers = Manufacturer.objects.filter(organization=organization)
+            q_primary_mfg = reduce(operator.or_, (Q(primary_manufacturer_part__manufacturer__in=manufacturer_name_trigrams.contains(organization_manufacturers, term))
+                                                  for term in search_terms))
+
+            if bom_search_backend() == constants.BOM_SEARCH_BACKEND_FULL_TEXT:
+                # Synopses, descriptions, manufacturer part numbers and manufacturer names from the full text index
+                search_part_ids = search_parts(organization.id, search_terms)
+                search_rank_expression = search_rank(search_terms)
+                q_search = Q(id__in=search_part_ids if search_part_ids is not None else []) | q_primary_mpn | q_primary_mfg
+            else:
+                # Query searchable_synopsis by OR'ing search terms
+                part_synopsis_ids = PartRevision.objects.filter(reduce(operator.or_, (Q(searchable_synopsis__icontains=term) for term in search_terms))).values_list("part", flat=True)
+                q_search = Q(id__in=part_synopsis_ids) | q_primary_mpn | q_primary_mfg
+
+            if number_class and number_item and number_variation:
+                parts = parts.filter(
+                    Q(number_class__code=number_class, number_item=number_item, number_variation=number_variation) |
+                    q_search)
+            elif number_class and number_item:
+                parts = parts.filter(
+                    Q(number_class__code=number_class, number_item=number_item) |
+                    q_search)
+            else:
+                parts = parts.filter(
+                    Q(number_item__in=search_terms) |
+                    q_search)
 
         part_revs = PartRevision.objects \
             .filter(id__in=Subquery(
                 PartRevision.objects.filter(
-                    part_id__in=part_ids
+                    part_id__in=parts.values('id')
                 ).annotate(max_id=Max('id')).values("id")
             )).order_by(
                 "part__number_class__code",
@@ -226,6 +233,12 @@ def home(request):
                 "part__number_variation"
             )
 
+        if search_rank_expression is not None:
+            # Most relevant first, parts found by their part number or manufacturer alone ahead of the rest. Ranked by
+            # the database, so that only the page shown is loaded.
+            part_revs = part_revs.annotate(search_rank=search_rank_expression) \
+                .order_by(F('search_rank').asc(nulls_first=True), *part_revs.query.order_by)
+
     if 'download' in request.GET:
         response = HttpResponse(content_type='text/csv')
         response['Content-Disposition'] = 'attachment; filename="indabom_parts_search.csv"'
@@ -484,9 +497,11 @@ def bom_settings(request, tab_anchor=None):
             elif part_class_action == 'submit-part-class-enable-mouser':
                 tab_anchor = INDABOM_TAB
                 PartClass.objects.filter(id__in=part_class_action_ids).update(mouser_enabled=True)
+                invalidate_all_bom_caches()  # A bulk update sends no signals
             elif part_class_action == 'submit-part-class-disable-mouser':
                 tab_anchor = INDABOM_TAB
                 PartClass.objects.filter(id__in=part_class_action_ids).update(mouser_enabled=False)
+                invalidate_all_bom_caches()  # A bulk update sends no signals
             elif part_class_action == 'submit-part-class-delete':
                 tab_anchor = INDABOM_TAB
                 try:
@@ -545,7 +560,16 @@ def manufacturers(request):
     if query:
         title += ' - Search Results'
 
-    manufacturers = Manufacturer.objects.filter(organization=organization, name__icontains=query).annotate(manufacturerpart_count=Count('manufacturerpart')).order_by('name')
+    manufacturers = Manufacturer.objects.filter(organization=organization)
+    if query:
+        # Names containing the query, then the names most like it, such as misspellings of it
+        name_trigrams = Manufacturer.name_trigrams()
+        similarities = name_trigrams.similar(manufacturers, query)
+        matching_ids = set(name_trigrams.contains(manufacturers, query).values_list('id', flat=True))
+        manufacturers = sorted(manufacturers.filter(id__in=matching_ids | set(similarities)).annotate(manufacturerpart_count=Count('manufacturerpart')),
+                               key=lambda manufacturer: (manufacturer.id not in matching_ids, -similarities.get(manufacturer.id, 0), manufacturer.name))
+    else:
+        manufacturers = manufacturers.annotate(manufacturerpart_count=Count('manufacturerpart')).order_by('name')
 
     autocomplete_dict = {}
     for manufacturer in manufacturers:
@@ -763,21 +787,14 @@ def part_info(request, part_id, part_revision_id=None):
     cache.set(qty_cache_key, qty, timeout=None)
 
     try:
-        indented_bom = part_revision.indented(top_level_quantity=qty)
-    except (RuntimeError, RecursionError):
-        messages.error(request, "Error: infinite recursion in part relationship. Contact info@indabom.com to resolve.")
+        indented_bom, flat_bom = part_revision.explode(top_level_quantity=qty)
+    except BomCycleError as err:
+        messages.error(request, f"Error: {err}. Contact info@indabom.com to resolve.")
         indented_bom = []
-    except AttributeError as err:
-        # No part revision found, that's OK
-        indented_bom = []
-
-    try:
-        flat_bom = part_revision.flat(top_level_quantity=qty)
-    except (RuntimeError, RecursionError):
-        messages.error(request, "Error: infinite recursion in part relationship. Contact info@indabom.com to resolve.")
         flat_bom = []
     except AttributeError as err:
         # No part revision found, that's OK
+        indented_bom = []
         flat_bom = []
 
     try:
@@ -817,7 +834,7 @@ def part_export_bom(request, part_id=None, part_revision_id=None, flat=False, so
 
     response = HttpResponse(content_type='text/csv')
     filename = f'indabom_export_{part.full_part_number()}_{"flat" if flat else "indented"}'
-    response['Content-Disposition'] = f'attachment; filename="{filename}.csv'
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
 
     qty_cache_key = str(part_id) + '_qty'
     qty = cache.get(qty_cache_key, 1000)
@@ -827,8 +844,8 @@ def part_export_bom(request, part_id=None, part_revision_id=None, flat=False, so
             bom = part_revision.flat(top_level_quantity=qty)
         else:
             bom = part_revision.indented(top_level_quantity=qty)
-    except (RuntimeError, RecursionError):
-        messages.error(request, "Error: infinite recursion in part relationship. Contact info@indabom.com to resolve.")
+    except BomCycleError as err:
+        messages.error(request, f"Error: {err}. Contact info@indabom.com to resolve.")
         bom = []
     except AttributeError as err:
         messages.error(request, err)
@@ -841,21 +858,25 @@ def part_export_bom(request, part_id=None, part_revision_id=None, flat=False, so
 
     csv_headers_raw = csv_headers.get_default_all()
     csv_rows = []
+    if bom and (sourcing or sourcing_detailed):
+        seller_parts = bom.seller_parts()
+        manufacturer_parts = bom.manufacturer_parts_by_part()
+    exchange_rates = bom.exchange_rates() if bom else None
     for _, item in bom.parts.items():
         mapped_row = {}
-        raw_row = {k: smart_str(v) for k, v in item.as_dict_for_export().items()}
+        raw_row = {k: smart_str(v) for k, v in item.as_dict_for_export(exchange_rates=exchange_rates).items()}
         for kx, vx in raw_row.items():
             if csv_headers.get_default(kx) is None: print ("NONE", kx)
             mapped_row.update({csv_headers.get_default(kx): vx})
 
         if sourcing_detailed:
-            for idx, sp in enumerate(item.seller_parts_for_export()):
+            for idx, sp in enumerate(item.seller_parts_for_export(seller_parts.get(item.part.id, []), exchange_rates=exchange_rates)):
                 if f'{ManufacturerPartCSVHeaders.all_headers_defns[0]}_{idx + 1}' not in csv_headers_raw:
                     csv_headers_raw.extend([f'{h}_{idx + 1}' for h in ManufacturerPartCSVHeaders.all_headers_defns])
                     csv_headers_raw.extend([f'{h}_{idx + 1}' for h in SellerPartCSVHeaders.all_headers_defns])
                 mapped_row.update({f'{k}_{idx + 1}': smart_str(v) for k, v in sp.items()})
         elif sourcing:
-            for idx, mp in enumerate(item.manufacturer_parts_for_export()):
+            for idx, mp in enumerate(item.manufacturer_parts_for_export(manufacturer_parts.get(item.part.id, []), seller_parts.get(item.part.id, []))):
                 if f'{ManufacturerPartCSVHeaders.all_headers_defns[0]}_{idx + 1}' not in csv_headers_raw:
                     csv_headers_raw.extend([f'{h}_{idx + 1}' for h in ManufacturerPartCSVHeaders.all_headers_defns])
                 mapped_row.update({f'{k}_{idx + 1}': smart_str(v) for k, v in mp.items()})
@@ -868,6 +889,46 @@ def part_export_bom(request, part_id=None, part_revision_id=None, flat=False, so
 
     return response
 
+
+@login_required(login_url=BOM_LOGIN_URL)
+def part_export_quantity_sweep(request, part_revision_id):
+    user = request.user
+    profile = user.bom_profile()
+    organization = profile.organization
+
+    part_revision = get_object_or_404(PartRevision, pk=part_revision_id)
+    part = part_revision.part
+
+    if part.organization != organization:
+        messages.error(request, "Cant export a part that is not yours!")
+        return HttpResponseRedirect(request.META.get('HTTP_REFERER'), '/')
+
+    try:
+        quantities = listify_quantities(request.GET.get('quantities')) or constants.QUANTITY_SWEEP_DEFAULT
+    except ValueError:
+        messages.error(request, "Quantities must be a comma separated list of positive whole numbers.")
+        return HttpResponseRedirect(request.META.get('HTTP_REFERER'), '/')
+    if len(quantities) > constants.QUANTITY_SWEEP_MAX:
+        messages.error(request, f"At most {constants.QUANTITY_SWEEP_MAX} quantities can be swept at once.")
+        return HttpResponseRedirect(request.META.get('HTTP_REFERER'), '/')
+
+    try:
+        sweep = part_revision.flat(top_level_quantity=1).quantity_sweep(quantities)
+    except BomCycleError as err:
+        messages.error(request, f"Error: {err}. Contact info@indabom.com to resolve.")
+        return HttpResponseRedirect(request.META.get('HTTP_REFERER'), '/')
+
+    response = HttpResponse(content_type='text/csv')
+    filename = f'indabom_export_{part.full_part_number()}_quantity_sweep'
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+
+    csv_headers = BOMQuantitySweepCSVHeaders()
+    writer = csv.DictWriter(response, fieldnames=csv_headers.get_default_all())
+    writer.writeheader()
+    writer.writerows([{csv_headers.get_default(k): smart_str(v) for k, v in row.items()} for row in sweep])
+
+    return response
+
 # @login_required
 # def part_export_bom_flat(request, part_revision_id):
 #     user = request.user
@@ -953,6 +1014,10 @@ def part_upload_bom(request, part_id):
         messages.error(request, "No part found with given part_id {}.".format(part_id))
         return HttpResponseRedirect(request.META.get('HTTP_REFERER'), '/')
 
+    parent_part_revision = parent_part.latest()
+    if parent_part_revision is not None and released_bom_error(request, parent_part_revision):
+        return HttpResponseRedirect(request.META.get('HTTP_REFERER', reverse('bom:home')))
+
     if request.method == 'POST' and request.FILES['file'] is not None:
         bom_csv_form = BOMCSVForm(request.POST, request.FILES, parent_part=parent_part, organization=organization)
         if bom_csv_form.is_valid():
@@ -1152,6 +1217,14 @@ def part_edit(request, part_id):
     return TemplateResponse(request, 'bom/bom-form.html', locals())
 
 
+def released_bom_error(request, part_revision):
+    # The BOM of a released revision is frozen in its snapshot, so it can't be changed until it is reverted to working
+    if part_revision.configuration != 'R':
+        return False
+    messages.error(request, "Can't change the BOM of released revision {}, revert it to working or create a new revision first.".format(part_revision))
+    return True
+
+
 @login_required(login_url=BOM_LOGIN_URL)
 def manage_bom(request, part_id, part_revision_id):
     user = request.user
@@ -1168,7 +1241,9 @@ def manage_bom(request, part_id, part_revision_id):
         messages.error(request, "Cant access a part that is not yours!")
         return HttpResponseRedirect(request.META.get('HTTP_REFERER'), '/')
 
-    add_subpart_form = AddSubpartForm(initial={'count': 1, }, organization=organization, part_id=part_id)
+    # Released BOMs are shown without the controls to change them
+    editable = part_revision.configuration != 'R'
+    add_subpart_form = AddSubpartForm(initial={'count': 1, }, organization=organization, part_id=part_id, part_revision=part_revision)
     upload_subparts_csv_form = FileForm()
 
     qty_cache_key = str(part_id) + '_qty'
@@ -1176,8 +1251,8 @@ def manage_bom(request, part_id, part_revision_id):
 
     try:
         indented_bom = part_revision.indented(top_level_quantity=qty)
-    except (RuntimeError, RecursionError):
-        messages.error(request, "Error: infinite recursion in part relationship. Contact info@indabom.com to resolve.")
+    except BomCycleError as err:
+        messages.error(request, f"Error: {err}. Contact info@indabom.com to resolve.")
         indented_bom = []
     except AttributeError as err:
         messages.error(request, err)
@@ -1211,8 +1286,8 @@ def add_subpart(request, part_id, part_revision_id):
 
     part_revision = get_object_or_404(PartRevision, pk=part_revision_id)
 
-    if request.method == 'POST':
-        add_subpart_form = AddSubpartForm(request.POST, organization=organization, part_id=part_id)
+    if request.method == 'POST' and not released_bom_error(request, part_revision):
+        add_subpart_form = AddSubpartForm(request.POST, organization=organization, part_id=part_id, part_revision=part_revision)
         if add_subpart_form.is_valid():
             subpart_part = add_subpart_form.subpart_part
             reference = add_subpart_form.cleaned_data['reference']
@@ -1256,7 +1331,8 @@ def add_subpart(request, part_id, part_revision_id):
 @organization_admin
 def remove_subpart(request, part_id, part_revision_id, subpart_id):
     subpart = get_object_or_404(Subpart, pk=subpart_id)
-    subpart.delete()
+    if not released_bom_error(request, get_object_or_404(PartRevision, pk=part_revision_id)):
+        subpart.delete()
     return HttpResponseRedirect(
         reverse('bom:part-manage-bom', kwargs={'part_id': part_id, 'part_revision_id': part_revision_id}))
 
@@ -1294,6 +1370,8 @@ def edit_subpart(request, part_id, part_revision_id, subpart_id):
 
     part = get_object_or_404(Part, pk=part_id)
     subpart = get_object_or_404(Subpart, pk=subpart_id)
+    if released_bom_error(request, get_object_or_404(PartRevision, pk=part_revision_id)):
+        return HttpResponseRedirect(reverse('bom:part-manage-bom', kwargs={'part_id': part_id, 'part_revision_id': part_revision_id}))
     title = "Edit Subpart"
     h1 = "{} {}".format(subpart.part_revision.part.full_part_number(), subpart.part_revision.synopsis())
 
@@ -1317,7 +1395,8 @@ def edit_subpart(request, part_id, part_revision_id, subpart_id):
 @organization_admin
 def remove_all_subparts(request, part_id, part_revision_id):
     part_revision = get_object_or_404(PartRevision, pk=part_revision_id)
-    part_revision.assembly.subparts.all().delete()
+    if not released_bom_error(request, part_revision):
+        part_revision.assembly.subparts.all().delete()
     return HttpResponseRedirect(reverse('bom:part-manage-bom', kwargs={'part_id': part_id, 'part_revision_id': part_revision_id}))
 
 
@@ -1498,6 +1577,40 @@ def part_revision_release(request, part_id, part_revision_id):
     return TemplateResponse(request, 'bom/part-revision-release.html', locals())
 
 
+@login_required(login_url=BOM_LOGIN_URL)
+def part_revision_compare(request, part_id, part_revision_id):
+    user = request.user
+    profile = user.bom_profile()
+    organization = profile.organization
+
+    part = get_object_or_404(Part, pk=part_id)
+    part_revision = get_object_or_404(PartRevision, pk=part_revision_id)
+
+    if part.organization != organization or part_revision.part_id != part.id:
+        messages.error(request, "Can't compare a part that is not yours!")
+        return HttpResponseRedirect(reverse('bom:home'))
+
+    revisions = part.revisions().exclude(id=part_revision.id).order_by('-id')
+    against_id = request.GET.get('against')
+    if against_id:
+        against = PartRevision.objects.filter(id=against_id, part__organization=organization).select_related('part').first()
+        if against is None:
+            messages.error(request, "Can't compare against a part revision that is not yours!")
+            return HttpResponseRedirect(reverse('bom:part-revision-compare', kwargs={'part_id': part.id, 'part_revision_id': part_revision.id}))
+    else:
+        against = revisions.filter(id__lt=part_revision.id).first() or revisions.first()
+
+    title = 'Compare {} Rev {}'.format(part.full_part_number(), part_revision.revision)
+    diff = []
+    if against is not None:
+        try:
+            diff = bom_diff(against, part_revision)
+        except BomCycleError as err:
+            messages.error(request, f"Error: {err}. Contact info@indabom.com to resolve.")
+
+    return TemplateResponse(request, 'bom/part-revision-compare.html', locals())
+
+
 @login_required(login_url=BOM_LOGIN_URL)
 def part_revision_revert(request, part_id, part_revision_id):
     user = request.user
@@ -1536,27 +1649,28 @@ def part_revision_new(request, part_id):
             new_part_revision = part_revision_new_form.save()
 
             revisions_to_roll = request.POST.getlist('roll')
-            # TODO: could optimize this, but probably shouldn't get too crazy so may be fine...
+            # Save each subpart, rather than update() the queryset, so the BOM closure follows the roll
             for r_id in revisions_to_roll:
-                subparts = PartRevision.objects.get(id=r_id).assembly.subparts \
+                roll_revision = PartRevision.objects.get(id=r_id)
+                if roll_revision.would_create_cycle(new_part_revision):
+                    messages.error(request, f"Infinite recursion! Can't roll {roll_revision} to {new_part_revision}, it is used in {new_part_revision}.")
+                    continue
+                subparts = roll_revision.assembly.subparts \
                     .filter(part_revision__in=all_part_revisions)
-                subparts.update(part_revision=new_part_revision)
+                for subpart in subparts:
+                    subpart.part_revision = new_part_revision
+                    subpart.save()
 
             if part_revision_new_form.cleaned_data['copy_assembly']:
-                old_subparts = latest_revision.assembly.subparts.all() if latest_revision.assembly is not None else None
-                new_assembly = latest_revision.assembly if latest_revision.assembly is not None else Assembly()
-                new_assembly.pk = None
-                new_assembly.save()
-
+                # A copy rather than the same assembly: BOM edits change a part revision's assembly in place, a shared
+                # one would change the BOM of the latest revision too. Giving the copy to the new revision links it into
+                # the BOM closure in one pass.
+                old_assembly = Assembly.objects.filter(id=latest_revision.assembly_id).first()
+                new_assembly = old_assembly.copy() if old_assembly is not None else Assembly.objects.create()
                 part_revision_new_form.cleaned_data['assembly'] = new_assembly
 
                 new_part_revision.assembly = new_assembly
                 new_part_revision.save()
-                for sp in old_subparts:
-                    new_sp = sp
-                    new_sp.pk = None
-                    new_sp.save()
-                    AssemblySubparts.objects.create(assembly=new_assembly, subpart=new_sp)
             return HttpResponseRedirect(reverse('bom:part-info', kwargs={'part_id': part_id}))
 
     else: